@@ -0,0 +1,65 @@
+"""
+Time finding the commands in a comment with a pasted build log, with a
+regex search per command (as ``pr_comment`` and ``pr_detailed_comment``
+used to do) against the single pass of ``parse_commands``.
+
+    python benchmarks/bench_command_parser.py --log-lines 50000
+"""
+import argparse
+import re
+import timeit
+
+from nwb_extensions_webservices.commands import parse_commands, pre
+
+COMMAND_PREFIX = re.compile(pre, re.I)
+RERENDER_MSG = re.compile(pre + "(please )?re-?render", re.I)
+LINT_MSG = re.compile(pre + "(please )?(re-?)?lint", re.I)
+UPDATE_CIRCLECI_KEY_MSG = re.compile(pre + "(please )?(update|refresh) (the )?circle", re.I)
+
+
+def per_command(comment):
+    # The searches made for a feedstock PR comment before.
+    if not COMMAND_PREFIX.search(comment):
+        return set()
+    commands = set()
+    if UPDATE_CIRCLECI_KEY_MSG.search(comment):
+        commands.add('update_circle')
+    if not any(command.search(comment) for command in [LINT_MSG, RERENDER_MSG]):
+        return commands
+    if LINT_MSG.search(comment):
+        commands.add('lint')
+    if RERENDER_MSG.search(comment):
+        commands.add('rerender')
+    return commands
+
+
+def single_pass(comment):
+    return {command.name for command in parse_commands(comment)}
+
+
+def make_comment(log_lines):
+    # Someone asks for a rerender at the end of a failed build log, mentioning the bot on the way.
+    log = ''.join('[{:06d}] conda-build: compiling extension @ step {} ... ok\n'.format(i, i % 7)
+                  for i in range(log_lines))
+    return ('The build fails, cc @nwb-extensions-admin\n```\n' + log + '```\n'
+            '@nwb-extensions-admin, please rerender')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--log-lines', type=int, default=20000)
+    parser.add_argument('--number', type=int, default=20)
+    args = parser.parse_args()
+
+    comment = make_comment(args.log_lines)
+    assert per_command(comment) == single_pass(comment) == {'rerender'}
+    results = {}
+    for name, func in [('per command', per_command), ('single pass', single_pass)]:
+        results[name] = timeit.timeit(lambda: func(comment), number=args.number) / args.number
+        print('{:12} {:.2f}ms'.format(name, results[name] * 1000))
+    print('{:.1f} kB comment, single pass was {:.1f}x faster.'.format(
+        len(comment) / 1024, results['per command'] / results['single pass']))
+
+
+if __name__ == '__main__':
+    main()
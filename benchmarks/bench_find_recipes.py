@@ -0,0 +1,66 @@
+"""
+Compare recipe discovery on a checkout (``find_recipes``) against listing the
+commit tree (``find_recipes_in_commit``) on a synthetic repository.
+
+    python benchmarks/bench_find_recipes.py --extensions 5000
+"""
+import argparse
+import os
+import time
+
+from git import Repo
+
+from nwb_extensions_webservices.linting import find_recipes, find_recipes_in_commit
+from nwb_extensions_webservices.utils import tmp_directory
+
+
+def make_repo(path, n_extensions):
+    # Two commits, so that base/merge style comparisons need a checkout in between.
+    repo = Repo.init(path)
+    for i in range(n_extensions):
+        ext_dir = os.path.join(path, 'extensions', 'ndx-ext-{:05d}'.format(i))
+        os.makedirs(os.path.join(ext_dir, 'spec'))
+        with open(os.path.join(ext_dir, 'ndx-meta.yaml'), 'w') as fh:
+            fh.write('name: ndx-ext-{:05d}\n'.format(i))
+        with open(os.path.join(ext_dir, 'spec', 'namespace.yaml'), 'w') as fh:
+            fh.write('namespaces: []\n')
+    repo.git.add('-A')
+    base = repo.index.commit('Add extensions')
+
+    ext_dir = os.path.join(path, 'extensions', 'ndx-new')
+    os.makedirs(ext_dir)
+    with open(os.path.join(ext_dir, 'ndx-meta.yaml'), 'w') as fh:
+        fh.write('name: ndx-new\n')
+    repo.git.add('-A')
+    head = repo.index.commit('Add one more extension')
+    return repo, base, head
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--extensions', type=int, default=2000)
+    args = parser.parse_args()
+
+    with tmp_directory() as tmp_dir:
+        print('Creating a repository with {} extensions...'.format(args.extensions))
+        repo, base, head = make_repo(tmp_dir, args.extensions)
+
+        start = time.time()
+        repo.git.checkout(base.hexsha, force=True)
+        base_recipes = find_recipes(tmp_dir)
+        repo.git.checkout(head.hexsha, force=True)
+        recipes = find_recipes(tmp_dir)
+        walk = time.time() - start
+        new_walk = set(recipes) - set(base_recipes)
+
+        start = time.time()
+        new_tree = set(find_recipes_in_commit(repo, head)) - set(find_recipes_in_commit(repo, base))
+        tree = time.time() - start
+
+        assert [os.path.relpath(r, tmp_dir) for r in new_walk] == list(new_tree)
+        print('checkout + os.walk: {:.3f}s'.format(walk))
+        print('tree listing:       {:.3f}s ({:.1f}x faster)'.format(tree, walk / tree))
+
+
+if __name__ == '__main__':
+    main()
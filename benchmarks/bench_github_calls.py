@@ -0,0 +1,152 @@
+"""
+Count the GitHub requests made to lint a PR and post the result, through the
+REST API and through GraphQL, against recorded responses served with a fixed
+latency instead of api.github.com.
+
+    python benchmarks/bench_github_calls.py --latency 0.1 --comments 250
+"""
+import argparse
+import json
+import os
+import re
+import time
+
+try:
+    import unittest.mock as mock
+except ImportError:
+    import mock
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+os.environ.setdefault('GH_TOKEN', 'recorded')
+
+from nwb_extensions_webservices import github_client, github_graphql, linting  # noqa: E402
+from nwb_extensions_webservices.store import SQLiteCache  # noqa: E402
+from nwb_extensions_webservices.utils import tmp_directory  # noqa: E402
+
+API = 'https://api.github.com'
+REPO = API + '/repos/nwb-extensions/staged-extensions'
+SHA = 'a' * 40
+LOGIN = 'nwb-extensions-linter'
+
+
+def user(login):
+    return {'login': login, 'id': 1, 'url': API + '/users/' + login}
+
+
+def comment(comment_id, body, login):
+    return {'id': comment_id, 'node_id': 'IC_{}'.format(comment_id), 'body': body, 'user': user(login),
+            'url': REPO + '/issues/comments/{}'.format(comment_id),
+            'html_url': 'https://github.com/nwb-extensions/staged-extensions/pull/1#issuecomment-{}'.format(
+                comment_id)}
+
+
+class RecordedGitHub(object):
+    """Responses recorded from the REST and GraphQL APIs for one open, mergeable PR."""
+    def __init__(self, n_comments, latency):
+        self.latency = latency
+        self.requests = []
+        # Our lint comment is at the start of the conversation, everything since is from people.
+        self.comments = [comment(1, 'Hi! This is the friendly automated nwb-extensions-linting service.', LOGIN)]
+        self.comments += [comment(i, 'Looks good to me.', 'someone') for i in range(2, n_comments + 1)]
+        self.rest = {
+            ('GET', '/repos/nwb-extensions/staged-extensions'): {
+                'name': 'staged-extensions', 'full_name': 'nwb-extensions/staged-extensions', 'url': REPO,
+                'clone_url': 'https://github.com/nwb-extensions/staged-extensions.git'},
+            ('GET', '/repos/nwb-extensions/staged-extensions/pulls/1'): {
+                'number': 1, 'state': 'open', 'mergeable': True, 'url': REPO + '/pulls/1',
+                'head': {'sha': SHA}},
+            ('GET', '/repos/nwb-extensions/staged-extensions/issues/1'): {
+                'number': 1, 'url': REPO + '/issues/1'},
+            ('GET', '/user'): user(LOGIN),
+            ('PATCH', '/repos/nwb-extensions/staged-extensions/issues/comments/1'): comment(1, '', LOGIN),
+            ('GET', '/repos/nwb-extensions/staged-extensions/commits/' + SHA): {
+                'sha': SHA, 'url': REPO + '/commits/' + SHA},
+            ('POST', '/repos/nwb-extensions/staged-extensions/statuses/' + SHA): {'state': 'success'},
+        }
+
+    def graphql(self, body):
+        query = body['query']
+        if 'addComment' in query:
+            new = comment(len(self.comments) + 1, body['variables']['input']['body'], LOGIN)
+            self.comments.append(new)
+            return {'data': {'addComment': {'commentEdge': {'node': {
+                'id': new['node_id'], 'databaseId': new['id'], 'url': new['html_url']}}}}}
+        if 'updateIssueComment' in query:
+            return {'data': {'updateIssueComment': {'issueComment': {'id': body['variables']['input']['id']}}}}
+        nodes = [{'id': c['node_id'], 'databaseId': c['id'], 'url': c['html_url'], 'body': c['body'],
+                  'author': {'login': c['user']['login']}} for c in self.comments[-100:]]
+        return {'data': {'viewer': {'login': LOGIN}, 'repository': {'pullRequest': {
+            'id': 'PR_1', 'state': 'OPEN', 'mergeable': 'MERGEABLE', 'headRefOid': SHA, 'baseRefOid': 'b' * 40,
+            'comments': {'nodes': nodes}}}}}
+
+    def comments_page(self, query):
+        page = int(re.search(r'page=(\d+)', query).group(1)) if 'page=' in query else 1
+        return self.comments[(page - 1) * 30:page * 30]
+
+    def respond(self, verb, url, data=None):
+        time.sleep(self.latency)
+        path, _, query = url.split(':443', 1)[1].partition('?')
+        self.requests.append((verb, path))
+        headers = CaseInsensitiveDict({'X-RateLimit-Remaining': '4000', 'X-RateLimit-Limit': '5000',
+                                       'X-RateLimit-Reset': str(int(time.time()) + 3600)})
+        if path == '/graphql':
+            body = self.graphql(json.loads(data))
+        elif path.endswith('/issues/1/comments'):
+            body = self.comments_page(query)
+            page = int(re.search(r'page=(\d+)', query).group(1)) if 'page=' in query else 1
+            if page * 30 < len(self.comments):
+                headers['Link'] = '<{}/issues/1/comments?page={}>; rel="next"'.format(REPO, page + 1)
+        else:
+            body = self.rest[(verb, path)]
+        return mock.MagicMock(status_code=200, headers=headers, text=json.dumps(body))
+
+    def patch(self):
+        def method(verb):
+            return lambda session, url, data=None, **kwargs: self.respond(verb, url, data)
+        return mock.patch.multiple(requests.Session, get=method('GET'), post=method('POST'),
+                                   patch=method('PATCH'))
+
+
+def lint_event(use_graphql):
+    # What webapp.lint_pr does around the actual linting: wait for the PR, comment and set the status.
+    with mock.patch.object(github_graphql, 'USE_GRAPHQL', use_graphql):
+        if use_graphql:
+            remote_repo = github_graphql.Repository('nwb-extensions', 'staged-extensions')
+        else:
+            remote_repo = github_client.get_repo('nwb-extensions', 'staged-extensions')
+        linting.wait_for_mergeable(remote_repo, 'nwb-extensions', 'staged-extensions', 1)
+        msg = linting.comment_on_pr('nwb-extensions', 'staged-extensions', 1,
+                                    'Hi! This is the friendly automated nwb-extensions-linting service.\n\n'
+                                    'All extensions are excellent.',
+                                    search='linting service')
+        linting.set_pr_status('nwb-extensions', 'staged-extensions', {'status': 'good', 'sha': SHA},
+                              target_url=msg.html_url)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds per request')
+    parser.add_argument('--comments', type=int, default=100, help='comments on the PR')
+    args = parser.parse_args()
+
+    results = {}
+    for name, use_graphql in [('REST', False), ('GraphQL', True)]:
+        github_client.reset()
+        recorded = RecordedGitHub(args.comments, args.latency)
+        with tmp_directory() as tmp_dir, recorded.patch(), \
+                mock.patch.object(linting, 'comment_index', SQLiteCache(os.path.join(tmp_dir, 'index.sqlite'))):
+            start = time.time()
+            lint_event(use_graphql)
+            results[name] = (len(recorded.requests), time.time() - start)
+        print('{:8} {:3d} requests in {:.2f}s: {}'.format(
+            name, results[name][0], results[name][1],
+            ', '.join('{} {}'.format(verb, path.replace('/repos/nwb-extensions/staged-extensions', ''))
+                      for verb, path in recorded.requests)))
+    print('GraphQL made {:.1f}x fewer requests and was {:.1f}x faster.'.format(
+        results['REST'][0] / results['GraphQL'][0], results['REST'][1] / results['GraphQL'][1]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""
+Time decoding what the webhook routes need from large push and pull_request
+payloads (including the push to a branch that the teams route turns down),
+against decoding the whole payload.
+
+    python benchmarks/bench_webhook_routing.py --commits 2000
+"""
+import argparse
+import json
+import timeit
+
+import tornado.escape
+
+from nwb_extensions_webservices.routing import Route, route_payload
+
+
+def repository():
+    repo = {'id': 1, 'name': 'staged-extensions', 'full_name': 'nwb-extensions/staged-extensions',
+            'owner': {'login': 'nwb-extensions', 'id': 2}}
+    repo.update(('{}_url'.format(i), 'https://api.github.com/repos/nwb-extensions/staged-extensions/{}'.format(i))
+                for i in range(40))
+    return repo
+
+
+def commit(i):
+    return {'id': '{:040x}'.format(i), 'message': 'Change {}\n\n{}'.format(i, 'details ' * 50),
+            'author': {'name': 'someone', 'email': 'someone@example.com'},
+            'added': ['recipes/ndx-{}/meta.yaml'.format(i)], 'removed': [], 'modified': ['README.md'] * 5}
+
+
+def push_payload(n_commits, ref='refs/heads/master'):
+    # In the order GitHub sends the members.
+    commits = [commit(i) for i in range(n_commits)]
+    return json.dumps({'ref': ref, 'before': '0' * 40, 'after': 'f' * 40,
+                       'repository': repository(), 'pusher': {'name': 'someone'},
+                       'sender': {'login': 'someone'}, 'created': False, 'deleted': False, 'forced': False,
+                       'compare': 'https://github.com/compare', 'commits': commits,
+                       'head_commit': commits[-1]}).encode('utf-8')
+
+
+def pull_request_payload(n_commits):
+    return json.dumps({'action': 'synchronize', 'number': 1,
+                       'pull_request': {'number': 1, 'state': 'open', 'head': {'sha': 'f' * 40},
+                                        'base': {'ref': 'master', 'repo': repository()},
+                                        'body': 'details ' * 20 * n_commits},
+                       'before': '0' * 40, 'after': 'f' * 40,
+                       'repository': repository(), 'sender': {'login': 'someone'}}).encode('utf-8')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--commits', type=int, default=1000, help='commits in the push')
+    parser.add_argument('--number', type=int, default=50, help='decodes timed')
+    args = parser.parse_args()
+
+    # The routes of webapp.HOOKS that decode the most, with the filters that matter here.
+    to_master = [lambda payload: payload['ref'] == 'refs/heads/master']
+    feedstocks = Route(['push'], ['ref', 'repository'], to_master, None)
+    teams = Route(['push'], ['ref', 'repository'], to_master, None, ['head_commit'])
+    linting = Route(['pull_request'], ['repository', 'pull_request'], [], None)
+    branch_push = push_payload(args.commits, ref='refs/heads/feature')
+    for name, body, route in [('feedstocks', push_payload(args.commits), feedstocks),
+                              ('teams', push_payload(args.commits), teams),
+                              ('teams', branch_push, teams),
+                              ('linting', pull_request_payload(args.commits), linting)]:
+        full = timeit.timeit(lambda: tornado.escape.json_decode(body), number=args.number) / args.number
+        partial = timeit.timeit(lambda: route_payload(route, body), number=args.number) / args.number
+        members = '+'.join(route.members)
+        if route_payload(route, body) is not None:
+            members = '+'.join(list(route.members) + list(route.job_members))
+        print('{:10} {:6.0f} kB {:24}: full decode {:.2f}ms, {} only {:.3f}ms ({:.1f}x faster)'.format(
+            name, len(body) / 1024, json.loads(body).get('ref', 'pull_request'), full * 1000, members,
+            partial * 1000, full / partial))
+
+
+if __name__ == '__main__':
+    main()
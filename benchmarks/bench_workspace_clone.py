@@ -0,0 +1,76 @@
+"""
+Compare a full clone against a blobless partial clone with a sparse checkout
+of the extensions being linted, on a synthetic repository served over
+``file://`` (so that git negotiates a pack like it does with GitHub).
+
+    python benchmarks/bench_workspace_clone.py --extensions 500 --revisions 20
+"""
+import argparse
+import os
+import time
+
+from git import Repo
+
+from nwb_extensions_webservices.repo_cache import checkout_paths, clone_workspace, dir_size
+from nwb_extensions_webservices.utils import tmp_directory
+
+
+def write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as fh:
+        fh.write(content)
+
+
+def make_repo(path, n_extensions, n_revisions, file_kb):
+    # Every extension has some example data, and each revision rewrites a tenth of it.
+    repo = Repo.init(path)
+    for revision in range(n_revisions):
+        for i in range(revision % 10, n_extensions, 10 if revision else 1):
+            ext_dir = os.path.join(path, 'extensions', 'ndx-ext-{:05d}'.format(i))
+            write(os.path.join(ext_dir, 'ndx-meta.yaml'), 'name: ndx-ext-{:05d}\n'.format(i).encode())
+            write(os.path.join(ext_dir, 'data', 'example.nwb'), os.urandom(file_kb * 1024))
+        repo.git.add('-A')
+        repo.index.commit('Revision {}'.format(revision))
+    # What GitHub allows, and a plain git daemon doesn't by default.
+    repo.git.config('uploadpack.allowFilter', 'true')
+    repo.git.config('uploadpack.allowAnySHA1InWant', 'true')
+    return repo
+
+
+def workspace(url, to_path, paths, mode):
+    start = time.time()
+    if mode == 'full':
+        repo = Repo.clone_from(url, to_path)
+    else:
+        repo = clone_workspace(url, to_path, mode=mode)
+        checkout_paths(repo, paths, mode=mode)
+    elapsed = time.time() - start
+    assert all(os.path.exists(os.path.join(to_path, path, 'ndx-meta.yaml')) for path in paths)
+    return elapsed, dir_size(os.path.join(to_path, '.git', 'objects'))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--extensions', type=int, default=300)
+    parser.add_argument('--revisions', type=int, default=10)
+    parser.add_argument('--file-kb', type=int, default=20)
+    parser.add_argument('--lint', type=int, default=2, help='extensions checked out for linting')
+    args = parser.parse_args()
+
+    with tmp_directory() as tmp_dir:
+        print('Creating a repository with {} extensions and {} revisions...'.format(
+            args.extensions, args.revisions))
+        upstream = make_repo(os.path.join(tmp_dir, 'upstream'), args.extensions, args.revisions, args.file_kb)
+        url = 'file://' + upstream.working_tree_dir
+        paths = ['extensions/ndx-ext-{:05d}'.format(i) for i in range(args.lint)]
+
+        results = {}
+        for mode in ['full', 'partial']:
+            results[mode] = workspace(url, os.path.join(tmp_dir, mode), paths, mode)
+            print('{:8} {:6.2f}s {:8.1f} MB transferred'.format(mode, results[mode][0], results[mode][1] / 2 ** 20))
+        print('partial + sparse was {:.1f}x faster and transferred {:.1f}x less.'.format(
+            results['full'][0] / results['partial'][0], results['full'][1] / results['partial'][1]))
+
+
+if __name__ == '__main__':
+    main()
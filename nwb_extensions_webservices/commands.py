@@ -1,30 +1,77 @@
-from git import GitCommandError, Repo
-import github
+from collections import namedtuple
+from git import GitCommandError
 import os
 import re
-import subprocess
+from .repo_cache import Workspace, clone_from
+from .github_client import get_github, get_repo, get_login, read_token
 from .utils import tmp_directory
 from .linting import compute_lint_message, comment_on_pr, set_pr_status
 from .update_teams import update_team
 from .circle_ci import update_circle
+from .metrics import stage
+from .store import SQLiteCache, cache_path
+from .subprocesses import rerender_executor
 import textwrap
 
 
 pre = r"@nwb-extensions-(admin|linter)\s*[,:]?\s*"
-COMMAND_PREFIX = re.compile(pre, re.I)
-RERENDER_MSG = re.compile(pre + "(please )?re-?render", re.I)
-LINT_MSG = re.compile(pre + "(please )?(re-?)?lint", re.I)
-UPDATE_TEAM_MSG = re.compile(pre + "(please )?(update|refresh) (the )?team", re.I)
-UPDATE_CIRCLECI_KEY_MSG = re.compile(pre + "(please )?(update|refresh) (the )?circle", re.I)
+COMMANDS = [
+    ('rerender', "(please )?re-?render"),
+    ('lint', "(please )?(re-?)?lint"),
+    ('update_team', "(please )?(update|refresh) (the )?team"),
+    ('update_circle', "(please )?(update|refresh) (the )?circle"),
+]
+# All commands in one pattern, so that a comment (which can be a pasted log) is only scanned once.
+_command_alternatives = '|'.join('(?P<{}>{})'.format(name, command) for name, command in COMMANDS)
+COMMAND_MSG = re.compile(pre + "(?:{})".format(_command_alternatives), re.I)
+
+Command = namedtuple('Command', ['name', 'start', 'end'])
+
+
+def parse_commands(text):
+    """The commands addressed to us in ``text``, in order."""
+    return [Command(match.lastgroup, match.start(), match.end()) for match in COMMAND_MSG.finditer(text)]
+
+
+# The heads of PRs, from the pull_request webhooks we get, so that a command in an issue
+# comment on a PR doesn't have to look the PR up first.
+pull_requests = SQLiteCache(cache_path('pull_requests.sqlite'),
+                            max_entries=int(os.environ.get('PR_CACHE_SIZE', 10000)),
+                            ttl=int(os.environ.get('PR_CACHE_TTL', 30 * 24 * 60 * 60)))
+
+
+def _pull_request_key(org_name, repo_name, pr_num):
+    return '{}/{}#{}'.format(org_name, repo_name, pr_num)
+
+
+def pull_request_head(pull_request):
+    """The head of a PR given the ``pull_request`` of a webhook payload, None once its fork has been deleted."""
+    head = pull_request.get('head') or {}
+    if not head.get('repo'):
+        return None
+    return {'owner': head['user']['login'], 'repo': head['repo']['name'], 'ref': head['ref'], 'sha': head['sha']}
+
+
+def remember_pull_request(org_name, repo_name, pr_num, head):
+    # Run as a job, the webhook handlers only take the head out of the payload.
+    pull_requests.set(_pull_request_key(org_name, repo_name, pr_num), head)
+
+
+def get_pull_request_head(org_name, repo_name, pr_num):
+    head = pull_requests.get(_pull_request_key(org_name, repo_name, pr_num))
+    if head is None:
+        # We haven't seen a webhook for it (recently), so ask GitHub.
+        pr = get_repo(org_name, repo_name, token=read_token()).get_pull(int(pr_num))
+        head = {'owner': pr.head.user.login, 'repo': pr.head.repo.name, 'ref': pr.head.ref, 'sha': pr.head.sha}
+        pull_requests.set(_pull_request_key(org_name, repo_name, pr_num), head)
+    return head
 
 
 def pr_comment(org_name, repo_name, issue_num, comment):
-    if not COMMAND_PREFIX.search(comment):
+    if not parse_commands(comment):
         return
-    gh = github.Github(os.environ['GH_TOKEN'])
-    repo = gh.get_repo("{}/{}".format(org_name, repo_name))
-    pr = repo.get_pull(int(issue_num))
-    pr_detailed_comment(org_name, repo_name, pr.head.user.login, pr.head.repo.name, pr.head.ref, issue_num, comment)
+    head = get_pull_request_head(org_name, repo_name, issue_num)
+    pr_detailed_comment(org_name, repo_name, head['owner'], head['repo'], head['ref'], issue_num, comment)
 
 
 def pr_detailed_comment(org_name, repo_name, pr_owner, pr_repo, pr_branch, pr_num, comment):
@@ -32,11 +79,12 @@ def pr_detailed_comment(org_name, repo_name, pr_owner, pr_repo, pr_branch, pr_nu
     if not (repo_name.endswith("-feedstock") or is_staged_recipes):
         return
 
-    if not is_staged_recipes and UPDATE_CIRCLECI_KEY_MSG.search(comment):
+    commands = {command.name for command in parse_commands(comment)}
+
+    if not is_staged_recipes and 'update_circle' in commands:
         update_circle(org_name, repo_name)
 
-        gh = github.Github(os.environ['GH_TOKEN'])
-        repo = gh.get_repo("{}/{}".format(org_name, repo_name))
+        repo = get_repo(org_name, repo_name)
         pull = repo.get_pull(int(pr_num))
         message = textwrap.dedent("""
                 Hi! This is the friendly automated nwb-extensions-webservice.
@@ -45,11 +93,11 @@ def pr_detailed_comment(org_name, repo_name, pr_owner, pr_repo, pr_branch, pr_nu
                 """)
         pull.create_issue_comment(message)
 
-    pr_commands = [LINT_MSG]
+    pr_commands = {'lint'}
     if not is_staged_recipes:
-        pr_commands += [RERENDER_MSG]
+        pr_commands.add('rerender')
 
-    if not any(command.search(comment) for command in pr_commands):
+    if not commands & pr_commands:
         return
 
     with tmp_directory() as tmp_dir:
@@ -57,23 +105,28 @@ def pr_detailed_comment(org_name, repo_name, pr_owner, pr_repo, pr_branch, pr_nu
         feedstock_dir = os.path.join(tmp_dir, repo_name)
         repo_url = "https://{}@github.com/{}/{}.git".format(
             os.environ['GH_TOKEN'], pr_owner, pr_repo)
-        repo = Repo.clone_from(repo_url, feedstock_dir, branch=pr_branch)
+        with stage('command', 'clone'):
+            repo = clone_from(repo_url, feedstock_dir, branch=pr_branch)
+        # Linting and rerendering both work in this one clone.
+        workspace = Workspace(repo, mode='mirror')
 
-        if LINT_MSG.search(comment):
-            relint(org_name, repo_name, pr_num)
+        if 'lint' in commands:
+            with stage('command', 'relint'):
+                relint(org_name, repo_name, pr_num, workspace=workspace)
 
         changed_anything = False
         rerender_error = False
         expected_changes = []
         if not is_staged_recipes:
             do_rerender = False
-            if RERENDER_MSG.search(comment):
+            if 'rerender' in commands:
                 do_rerender = True
                 expected_changes.append('re-render')
 
             if do_rerender:
                 try:
-                    changed_anything |= rerender(repo)
+                    with stage('command', 'rerender'):
+                        changed_anything |= rerender(repo)
                 except RuntimeError:
                     rerender_error = True
 
@@ -83,13 +136,13 @@ def pr_detailed_comment(org_name, repo_name, pr_owner, pr_repo, pr_branch, pr_nu
             joiner = ", " if len(expected_changes) > 2 else " "
             changes_str = joiner.join(expected_changes)
 
-            gh = github.Github(os.environ['GH_TOKEN'])
-            gh_repo = gh.get_repo("{}/{}".format(org_name, repo_name))
+            gh_repo = get_repo(org_name, repo_name)
             pull = gh_repo.get_pull(int(pr_num))
 
             if changed_anything:
                 try:
-                    repo.remotes.origin.push()
+                    with stage('command', 'push'):
+                        repo.remotes.origin.push()
                 except GitCommandError:
                     message = textwrap.dedent("""
                         Hi! This is the friendly automated nwb-extensions-webservice.
@@ -117,21 +170,23 @@ def issue_comment(org_name, repo_name, issue_num, title, comment):
     if not repo_name.endswith("-feedstock"):
         return
 
-    text = comment + title
+    parsed = parse_commands(comment + title)
+    commands = {command.name for command in parsed}
+    # Those that are in the title, which we close the issue for.
+    title_commands = {command.name for command in parsed if command.start >= len(comment)}
 
-    issue_commands = [UPDATE_TEAM_MSG, UPDATE_CIRCLECI_KEY_MSG, RERENDER_MSG]
-    send_pr_commands = [RERENDER_MSG]
+    issue_commands = {'update_team', 'update_circle', 'rerender'}
+    send_pr_commands = {'rerender'}
 
-    if not any(command.search(text) for command in issue_commands):
+    if not commands & issue_commands:
         return
 
-    gh = github.Github(os.environ['GH_TOKEN'])
-    repo = gh.get_repo("{}/{}".format(org_name, repo_name))
+    repo = get_repo(org_name, repo_name)
     issue = repo.get_issue(int(issue_num))
 
-    if UPDATE_TEAM_MSG.search(text):
+    if 'update_team' in commands:
         update_team(org_name, repo_name)
-        if UPDATE_TEAM_MSG.search(title):
+        if 'update_team' in title_commands:
             issue.edit(state="closed")
         message = textwrap.dedent("""
                 Hi! This is the friendly automated nwb-extensions-webservice.
@@ -140,9 +195,9 @@ def issue_comment(org_name, repo_name, issue_num, title, comment):
                 """)
         issue.create_comment(message)
 
-    if UPDATE_CIRCLECI_KEY_MSG.search(text):
+    if 'update_circle' in commands:
         update_circle(org_name, repo_name)
-        if UPDATE_CIRCLECI_KEY_MSG.search(title):
+        if 'update_circle' in title_commands:
             issue.edit(state="closed")
         message = textwrap.dedent("""
                 Hi! This is the friendly automated nwb-extensions-webservice.
@@ -151,9 +206,9 @@ def issue_comment(org_name, repo_name, issue_num, title, comment):
                 """)
         issue.create_comment(message)
 
-    if any(command.search(text) for command in send_pr_commands):
-        forked_user = gh.get_user().login
-        forked_repo = gh.get_user().create_fork(repo)
+    if commands & send_pr_commands:
+        forked_user = get_login()
+        forked_repo = get_github().get_user().create_fork(repo)
 
         with tmp_directory() as tmp_dir:
             feedstock_dir = os.path.join(tmp_dir, repo_name)
@@ -161,7 +216,7 @@ def issue_comment(org_name, repo_name, issue_num, title, comment):
                 os.environ['GH_TOKEN'], forked_user, repo_name)
             upstream_repo_url = "https://{}@github.com/{}/{}.git".format(
                 os.environ['GH_TOKEN'], org_name, repo_name)
-            git_repo = Repo.clone_from(repo_url, feedstock_dir)
+            git_repo = clone_from(repo_url, feedstock_dir)
             forked_repo_branch = 'nwb_extensions_admin_{}'.format(issue_num)
             upstream = git_repo.create_remote('upstream', upstream_repo_url)
             upstream.fetch()
@@ -170,10 +225,10 @@ def issue_comment(org_name, repo_name, issue_num, title, comment):
 
             changed_anything = False
             extra_msg = ""
-            if RERENDER_MSG.search(text):
+            if 'rerender' in commands:
                 pr_title = "MNT: rerender"
                 comment_msg = "rerendered the recipe"
-                to_close = RERENDER_MSG.search(title)
+                to_close = 'rerender' in title_commands
 
                 changed_anything |= rerender(git_repo)
 
@@ -214,17 +269,22 @@ def issue_comment(org_name, repo_name, issue_num, title, comment):
 
 def rerender(repo):
     curr_head = repo.active_branch.commit
-    ret = subprocess.call(["nwb" "extensions" "smithy", "rerender", "-c", "auto"], cwd=repo.working_dir)
-
-    if ret:
-        raise RuntimeError
+    result = rerender_executor.run(["nwb-extensions-smithy", "rerender", "-c", "auto"], cwd=repo.working_dir,
+                                   label=os.path.basename(repo.working_dir))
+    print('Rerender waited {:.1f}s for a slot and ran for {:.1f}s, its output is in {}.'.format(
+        result.wait_time, result.run_time, result.log_key))
+
+    if result.timed_out:
+        raise RuntimeError('Rerender took longer than {}s.'.format(rerender_executor.timeout))
+    elif result.returncode:
+        raise RuntimeError('Rerender exited with {}.'.format(result.returncode))
     else:
         return repo.active_branch.commit != curr_head
 
 
-def relint(owner, repo_name, pr_num):
+def relint(owner, repo_name, pr_num, workspace=None):
     pr = int(pr_num)
-    lint_info = compute_lint_message(owner, repo_name, pr, repo_name == 'staged-extensions')
+    lint_info = compute_lint_message(owner, repo_name, pr, repo_name == 'staged-extensions', workspace=workspace)
     if not lint_info:
         print('Linting was skipped.')
     else:
@@ -3,6 +3,7 @@ import jinja2
 import os
 
 from collections import namedtuple
+from .repo_cache import clone_from
 from .utils import tmp_directory
 
 
@@ -18,7 +19,7 @@ def update_listing():
         webpage_url = (
             "https://github.com/nwb-extensions/nwb-extensions.github.io.git"
         )
-        webpage_repo = git.Repo.clone_from(
+        webpage_repo = clone_from(
             webpage_url,
             os.path.join(tmp_dir, "webpage")
         )
@@ -27,7 +28,7 @@ def update_listing():
         feedstocks_url = (
             "https://github.com/nwb-extensions/feedstocks.git"
         )
-        feedstocks_repo = git.Repo.clone_from(
+        feedstocks_repo = clone_from(
             feedstocks_url,
             os.path.join(tmp_dir, "feedstocks")
         )
@@ -37,7 +38,7 @@ def update_listing():
             "https://{}@github.com/nwb-extensions/feedstocks.git"
             "".format(os.environ["FEEDSTOCKS_GH_TOKEN"])
         )
-        feedstocks_page_repo = git.Repo.clone_from(
+        feedstocks_page_repo = clone_from(
             feedstocks_page_url,
             os.path.join(tmp_dir, "feedstocks_page"),
             branch="gh-pages"
@@ -93,7 +94,7 @@ def update_feedstock(org_name, repo_name):
             "https://{}@github.com/nwb-extensions/feedstocks.git"
             "".format(os.environ["FEEDSTOCKS_GH_TOKEN"])
         )
-        feedstocks_repo = git.Repo.clone_from(
+        feedstocks_repo = clone_from(
             feedstocks_url,
             tmp_dir
         )
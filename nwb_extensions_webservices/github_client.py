@@ -0,0 +1,163 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import github
+
+from .http_cache import http_cache, install
+from .rate_limit import rate_limits
+
+# Conditional requests for everything we read, GitHub doesn't charge for a 304.
+install()
+
+# Resolved users, organizations and repositories are reused for this many seconds.
+OBJECT_TTL = int(os.environ.get('GITHUB_OBJECT_TTL', 300))
+POOL_SIZE = int(os.environ.get('GITHUB_POOL_SIZE', 10))
+# Stop using tokens with less than this much budget left, and wait at most
+# this many seconds for one to reset when they all are.
+TOKEN_RESERVE = int(os.environ.get('GITHUB_TOKEN_RESERVE', 100))
+MAX_BACKOFF = int(os.environ.get('GITHUB_MAX_BACKOFF', 600))
+
+_lock = threading.Lock()
+_clients = {}
+_objects = {}
+_local = threading.local()
+_stats = {'clients_reused': 0, 'calls_saved': 0}
+
+
+def reset():
+    """Forget all clients, cached objects and statistics."""
+    with _lock:
+        _clients.clear()
+        _objects.clear()
+        for key in _stats:
+            _stats[key] = 0
+
+
+def _saved(calls):
+    with _lock:
+        _stats['calls_saved'] += calls
+    _local.calls_saved = getattr(_local, 'calls_saved', 0) + calls
+
+
+def tokens():
+    """GH_TOKEN, followed by any extra (read only) tokens in GH_TOKENS."""
+    tokens = [os.environ['GH_TOKEN']]
+    for token in os.environ.get('GH_TOKENS', '').split(','):
+        token = token.strip()
+        if token and token not in tokens:
+            tokens.append(token)
+    return tokens
+
+
+def _budget(token):
+    rate = rate_limits.remaining(token)
+    if rate is None:
+        # We haven't used it yet, so as far as we know it has its full budget.
+        return float('inf'), 0
+    return rate[0], rate[2]
+
+
+def _pick_token(tokens):
+    budgets = {token: _budget(token) for token in tokens}
+    token = max(tokens, key=lambda token: budgets[token][0])
+    if budgets[token][0] > TOKEN_RESERVE:
+        return token
+    wait = min(reset for _, reset in budgets.values()) - time.time()
+    wait = min(max(wait, 1), MAX_BACKOFF)
+    print('All GitHub tokens are nearly out of rate limit, waiting {:.0f}s.'.format(wait))
+    time.sleep(wait)
+    return max(tokens, key=lambda token: _budget(token)[0])
+
+
+def read_token():
+    """
+    The token with the most rate limit left, for calls that only read.
+
+    Anything that writes (or needs to be done as nwb-extensions-linter) must
+    use GH_TOKEN, which is what all functions here default to.
+    """
+    return _pick_token(tokens())
+
+
+def write_token():
+    return _pick_token(tokens()[:1])
+
+
+def get_github(token=None, queries_only=False):
+    """
+    The process-wide client for ``token`` (GH_TOKEN by default).
+
+    Reusing one client keeps its HTTP connections alive between calls.
+    PyGithub spaces out POSTs as writes, so GraphQL queries (which are POSTs
+    that don't write) get a ``queries_only`` client that doesn't.
+    """
+    if token is None:
+        token = write_token()
+    with _lock:
+        gh = _clients.get((token, queries_only))
+        if gh is None:
+            if queries_only:
+                gh = github.Github(token, pool_size=POOL_SIZE, seconds_between_writes=None)
+            else:
+                gh = github.Github(token, pool_size=POOL_SIZE)
+            _clients[(token, queries_only)] = gh
+        else:
+            _stats['clients_reused'] += 1
+    return gh
+
+
+def _cached(key, calls, resolve):
+    now = time.time()
+    with _lock:
+        cached = _objects.get(key)
+    if cached is not None and cached[0] > now:
+        _saved(calls)
+        return cached[1]
+    obj = resolve()
+    with _lock:
+        _objects[key] = (now + OBJECT_TTL, obj)
+    return obj
+
+
+def get_repo(owner, repo_name, token=None):
+    token = token or write_token()
+    # Resolving it through get_user(owner).get_repo(repo_name) costs two calls.
+    return _cached(('repo', token, owner, repo_name), 2,
+                   lambda: get_github(token).get_repo('{}/{}'.format(owner, repo_name)))
+
+
+def get_organization(org_name, token=None):
+    token = token or write_token()
+    return _cached(('org', token, org_name), 1,
+                   lambda: get_github(token).get_organization(org_name))
+
+
+def get_login(token=None):
+    """The login of the user the token belongs to."""
+    token = token or write_token()
+    return _cached(('login', token), 1, lambda: get_github(token).get_user().login)
+
+
+@contextmanager
+def track_job(job):
+    # Report the API calls saved by the caches for each job.
+    _local.calls_saved = 0
+    http_cache.pop_not_modified()
+    try:
+        yield
+    finally:
+        not_modified = http_cache.pop_not_modified()
+        if _local.calls_saved or not_modified:
+            print('Job "{}" saved {} GitHub API calls, {} requests were not modified.'.format(
+                job.name, _local.calls_saved, not_modified))
+        _local.calls_saved = 0
+
+
+def stats():
+    with _lock:
+        stats = dict(_stats)
+        stats.update(clients=len(_clients), objects=len(_objects))
+    stats['http_cache'] = http_cache.stats()
+    return stats
@@ -0,0 +1,109 @@
+from collections import namedtuple
+import os
+
+from .github_client import get_github, read_token
+
+
+# Set GITHUB_GRAPHQL=1 to fetch pull requests and post lint comments through the GraphQL API,
+# which needs one request for what takes several (and pages of comments) with the REST API.
+USE_GRAPHQL = bool(int(os.environ.get('GITHUB_GRAPHQL', 0)))
+
+# Only the last 100 comments are searched for the bot's, older ones are only found through the comment index.
+PULL_REQUEST_QUERY = """
+query($owner: String!, $name: String!, $number: Int!) {
+  viewer { login }
+  repository(owner: $owner, name: $name) {
+    pullRequest(number: $number) {
+      id
+      state
+      mergeable
+      headRefOid
+      comments(last: 100) {
+        nodes { id databaseId url body author { login } }
+      }
+    }
+  }
+}
+"""
+
+# What waiting for a PR to become mergeable polls, without the comments.
+PULL_REQUEST_STATE_QUERY = """
+query($owner: String!, $name: String!, $number: Int!) {
+  repository(owner: $owner, name: $name) {
+    pullRequest(number: $number) { state mergeable headRefOid baseRefOid }
+  }
+}
+"""
+
+PullRequest = namedtuple('PullRequest', ['node_id', 'state', 'mergeable', 'head_sha', 'bot_comments'])
+PullRequestState = namedtuple('PullRequestState', ['state', 'mergeable', 'head_sha', 'base_sha'])
+Comment = namedtuple('Comment', ['id', 'node_id', 'html_url', 'body'])
+
+_MERGEABLE = {'MERGEABLE': True, 'CONFLICTING': False, 'UNKNOWN': None}
+
+
+def query(query, variables, token=None):
+    # Goes through the shared client, so it gets its connection pool and rate limit tracking.
+    _, data = get_github(token, queries_only=True).requester.graphql_query(query, variables)
+    return data['data']
+
+
+def fetch_pull_request(owner, repo_name, number, token=None):
+    """
+    The state, mergeability, head and bot comments of a PR in one request.
+
+    The bot is whoever ``token`` (GH_TOKEN by default) belongs to.
+    """
+    data = query(PULL_REQUEST_QUERY, {'owner': owner, 'name': repo_name, 'number': number}, token=token)
+    login = data['viewer']['login']
+    pr = data['repository']['pullRequest']
+    bot_comments = [Comment(node['databaseId'], node['id'], node['url'], node['body'])
+                    for node in pr['comments']['nodes']
+                    if node['author'] and node['author']['login'] == login]
+    # Lower case, like the REST API (which reports merged PRs as closed).
+    return PullRequest(pr['id'], pr['state'].lower(), _MERGEABLE[pr['mergeable']],
+                       pr['headRefOid'], bot_comments)
+
+
+def fetch_pull_request_state(owner, repo_name, number, token=None):
+    """The state, mergeability, head and base of a PR, in a much smaller query than ``fetch_pull_request``."""
+    data = query(PULL_REQUEST_STATE_QUERY, {'owner': owner, 'name': repo_name, 'number': number}, token=token)
+    pr = data['repository']['pullRequest']
+    return PullRequestState(pr['state'].lower(), _MERGEABLE[pr['mergeable']], pr['headRefOid'], pr['baseRefOid'])
+
+
+class Repository(object):
+    # Just the parts of github.Repository that linting needs to wait for a PR and clone it.
+    def __init__(self, owner, name, token=None):
+        self.owner = owner
+        self.name = name
+        self.token = token
+        self.clone_url = 'https://github.com/{}/{}.git'.format(owner, name)
+
+    def get_pull(self, number):
+        # Only reads, so any of our tokens will do.
+        return fetch_pull_request_state(self.owner, self.name, number, token=self.token or read_token())
+
+
+def add_comment(subject_id, body, token=None):
+    _, data = get_github(token).requester.graphql_named_mutation(
+        'addComment', {'subjectId': subject_id, 'body': body},
+        'commentEdge { node { id databaseId url } }')
+    node = data['commentEdge']['node']
+    return Comment(node['databaseId'], node['id'], node['url'], body)
+
+
+def update_comment(comment, body, token=None):
+    get_github(token).requester.graphql_named_mutation(
+        'updateIssueComment', {'id': comment.node_id, 'body': body}, 'issueComment { id }')
+    return comment._replace(body=body)
+
+
+def create_status(owner, repo_name, sha, state, description, context, target_url=None, token=None):
+    # There is no GraphQL mutation for commit statuses, but the REST call doesn't
+    # need the repository or commit to be fetched first either.
+    status = {'state': state, 'description': description, 'context': context}
+    if target_url is not None:
+        status['target_url'] = target_url
+    get_github(token).requester.requestJsonAndCheck(
+        'POST', '/repos/{}/{}/statuses/{}'.format(owner, repo_name, sha), input=status)
@@ -0,0 +1,182 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+from github.Requester import (Requester, RequestsResponse, HTTPRequestsConnectionClass,
+                              HTTPSRequestsConnectionClass)
+from requests.structures import CaseInsensitiveDict
+
+from .rate_limit import rate_limits
+from .store import SQLiteCache, cache_path
+
+
+class HTTPCache(object):
+    """
+    ETag and Last-Modified validators, with the response they belong to, per url.
+
+    Recently used entries are kept in memory, and all of them in ``disk``
+    (a ``SQLiteCache``) if one is given.
+    """
+    def __init__(self, max_entries=1000, disk=None):
+        self.max_entries = max_entries
+        self.disk = disk
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._stats = {'requests': 0, 'conditional': 0, 'not_modified': 0, 'stored': 0}
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return entry
+        if self.disk is not None:
+            entry = self.disk.get(key)
+            if entry is not None:
+                self._remember(key, entry)
+        return entry
+
+    def set(self, key, entry):
+        self._remember(key, entry)
+        if self.disk is not None:
+            self.disk.set(key, entry)
+
+    def _remember(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            for key in self._stats:
+                self._stats[key] = 0
+
+    def record(self, stat):
+        with self._lock:
+            self._stats[stat] += 1
+        if stat == 'not_modified':
+            self._local.not_modified = getattr(self._local, 'not_modified', 0) + 1
+
+    def pop_not_modified(self):
+        """The number of 304s this thread got since it last asked."""
+        count = getattr(self._local, 'not_modified', 0)
+        self._local.not_modified = 0
+        return count
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._entries)
+        # GitHub doesn't count a 304 against the rate limit.
+        stats['rate_limit_saved'] = stats['not_modified']
+        stats['hit_ratio'] = stats['not_modified'] / stats['requests'] if stats['requests'] else 0.0
+        return stats
+
+
+def _disk_cache():
+    if not int(os.environ.get('GITHUB_DISK_CACHE', 0)):
+        return None
+    return SQLiteCache(cache_path('github_http.sqlite'),
+                       max_entries=int(os.environ.get('GITHUB_DISK_CACHE_SIZE', 10000)))
+
+
+http_cache = HTTPCache(int(os.environ.get('GITHUB_CACHE_SIZE', 1000)), disk=_disk_cache())
+
+
+class CachedResponse(object):
+    # Mimics github.Requester.RequestsResponse for a response served from the cache.
+    def __init__(self, status, headers, body):
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+    def getheaders(self):
+        return self.headers.items()
+
+    def read(self):
+        return self.body
+
+    def raise_for_status(self):
+        pass
+
+
+class CachingHTTPSConnection(HTTPSRequestsConnectionClass):
+    """
+    A PyGithub connection that turns repeated GETs into conditional requests.
+
+    A ``304 Not Modified`` is answered from ``http_cache``, with the fresh
+    rate limit headers of the 304, so PyGithub never sees the difference.
+    """
+    cache = http_cache
+
+    def __init__(self, *args, **kwargs):
+        super(CachingHTTPSConnection, self).__init__(*args, **kwargs)
+        # PyGithub hands one connection to every thread using the client, and
+        # keeps the request being made on it; keep that per thread instead.
+        self._pending = threading.local()
+
+    def request(self, verb, url, input, headers, stream=False):
+        self._pending.request = (verb, url, input, headers, stream)
+
+    def _key(self, url, headers):
+        # Responses depend on who is asking and for which media type.
+        key = '\0'.join([headers.get('Authorization', ''), headers.get('Accept', ''),
+                         self.host, url])
+        return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+    def getresponse(self):
+        verb, url, input, headers, stream = self._pending.request
+        self._pending.request = None
+        if verb != 'GET' or stream:
+            return self._send(verb, url, input, headers, stream)
+
+        self.cache.record('requests')
+        key = self._key(url, headers)
+        entry = self.cache.get(key)
+        if entry is not None:
+            headers = dict(headers)
+            if entry['etag']:
+                headers['If-None-Match'] = entry['etag']
+            if entry['last_modified']:
+                headers['If-Modified-Since'] = entry['last_modified']
+            self.cache.record('conditional')
+
+        response = self._send(verb, url, input, headers, stream)
+        if response.status == 304 and entry is not None:
+            self.cache.record('not_modified')
+            response_headers = CaseInsensitiveDict(entry['headers'])
+            response_headers.update(response.headers)
+            return CachedResponse(entry['status'], response_headers, entry['body'])
+
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        if response.status == 200 and (etag or last_modified):
+            self.cache.set(key, {'status': response.status,
+                                 'headers': dict(response.headers),
+                                 'body': response.read(),
+                                 'etag': etag,
+                                 'last_modified': last_modified})
+            self.cache.record('stored')
+        return response
+
+    def _send(self, verb, url, input, headers, stream):
+        # As HTTPSRequestsConnectionClass.getresponse, without the shared state.
+        send = getattr(self.session, verb.lower())
+        response = send('{}://{}:{}{}'.format(self.protocol, self.host, self.port, url),
+                        headers=headers, data=input, timeout=self.timeout, verify=self.verify,
+                        allow_redirects=False)
+        rate_limits.record(headers.get('Authorization'), response.status_code, response.headers)
+        return RequestsResponse(response)
+
+
+def install():
+    """Send every PyGithub request made over https through the cache."""
+    Requester.injectConnectionClasses(HTTPRequestsConnectionClass, CachingHTTPSConnection)
+    # injectConnectionClasses also stops PyGithub reusing connections (it is meant
+    # for tests), which would undo the keep-alive we get from sharing clients.
+    Requester._Requester__persist = True
@@ -0,0 +1,90 @@
+"""
+A process that only runs jobs, queued by the web processes in the shared job store.
+
+    python -m nwb_extensions_webservices.job_worker
+
+The web processes then only need to take webhooks (with ``WEB_RUNS_JOBS=0``),
+and more of these can be started to lint and rerender more at once. The store
+is a SQLite file in ``CACHE_DIR``, so they have to run on the same host as the
+web processes: Heroku dynos don't share a filesystem, so there the web dyno
+has to run the jobs itself.
+"""
+import errno
+import os
+import signal
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+# The jobs are functions of the webapp, which also adds the job hooks (metrics, GitHub call counts).
+from . import webapp  # noqa: F401
+from . import metrics
+from .jobs import job_queue, SharedJobQueue
+from .workers import worker_pool
+
+# Heroku sends SIGKILL 30s after SIGTERM.
+SHUTDOWN_TIMEOUT = int(os.environ.get('WORKER_SHUTDOWN_TIMEOUT', 20))
+
+# Where each worker serves its /metrics, the first free port from this one on.
+METRICS_PORT = int(os.environ.get('WORKER_METRICS_PORT', 9200))
+METRICS_PORTS = 100
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    # The jobs (and their stages) run here, so their metrics are only in this process.
+    def do_GET(self):
+        if self.path != '/metrics':
+            self.send_error(404)
+            return
+        body = metrics.registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Scrapes would drown out the jobs' output.
+        pass
+
+
+def serve_metrics(port=METRICS_PORT, tries=METRICS_PORTS):
+    """Serve /metrics from a thread on ``port``, or the next free one, returns the server."""
+    for offset in range(tries):
+        try:
+            server = HTTPServer(('', port + offset), MetricsHandler)
+        except OSError as err:
+            if err.errno != errno.EADDRINUSE:
+                raise
+            continue
+        thread = threading.Thread(target=server.serve_forever, name='metrics-server')
+        thread.daemon = True
+        thread.start()
+        return server
+    raise RuntimeError('No free port for /metrics in {}-{}.'.format(port, port + tries - 1))
+
+
+def run(queue, stop, shutdown_timeout=SHUTDOWN_TIMEOUT):
+    """Run the jobs of ``queue`` until ``stop`` is set."""
+    queue.start()
+    print('Running jobs from {} with {} threads.'.format(queue.store.path, queue.max_workers))
+    while not stop.wait(1):
+        pass
+    print('Stopping, waiting up to {}s for running jobs.'.format(shutdown_timeout))
+    queue.stop(timeout=shutdown_timeout)
+
+
+def main():
+    if not isinstance(job_queue, SharedJobQueue):
+        sys.exit('Worker processes need the shared job store, set WEB_RUNS_JOBS=0 or JOB_STORE=sqlite.')
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+    signal.signal(signal.SIGINT, lambda signum, frame: stop.set())
+    worker_pool.start()
+    server = serve_metrics()
+    print('Serving /metrics on port {}.'.format(server.server_port))
+    run(job_queue, stop)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,411 @@
+import importlib
+import json
+import os
+import queue
+import socket
+import sys
+import threading
+import time
+import traceback
+from contextlib import ExitStack
+
+from .store import JobStore, cache_path
+
+
+class QueueFull(Exception):
+    pass
+
+
+_local = threading.local()
+
+
+def current_job():
+    """The job running in this worker thread, if any."""
+    return getattr(_local, 'job', None)
+
+
+class Job(object):
+    def __init__(self, name, func, args, kwargs, key=None):
+        self.name = name
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.key = key
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        # Set when a newer job with the same key is submitted while this one runs.
+        self.superseded = False
+
+    @property
+    def wait_time(self):
+        if self.started is None:
+            return None
+        return self.started - self.submitted
+
+    @property
+    def run_time(self):
+        if self.finished is None:
+            return None
+        return self.finished - self.started
+
+
+class JobQueue(object):
+    """
+    A bounded pool of worker threads that runs webhook work off the IOLoop.
+
+    Handlers only validate the event and ``submit`` it, so a slow clone or
+    lint never holds up the next webhook delivery.
+
+    Jobs submitted with a ``key`` are coalesced: a newer job replaces an older
+    one with the same key that has not started yet, and marks one that is
+    already running as superseded so that it can discard its result.
+    """
+    def __init__(self, max_workers=2, max_depth=100):
+        self.max_workers = max_workers
+        self._queue = queue.Queue(maxsize=max_depth)
+        self._lock = threading.Lock()
+        self._threads = []
+        self._running = 0
+        self._keyed = {}
+        self._stats = {}
+        self._hooks = []
+        self._coalesce = {'collapsed': 0, 'superseded': 0}
+
+    def start(self):
+        """Start the worker threads, which is otherwise done on the first ``submit``."""
+        self._start_workers()
+
+    def _start_workers(self):
+        with self._lock:
+            while len(self._threads) < self.max_workers:
+                thread = threading.Thread(target=self._work,
+                                          name='job-worker-{}'.format(len(self._threads)))
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+
+    def add_hook(self, hook):
+        """Run every job inside the context manager returned by ``hook(job)``."""
+        self._hooks.append(hook)
+
+    def submit(self, name, func, *args, key=None, **kwargs):
+        return self._submit(name, func, args, kwargs, key)
+
+    def _submit(self, name, func, args, kwargs, key, retry_of=None):
+        self._start_workers()
+        with self._lock:
+            previous = self._keyed.get(key) if key is not None else None
+            if previous is not None and previous.started is None:
+                # Still waiting for a worker, so just bring it up to date.
+                previous.func, previous.args, previous.kwargs = func, args, kwargs
+                self._coalesce['collapsed'] += 1
+                print('Job "{}" for {} was collapsed into a newer one.'.format(name, key))
+                return previous
+
+            job = Job(name, func, args, kwargs, key=key)
+            try:
+                self._queue.put_nowait(job)
+            except queue.Full:
+                raise QueueFull('Job queue is full ({} jobs pending).'.format(self._queue.maxsize))
+            if previous is not None and previous is not retry_of:
+                previous.superseded = True
+                self._coalesce['superseded'] += 1
+            if key is not None:
+                self._keyed[key] = job
+        return job
+
+    def submit_later(self, delay, name, func, *args, key=None, **kwargs):
+        # Used to retry a job, e.g. when GitHub wasn't ready for it yet. A job
+        # retrying itself isn't superseded by its retry.
+        timer = threading.Timer(delay, self._submit_later, (name, func, args, kwargs, key, current_job()))
+        timer.daemon = True
+        timer.start()
+        return timer
+
+    def _submit_later(self, name, func, args, kwargs, key, retry_of):
+        try:
+            self._submit(name, func, args, kwargs, key, retry_of=retry_of)
+        except QueueFull as err:
+            print('Dropping job "{}": {}'.format(name, err))
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            try:
+                with self._lock:
+                    job.started = time.time()
+                    self._running += 1
+                self._run(job)
+            finally:
+                self._queue.task_done()
+
+    def _run(self, job):
+        _local.job = job
+        result = error = None
+        try:
+            with ExitStack() as stack:
+                for hook in self._hooks:
+                    stack.enter_context(hook(job))
+                result = job.func(*job.args, **job.kwargs)
+        except Exception:
+            error = traceback.format_exc()
+            print('Job "{}" failed:'.format(job.name))
+            traceback.print_exc()
+        finally:
+            _local.job = None
+            job.finished = time.time()
+            with self._lock:
+                self._running -= 1
+                if job.key is not None and self._keyed.get(job.key) is job:
+                    del self._keyed[job.key]
+                self._record(job, error is not None)
+            try:
+                self._done(job, result, error)
+            except Exception as err:
+                # Not worth losing the worker thread over.
+                print('Could not record the result of job "{}": {}'.format(job.name, err))
+        print('Job "{}" finished in {:.2f}s (waited {:.2f}s).'.format(
+            job.name, job.run_time, job.wait_time))
+
+    def _done(self, job, result, error):
+        # Where the result of a job would be kept, jobs only run here don't keep it.
+        pass
+
+    def _record(self, job, failed):
+        stats = self._stats.setdefault(job.name, {'count': 0, 'failed': 0,
+                                                  'total_wait': 0.0, 'total_run': 0.0,
+                                                  'max_run': 0.0, 'last_run': 0.0})
+        stats['count'] += 1
+        stats['failed'] += int(failed)
+        stats['total_wait'] += job.wait_time
+        stats['total_run'] += job.run_time
+        stats['max_run'] = max(stats['max_run'], job.run_time)
+        stats['last_run'] = job.run_time
+
+    @property
+    def depth(self):
+        return self._queue.qsize()
+
+    def join(self):
+        # Block until every submitted job has been run.
+        self._queue.join()
+
+    def stats(self):
+        with self._lock:
+            jobs = {name: dict(stats) for name, stats in self._stats.items()}
+            running = self._running
+            coalesce = dict(self._coalesce)
+        stats = {'depth': self.depth,
+                 'running': running,
+                 'workers': self.max_workers,
+                 'jobs': jobs}
+        stats.update(coalesce)
+        return stats
+
+
+def function_path(func):
+    """The ``module:function`` name other processes can find ``func`` by."""
+    module = func.__module__
+    if module == '__main__':
+        # Run with ``python -m``, everyone else knows it by its real name. Not so for a script.
+        main = sys.modules['__main__']
+        module = main.__spec__.name if getattr(main, '__spec__', None) is not None else None
+    if module is None or '<' in func.__qualname__:
+        raise ValueError('{!r} is not a module level function.'.format(func))
+    return '{}:{}'.format(module, func.__qualname__)
+
+
+def resolve_function(path):
+    module_name, _, name = path.partition(':')
+    main = sys.modules['__main__']
+    if getattr(main, '__spec__', None) is not None and main.__spec__.name == module_name:
+        obj = main
+    else:
+        obj = importlib.import_module(module_name)
+    for attr in name.split('.'):
+        obj = getattr(obj, attr)
+    return obj
+
+
+class StoredJob(Job):
+    def __init__(self, store, job_id, name, func, args, kwargs, key=None):
+        self.store = store
+        self.id = job_id
+        super(StoredJob, self).__init__(name, func, args, kwargs, key=key)
+
+    @property
+    def superseded(self):
+        # Whoever superseded it may be another process.
+        return self.store.is_superseded(self.id)
+
+    @superseded.setter
+    def superseded(self, value):
+        if value:
+            self.store.supersede(self.id)
+
+
+class SharedJobQueue(JobQueue):
+    """
+    A JobQueue whose jobs are kept in a JobStore.
+
+    Every process using the same store takes jobs from the same queue, so
+    with WEB_CONCURRENCY processes a PR is still only linted by one of them,
+    and jobs survive a restart. Functions must be module level and their
+    arguments JSON, the worker threads look them up by name. Worker threads
+    check the store every ``poll_interval`` seconds, or straight away when
+    a job is submitted in their own process.
+    """
+    def __init__(self, store, max_workers=2, max_depth=100, poll_interval=1.0):
+        super(SharedJobQueue, self).__init__(max_workers=max_workers, max_depth=max_depth)
+        self.store = store
+        self.poll_interval = poll_interval
+        self.owner = None
+        self._wake = threading.Event()
+        self._stopping = False
+        # The results of jobs that couldn't be written to the store yet, by job id.
+        self._unfinished = {}
+
+    def _start_workers(self):
+        if self.owner is None:
+            # Only once we are in the process that runs the jobs, i.e. after forking.
+            self.owner = '{}:{}'.format(socket.gethostname(), os.getpid())
+            thread = threading.Thread(target=self._heartbeat, name='job-heartbeat')
+            thread.daemon = True
+            thread.start()
+        super(SharedJobQueue, self)._start_workers()
+
+    def _heartbeat(self):
+        while True:
+            time.sleep(self.store.lease_time / 3)
+            try:
+                # Before renewing, or the leases of those jobs would never run out.
+                self._finish_unfinished()
+                self.store.renew(self.owner)
+            except Exception as err:
+                print('Could not renew job leases: {}'.format(err))
+
+    def _finish_unfinished(self):
+        with self._lock:
+            unfinished = list(self._unfinished.items())
+        for job_id, (result, error) in unfinished:
+            self.store.finish(job_id, result=result, error=error, owner=self.owner)
+            with self._lock:
+                del self._unfinished[job_id]
+
+    def _enqueue(self, delay, name, func, args, kwargs, key, retry_of=None):
+        store_key = json.dumps(key) if key is not None else None
+        job_id, outcome = self.store.enqueue(name, function_path(func), args, kwargs, key=store_key, delay=delay,
+                                             max_depth=self._queue.maxsize, retry_of=retry_of)
+        if outcome == 'full':
+            raise QueueFull('Job queue is full ({} jobs pending).'.format(self._queue.maxsize))
+        if outcome in self._coalesce:
+            with self._lock:
+                self._coalesce[outcome] += 1
+        if outcome == 'collapsed':
+            print('Job "{}" for {} was collapsed into a newer one.'.format(name, key))
+        self._wake.set()
+        return StoredJob(self.store, job_id, name, func, args, kwargs, key=key)
+
+    def submit(self, name, func, *args, key=None, **kwargs):
+        self._start_workers()
+        return self._enqueue(0, name, func, args, kwargs, key)
+
+    def submit_later(self, delay, name, func, *args, key=None, **kwargs):
+        # Kept in the store, so the retry happens even if this process doesn't last that long.
+        job = current_job()
+        retry_of = job.id if isinstance(job, StoredJob) else None
+        try:
+            return self._enqueue(delay, name, func, args, kwargs, key, retry_of=retry_of)
+        except QueueFull as err:
+            print('Dropping job "{}": {}'.format(name, err))
+
+    def _lease(self):
+        try:
+            row = self.store.lease(self.owner)
+        except Exception as err:
+            print('Could not lease a job: {}'.format(err))
+            return None
+        if row is None:
+            return None
+        key = tuple(json.loads(row['key'])) if row['key'] is not None else None
+        try:
+            func = resolve_function(row['func'])
+        except (ImportError, AttributeError) as err:
+            self.store.finish(row['id'], error='Unknown function {}: {}'.format(row['func'], err))
+            return None
+        job = StoredJob(self.store, row['id'], row['name'], func, row['args'], row['kwargs'], key=key)
+        job.submitted = row['not_before']
+        return job
+
+    def _work(self):
+        while not self._stopping:
+            job = self._lease()
+            if job is None:
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+                continue
+            with self._lock:
+                job.started = time.time()
+                self._running += 1
+            self._run(job)
+
+    def _done(self, job, result, error):
+        try:
+            self.store.finish(job.id, result=result, error=error, owner=self.owner)
+        except Exception:
+            # The heartbeat tries again.
+            with self._lock:
+                self._unfinished[job.id] = (result, error)
+            raise
+
+    def stop(self, timeout=None):
+        """
+        Stop taking jobs and wait up to ``timeout`` seconds for the running ones,
+        those still running after that are handed back to the queue.
+        """
+        self._stopping = True
+        self._wake.set()
+        deadline = time.time() + timeout if timeout is not None else None
+        while self.stats()['running'] and (deadline is None or time.time() < deadline):
+            time.sleep(0.05)
+        for thread in self._threads:
+            # Those that are still running a job won't stop in time.
+            thread.join(self.poll_interval)
+        if self.owner is not None:
+            released = self.store.release(self.owner)
+            if released:
+                print('Handed {} running jobs back to the queue.'.format(released))
+
+    @property
+    def depth(self):
+        return self.store.count('queued')
+
+    def join(self):
+        # Block until no job is queued or running, in any process.
+        while self.store.count('queued') or self.store.count('running'):
+            time.sleep(0.05)
+
+    def stats(self):
+        stats = super(SharedJobQueue, self).stats()
+        stats['store'] = self.store.stats()
+        return stats
+
+
+def create_job_queue():
+    # JOB_STORE=sqlite shares the queue between processes, which is the default with WEB_CONCURRENCY
+    # above 1 or when worker processes run the jobs (WEB_RUNS_JOBS=0).
+    max_workers = int(os.environ.get('JOB_WORKERS', 2))
+    max_depth = int(os.environ.get('JOB_QUEUE_DEPTH', 100))
+    shared = int(os.environ.get('WEB_CONCURRENCY', 1)) > 1 or not int(os.environ.get('WEB_RUNS_JOBS', 1))
+    default = 'sqlite' if shared else 'memory'
+    if os.environ.get('JOB_STORE', default) == 'sqlite':
+        store = JobStore(cache_path('jobs.sqlite'),
+                         lease_time=int(os.environ.get('JOB_LEASE_TIME', 1800)),
+                         result_ttl=int(os.environ.get('JOB_RESULT_TTL', 24 * 60 * 60)))
+        return SharedJobQueue(store, max_workers=max_workers, max_depth=max_depth,
+                              poll_interval=float(os.environ.get('JOB_POLL_INTERVAL', 1)))
+    return JobQueue(max_workers=max_workers, max_depth=max_depth)
+
+
+job_queue = create_job_queue()
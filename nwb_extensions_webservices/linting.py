@@ -1,13 +1,24 @@
+from collections import namedtuple
+from contextlib import contextmanager
 from glob import glob
+import hashlib
 import os
+import random
 import textwrap
+import threading
 import time
 
-from git import GitCommandError, Repo
+from git import GitCommandError
 import github
 import nwb_extensions_smithy.lint_recipe
 
+from .metrics import stage, lint_cache_lookups
+from .repo_cache import Workspace
+from . import github_graphql
+from .github_client import get_github, get_repo, get_login, read_token
+from .store import SQLiteCache, cache_path
 from .utils import tmp_directory
+from .workers import worker_pool, WorkerError, WorkerTimeout
 
 
 def find_recipes(a_dir):
@@ -15,38 +26,283 @@ def find_recipes(a_dir):
             for y in glob(os.path.join(x[0], 'ndx-meta.yaml'))]
 
 
-def compute_lint_message(repo_owner, repo_name, pr_id, ignore_base=False):
-    gh = github.Github(os.environ['GH_TOKEN'])
+def find_recipes_in_commit(repo, commit):
+    # Same as find_recipes, but read from the commit's tree so nothing needs to be checked out.
+    # Paths are relative to the root of the repository.
+    paths = repo.git.ls_tree('-r', '-z', '--name-only', commit.hexsha).split('\0')
+    return [os.path.dirname(path) or '.' for path in paths
+            if os.path.basename(path) == 'ndx-meta.yaml']
+
+
+def find_changed_recipes(repo, base_commit, head_commit, merge_commit=None):
+    # Find the extensions touched by the changes between the merge-base and the head of a PR,
+    # i.e. the closest directory above each changed file with a ndx-meta.yaml in the merged tree.
+    if merge_commit is None:
+        merge_commit = head_commit
+    merge_base = repo.merge_base(base_commit, head_commit)[0]
+    changed = repo.git.diff('--name-only', '-z', merge_base.hexsha, head_commit.hexsha).split('\0')
+
+    tree = merge_commit.tree
+    is_recipe = {}
+    recipes = set()
+    for path in filter(None, changed):
+        directory = os.path.dirname(path)
+        while True:
+            if directory not in is_recipe:
+                try:
+                    tree.join(os.path.join(directory, 'ndx-meta.yaml'))
+                    is_recipe[directory] = True
+                except KeyError:
+                    is_recipe[directory] = False
+            if is_recipe[directory]:
+                recipes.add(directory or '.')
+                break
+            if not directory:
+                break
+            directory = os.path.dirname(directory)
+    return list(recipes)
+
+
+class MergeabilityTimeout(Exception):
+    pass
+
+
+# GitHub computes the mergeability of a PR in the background, so we wait for it.
+MERGEABLE_TIMEOUT = int(os.environ.get('MERGEABLE_TIMEOUT', 60))
+MERGEABLE_MAX_DELAY = 16.0
+
+# How often a wait checks for mergeability values delivered to other processes.
+MERGEABLE_HINT_INTERVAL = 1.0
+
+# Mergeability values delivered by webhooks, for PRs that someone in this process is waiting on.
+_mergeable_waiting = {}
+_mergeable_hints = {}
+_mergeable_cond = threading.Condition()
+
+# And for those waited on in other processes, like the job workers of a shared job queue.
+mergeable_hints = SQLiteCache(cache_path('mergeable_hints.sqlite'), max_entries=10000,
+                              ttl=max(MERGEABLE_TIMEOUT, 60))
+
+
+def _hint_key(key):
+    return '{}/{}#{}'.format(*key)
+
+
+def notify_mergeable(repo_owner, repo_name, pr_id, mergeable):
+    # Called with the ``mergeable`` value of a webhook payload, so that a wait for the same PR can stop early.
+    key = (repo_owner, repo_name, pr_id)
+    if mergeable is None:
+        return
+    mergeable_hints.set(_hint_key(key), {'mergeable': mergeable, 'time': time.time()})
+    with _mergeable_cond:
+        if key in _mergeable_waiting:
+            _mergeable_hints[key] = mergeable
+            _mergeable_cond.notify_all()
+
+
+def _wait_for_hint(key, since, until):
+    # A value delivered to this process wakes us up straight away, one delivered to
+    # another process since ``since`` is noticed within MERGEABLE_HINT_INTERVAL.
+    while True:
+        with _mergeable_cond:
+            _mergeable_cond.wait_for(lambda: key in _mergeable_hints,
+                                     timeout=max(0, min(MERGEABLE_HINT_INTERVAL, until - time.time())))
+            hint = _mergeable_hints.get(key)
+        if hint is None:
+            shared = mergeable_hints.get(_hint_key(key))
+            if shared is not None and shared['time'] >= since:
+                hint = shared['mergeable']
+        if hint is not None or time.time() >= until:
+            return hint
+
+
+def wait_for_mergeable(remote_repo, repo_owner, repo_name, pr_id, timeout=None):
+    """
+    Wait for GitHub to compute whether the PR is mergeable.
+
+    Polls with exponential backoff and jitter, and stops early when a webhook
+    delivers the value. Returns None if the PR is not open, and raises
+    ``MergeabilityTimeout`` once ``timeout`` seconds have passed.
+    """
+    if timeout is None:
+        timeout = MERGEABLE_TIMEOUT
+    key = (repo_owner, repo_name, pr_id)
+    started = time.time()
+    deadline = started + timeout
+    delay = 1.0
+    with _mergeable_cond:
+        _mergeable_waiting[key] = _mergeable_waiting.get(key, 0) + 1
+    try:
+        while True:
+            pull_request = remote_repo.get_pull(pr_id)
+            if pull_request.state != "open":
+                return None
+            if pull_request.mergeable is not None:
+                return pull_request.mergeable
+
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                raise MergeabilityTimeout('Mergeability of {}/{}#{} unknown after {}s.'.format(
+                    repo_owner, repo_name, pr_id, timeout))
+            hint = _wait_for_hint(key, started, time.time() + min(remaining, delay * random.uniform(0.5, 1.5)))
+            if hint is not None:
+                return hint
+            delay = min(2 * delay, MERGEABLE_MAX_DELAY)
+    finally:
+        with _mergeable_cond:
+            _mergeable_waiting[key] -= 1
+            if not _mergeable_waiting[key]:
+                del _mergeable_waiting[key]
+                _mergeable_hints.pop(key, None)
+
+
+# Lint results only depend on the contents of the extension directory (its git tree) and the linter.
+lint_cache = SQLiteCache(cache_path('lint_results.sqlite'),
+                         max_entries=int(os.environ.get('LINT_CACHE_SIZE', 5000)),
+                         ttl=int(os.environ.get('LINT_CACHE_TTL', 7 * 24 * 60 * 60)))
+
+
+def lint_cache_key(tree_sha):
+    smithy_version = getattr(nwb_extensions_smithy, '__version__', 'unknown')
+    return '{}-{}'.format(tree_sha, smithy_version)
+
+
+LINT_FAILED = ("Failed to even lint the extension, probably because of a nwb-extensions-smithy bug :cry:. "
+               "This likely indicates a problem in your `ndx-meta.yaml`, though. "
+               "To get a traceback to help figure out what's going on, install nwb-extensions-smithy "
+               "and run `nwb extensions smithy recipe-lint .` from the extension directory. ")
+
+LINT_TIMED_OUT = ("Linting the extension took longer than {} seconds, so I gave up :hourglass:. "
+                  "To see what is going on, install nwb-extensions-smithy "
+                  "and run `nwb extensions smithy recipe-lint .` from the extension directory. ")
+
+# Extensions are linted in parallel in separate processes, so that a hanging lint can be killed.
+LINT_TIMEOUT = int(os.environ.get('LINT_TIMEOUT', 300))
+
+
+def lint_recipe(recipe_dir):
+    # Returns the lints, the hints, and whether the linter actually ran.
+    try:
+        lints, hints = nwb_extensions_smithy.lint_recipe.main(recipe_dir, conda_forge=True, return_hints=True)
+        return lints, hints, True
+    except Exception as err:
+        print('ERROR:', err)
+        return [LINT_FAILED], [], False
+
+
+def lint_recipes(recipe_dirs, timeout=LINT_TIMEOUT):
+    # Lint the extensions in parallel, the results come back in the same order.
+    results = []
+    for recipe_dir, result in zip(recipe_dirs, worker_pool.map(lint_recipe, recipe_dirs, timeout=timeout)):
+        if isinstance(result, WorkerTimeout):
+            print('ERROR: linting {} timed out.'.format(recipe_dir))
+            result = [LINT_TIMED_OUT.format(timeout)], [], False
+        elif isinstance(result, WorkerError):
+            print('ERROR:', result)
+            result = [LINT_FAILED], [], False
+        results.append(result)
+    return results
+
+
+def select_recipes(repo, head_commit, merge_commit, ignore_base=False, changed_only=False):
+    # The extensions to lint (relative to the root of the repository, sorted for a consistent linting order):
+    # those the PR touches, or all of those in the merged tree less those of the base branch if ``ignore_base``.
+    if not (ignore_base or changed_only):
+        return sorted(set(find_recipes_in_commit(repo, merge_commit)))
+
+    num_parents = len(merge_commit.parents)
+    assert num_parents == 2, textwrap.dedent("""
+           Expected merging our PR with the base branch would have two parents.
+           Instead there were %i parents found. :/
+           """ % num_parents)
+    base_commit = (set(merge_commit.parents) - {head_commit}).pop()
+
+    if changed_only:
+        return sorted(set(find_changed_recipes(repo, base_commit, head_commit, merge_commit)))
+    return sorted(set(find_recipes_in_commit(repo, merge_commit)) - set(find_recipes_in_commit(repo, base_commit)))
+
+
+@contextmanager
+def lint_workspace(url, workspace=None):
+    # Lint in the job's workspace if it has one (and give it back as we found it), otherwise in a clone of our own.
+    if workspace is not None:
+        try:
+            yield workspace
+        finally:
+            workspace.restore()
+        return
+    with tmp_directory() as tmp_dir:
+        with stage('lint', 'clone'):
+            workspace = Workspace.clone(url, tmp_dir)
+        yield workspace
+
+
+def fetch_pr_refs(workspace, url, pr_id):
+    """
+    Fetch the head and merge refs of a PR from ``url``, the base repository
+    (the workspace may be a clone of the PR's fork). The merge ref is None
+    if GitHub couldn't merge the PR.
+    """
+    repo = workspace.repo
+    try:
+        workspace.fetch(url, [
+            'pull/{pr}/head:pull/{pr}/head'.format(pr=pr_id),
+            'pull/{pr}/merge:pull/{pr}/merge'.format(pr=pr_id)
+        ])
+        return repo.refs['pull/{pr}/head'.format(pr=pr_id)], repo.refs['pull/{pr}/merge'.format(pr=pr_id)]
+    except GitCommandError:
+        # Either `merge` doesn't exist because the PR was opened
+        # in conflict or it is closed and it can't be the latter.
+        workspace.fetch(url, [
+            'pull/{pr}/head:pull/{pr}/head'.format(pr=pr_id)
+        ])
+        return repo.refs['pull/{pr}/head'.format(pr=pr_id)], None
+
+
+def lint_with_cache(workspace, commit, recipes):
+    # The ``[lints, hints]`` of each of ``recipes`` (checked out from ``commit`` in the workspace), in the same
+    # order. Only those whose tree isn't in the lint cache are linted.
+    results = {}
+    cache_keys = {}
+    for rel_path in recipes:
+        tree = commit.tree if rel_path == '.' else commit.tree.join(rel_path)
+        cache_keys[rel_path] = lint_cache_key(tree.hexsha)
+        cached = lint_cache.get(cache_keys[rel_path])
+        if cached is not None:
+            results[rel_path] = cached
+
+    to_lint = [rel_path for rel_path in recipes if rel_path not in results]
+    print('Lint cache: {} hits, {} misses.'.format(len(results), len(to_lint)))
+    lint_cache_lookups.inc(len(results), result='hit')
+    lint_cache_lookups.inc(len(to_lint), result='miss')
+    linted = lint_recipes([os.path.join(workspace.path, rel_path) for rel_path in to_lint])
+    for rel_path, (lints, hints, ok) in zip(to_lint, linted):
+        results[rel_path] = [lints, hints]
+        if ok:
+            lint_cache.set(cache_keys[rel_path], [lints, hints])
+    return [results[rel_path] for rel_path in recipes]
+
+
+def compute_lint_message(repo_owner, repo_name, pr_id, ignore_base=False, changed_only=None, workspace=None):
+    if changed_only is None:
+        changed_only = bool(int(os.environ.get('LINT_CHANGED_ONLY', 0)))
+
+    if github_graphql.USE_GRAPHQL:
+        remote_repo = github_graphql.Repository(repo_owner, repo_name)
+    else:
+        # Only reads, so any of our tokens will do.
+        remote_repo = get_repo(repo_owner, repo_name, token=read_token())
 
-    owner = gh.get_user(repo_owner)
-    remote_repo = owner.get_repo(repo_name)
+    with stage('lint', 'wait_mergeable'):
+        mergeable = wait_for_mergeable(remote_repo, repo_owner, repo_name, pr_id)
+    if mergeable is None:
+        return {}
 
-    mergeable = None
-    while mergeable is None:
-        time.sleep(1.0)
-        pull_request = remote_repo.get_pull(pr_id)
-        if pull_request.state != "open":
-            return {}
-        mergeable = pull_request.mergeable
+    with lint_workspace(remote_repo.clone_url, workspace) as workspace:
+        repo = workspace.repo
 
-    with tmp_directory() as tmp_dir:
-        repo = Repo.clone_from(remote_repo.clone_url, tmp_dir)
-
-        # Retrieve the PR refs.
-        try:
-            repo.remotes.origin.fetch([
-                'pull/{pr}/head:pull/{pr}/head'.format(pr=pr_id),
-                'pull/{pr}/merge:pull/{pr}/merge'.format(pr=pr_id)
-            ])
-            ref_head = repo.refs['pull/{pr}/head'.format(pr=pr_id)]
-            ref_merge = repo.refs['pull/{pr}/merge'.format(pr=pr_id)]
-        except GitCommandError:
-            # Either `merge` doesn't exist because the PR was opened
-            # in conflict or it is closed and it can't be the latter.
-            repo.remotes.origin.fetch([
-                'pull/{pr}/head:pull/{pr}/head'.format(pr=pr_id)
-            ])
-            ref_head = repo.refs['pull/{pr}/head'.format(pr=pr_id)]
+        with stage('lint', 'fetch'):
+            ref_head, ref_merge = fetch_pr_refs(workspace, remote_repo.clone_url, pr_id)
         sha = str(ref_head.commit.hexsha)
 
         # Check if the linter is skipped via the commit message.
@@ -79,43 +335,22 @@ def compute_lint_message(repo_owner, repo_name, pr_id, ignore_base=False):
 
             return lint_info
 
-        # Collect recipes from base that should be ignored.
-        base_recipes = []
-        if ignore_base:
-            num_parents = len(ref_merge.commit.parents)
-            assert num_parents == 2, textwrap.dedent("""
-                   Expected merging our PR with the base branch would have two parents.
-                   Instead there were %i parents found. :/
-                   """ % num_parents)
-            base_commit = (set(ref_merge.commit.parents) - {ref_head.commit}).pop()
-            ref_base = repo.create_head("pull/{pr}/base".format(pr=pr_id), base_commit)
-            ref_base.checkout(force=True)
-            base_recipes = find_recipes(tmp_dir)
-
-        # Get the list of recipes and prep for linting.
-        ref_merge.checkout(force=True)
-        recipes = find_recipes(tmp_dir)
+        with stage('lint', 'find_recipes'):
+            pr_recipes = select_recipes(repo, ref_head.commit, ref_merge.commit, ignore_base, changed_only)
+
+        # Prep for linting, only the extensions we lint are needed.
+        with stage('lint', 'checkout'):
+            workspace.checkout(pr_recipes, ref=ref_merge)
         all_pass = True
         messages = []
         hints = []
 
-        # Exclude some things from our list of recipes.
-        # Sort the recipes for consistent linting order (which glob doesn't give us).
-        pr_recipes = sorted(set(recipes) - set(base_recipes))
+        with stage('lint', 'lint'):
+            results = lint_with_cache(workspace, ref_merge.commit, pr_recipes)
 
         rel_pr_recipes = []
-        for recipe_dir in pr_recipes:
-            rel_path = os.path.relpath(recipe_dir, tmp_dir)
+        for rel_path, (lints, hints) in zip(pr_recipes, results):
             rel_pr_recipes.append(rel_path)
-            try:
-                lints, hints = nwb_extensions_smithy.lint_recipe.main(recipe_dir, conda_forge=True, return_hints=True)
-
-            except Exception as err:
-                print('ERROR:', err)
-                lints = ["Failed to even lint the extension, probably because of a nwb-extensions-smithy bug :cry:. "
-                         "This likely indicates a problem in your `ndx-meta.yaml`, though. "
-                         "To get a traceback to help figure out what's going on, install nwb-extensions-smithy "
-                         "and run `nwb extensions smithy recipe-lint .` from the extension directory. "]
             if lints:
                 all_pass = False
                 messages.append("\nFor **{}**:\n\n{}".format(rel_path,
@@ -179,52 +414,139 @@ def compute_lint_message(repo_owner, repo_name, pr_id, ignore_base=False):
     return lint_info
 
 
+# The bot's latest comment on each PR, so that we don't have to list all the comments to find it.
+comment_index = SQLiteCache(cache_path('bot_comments.sqlite'),
+                            max_entries=int(os.environ.get('COMMENT_INDEX_SIZE', 10000)))
+
+IndexedComment = namedtuple('IndexedComment', ['id', 'html_url'])
+
+
+def _body_hash(body):
+    return hashlib.sha1(body.encode('utf-8')).hexdigest()
+
+
+def _index_comment(owner, repo_name, pr_id, search, comment, body):
+    # Entries are kept per ``search`` string: the latest bot comment that contains it
+    # (any bot comment for ``search=None``), which is what listing the comments would find.
+    index_key = '{}/{}#{}'.format(owner, repo_name, pr_id)
+    entries = comment_index.get(index_key, {})
+    entry = {'id': comment.id, 'node_id': getattr(comment, 'node_id', None),
+             'hash': _body_hash(body), 'html_url': comment.html_url}
+    entries[search or ''] = entry
+    for other_search in entries:
+        if other_search in body:
+            entries[other_search] = entry
+    comment_index.set(index_key, entries)
+
+
+def _comment_exists(owner, repo_name, comment_id):
+    # A conditional request (see http_cache), so it is usually a 304 that doesn't count against the rate limit.
+    try:
+        get_github(read_token()).requester.requestJsonAndCheck(
+            'GET', '/repos/{}/{}/issues/comments/{}'.format(owner, repo_name, comment_id))
+    except github.UnknownObjectException:
+        return False
+    return True
+
+
 def comment_on_pr(owner, repo_name, pr_id, message, force=False, search=None):
-    gh = github.Github(os.environ['GH_TOKEN'])
+    index_key = '{}/{}#{}'.format(owner, repo_name, pr_id)
+    entry = comment_index.get(index_key, {}).get(search or '')
 
-    user = gh.get_user(owner)
-    repo = user.get_repo(repo_name)
+    # Nothing to do if our last comment already says this, as long as nobody deleted it.
+    if not force and entry is not None and entry['hash'] == _body_hash(message):
+        if _comment_exists(owner, repo_name, entry['id']):
+            return IndexedComment(entry['id'], entry['html_url'])
+        entry = None
+
+    if github_graphql.USE_GRAPHQL:
+        return _graphql_comment_on_pr(owner, repo_name, pr_id, message, force, search, entry)
+
+    repo = get_repo(owner, repo_name)
     issue = repo.get_issue(pr_id)
 
     if force:
-        return issue.create_comment(message)
-
-    comments = list(issue.get_comments())
-    comment_owners = [comment.user.login for comment in comments]
+        comment = issue.create_comment(message)
+        _index_comment(owner, repo_name, pr_id, search, comment, message)
+        return comment
 
     my_last_comment = None
-    my_login = gh.get_user().login
-    if my_login in comment_owners:
-        my_comments = [comment for comment in comments
-                       if comment.user.login == my_login]
-        if search is not None:
-            my_comments = [comment for comment in my_comments
-                           if search in comment.body]
-        my_last_comment = my_comments[-1]
-
-    # Only comment if we haven't before, or if the message we have is different.
-    if my_last_comment is None or my_last_comment.body != message:
+    if entry is not None:
+        try:
+            my_last_comment = issue.get_comment(entry['id'])
+        except github.UnknownObjectException:
+            # Someone deleted it, look for another one.
+            pass
+
+    if my_last_comment is None:
+        comments = list(issue.get_comments())
+        comment_owners = [comment.user.login for comment in comments]
+
+        my_login = get_login()
+        if my_login in comment_owners:
+            my_comments = [comment for comment in comments
+                           if comment.user.login == my_login]
+            if search is not None:
+                my_comments = [comment for comment in my_comments
+                               if search in comment.body]
+            if my_comments:
+                my_last_comment = my_comments[-1]
+
+    # Only comment if we haven't before, otherwise update our comment if the message is different.
+    if my_last_comment is None:
         my_last_comment = issue.create_comment(message)
+    elif my_last_comment.body != message:
+        my_last_comment.edit(message)
+    _index_comment(owner, repo_name, pr_id, search, my_last_comment, message)
 
     return my_last_comment
 
 
-def set_pr_status(owner, repo_name, lint_info, target_url=None):
-    gh = github.Github(os.environ['GH_TOKEN'])
-
-    user = gh.get_user(owner)
-    repo = user.get_repo(repo_name)
-    if lint_info:
-        commit = repo.get_commit(lint_info['sha'])
-        if lint_info['status'] == 'good':
-            commit.create_status("success", description="All extensions are excellent.",
-                                 context="nwb-extensions-linter", target_url=target_url)
-        elif lint_info['status'] == 'mixed':
-            commit.create_status("success", description="Some extensions have hints.",
-                                 context="nwb-extensions-linter", target_url=target_url)
+def _graphql_comment_on_pr(owner, repo_name, pr_id, message, force, search, entry):
+    # comment_on_pr in one query and one mutation at most.
+    if not force and entry is not None and entry.get('node_id'):
+        try:
+            comment = github_graphql.update_comment(
+                github_graphql.Comment(entry['id'], entry['node_id'], entry['html_url'], None), message)
+        except github.GithubException:
+            # Someone deleted it, look for another one.
+            pass
         else:
-            commit.create_status("failure", description="Some extensions need some changes.",
-                                 context="nwb-extensions-linter", target_url=target_url)
+            _index_comment(owner, repo_name, pr_id, search, comment, message)
+            return comment
+
+    pull_request = github_graphql.fetch_pull_request(owner, repo_name, pr_id)
+    my_comments = pull_request.bot_comments
+    if search is not None:
+        my_comments = [comment for comment in my_comments if search in comment.body]
+
+    if force or not my_comments:
+        comment = github_graphql.add_comment(pull_request.node_id, message)
+    else:
+        comment = my_comments[-1]
+        if comment.body != message:
+            comment = github_graphql.update_comment(comment, message)
+    _index_comment(owner, repo_name, pr_id, search, comment, message)
+    return comment
+
+
+def set_pr_status(owner, repo_name, lint_info, target_url=None):
+    if not lint_info:
+        return
+    if lint_info['status'] == 'good':
+        state, description = "success", "All extensions are excellent."
+    elif lint_info['status'] == 'mixed':
+        state, description = "success", "Some extensions have hints."
+    else:
+        state, description = "failure", "Some extensions need some changes."
+
+    if github_graphql.USE_GRAPHQL:
+        github_graphql.create_status(owner, repo_name, lint_info['sha'], state, description,
+                                     "nwb-extensions-linter", target_url=target_url)
+    else:
+        commit = get_repo(owner, repo_name).get_commit(lint_info['sha'])
+        commit.create_status(state, description=description,
+                             context="nwb-extensions-linter", target_url=target_url)
 
 
 def main():
@@ -237,11 +559,14 @@ def main():
     parser.add_argument('--ignore-base',
                         help='Ignore extensions in the base branch of the PR',
                         action='store_true')
+    parser.add_argument('--changed-only',
+                        help='Only lint the extensions changed by the PR',
+                        action='store_true', default=None)
 
     args = parser.parse_args()
     owner, repo_name = args.repo.split('/')
 
-    lint_info = compute_lint_message(owner, repo_name, args.pr, args.ignore_base)
+    lint_info = compute_lint_message(owner, repo_name, args.pr, args.ignore_base, args.changed_only)
 
     if not lint_info:
         print('Linting was skipped.')
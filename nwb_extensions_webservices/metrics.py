@@ -0,0 +1,250 @@
+import bisect
+import os
+import shutil
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from glob import glob
+
+import tornado.log
+
+from .jobs import job_queue
+from .repo_cache import dir_size, repo_cache
+
+# In seconds, from a webhook reply to a full lint.
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(name, _escape(value)) for name, value in labels) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric(object):
+    type = None
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def samples(self):
+        raise NotImplementedError
+
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, self.help),
+                 '# TYPE {} {}'.format(self.name, self.type)]
+        for name, labels, value in self.samples():
+            lines.append('{}{} {}'.format(name, _format_labels(labels), _format_value(value)))
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        for labels, value in values:
+            yield self.name, labels, value
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, help, buckets=BUCKETS):
+        super(Histogram, self).__init__(name, help)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._values[key] = (counts, total + value)
+
+    def samples(self):
+        with self._lock:
+            values = sorted((labels, (list(counts), total)) for labels, (counts, total) in self._values.items())
+        for labels, (counts, total) in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                yield self.name + '_bucket', labels + (('le', _format_value(bound)),), cumulative
+            yield self.name + '_sum', labels, total
+            yield self.name + '_count', labels, cumulative
+
+
+class Gauge(Metric):
+    # Read when scraped. ``func`` returns a number, or a dict of label tuples to numbers, or None for no samples.
+    type = 'gauge'
+
+    def __init__(self, name, help, func):
+        super(Gauge, self).__init__(name, help)
+        self.func = func
+
+    def samples(self):
+        value = self.func()
+        if value is None:
+            return
+        if not isinstance(value, dict):
+            value = {(): value}
+        for labels, value in sorted(value.items()):
+            yield self.name, labels, value
+
+
+class BackgroundValue(object):
+    """
+    A value too slow to compute on every scrape (like the size of a directory
+    tree), computed every ``interval`` seconds by a thread that is started on
+    the first call. Calling it returns the latest value, None until there is one.
+    """
+    def __init__(self, func, interval):
+        self.func = func
+        self.interval = interval
+        self.value = None
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def __call__(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                # Not started yet, or started before we were forked (threads don't survive that).
+                self._pid = os.getpid()
+                thread = threading.Thread(target=self._update, name='metrics-{}'.format(self.func.__name__))
+                thread.daemon = True
+                thread.start()
+        return self.value
+
+    def _update(self):
+        while True:
+            try:
+                self.value = self.func()
+            except Exception as err:
+                print('Could not compute {}: {}'.format(self.func.__name__, err))
+            time.sleep(self.interval)
+
+
+class Registry(object):
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        return '\n'.join(metric.render() for metric in self._metrics) + '\n'
+
+
+registry = Registry()
+
+http_requests = registry.register(Counter(
+    'nwb_webservices_http_requests_total', 'HTTP requests by handler, method and status code.'))
+http_request_seconds = registry.register(Histogram(
+    'nwb_webservices_http_request_seconds', 'Time taken to reply to HTTP requests, by handler.'))
+job_wait_seconds = registry.register(Histogram(
+    'nwb_webservices_job_wait_seconds', 'Time jobs spent in the queue, by job.'))
+job_run_seconds = registry.register(Histogram(
+    'nwb_webservices_job_run_seconds', 'Time taken to run jobs, by job.'))
+job_failures = registry.register(Counter(
+    'nwb_webservices_job_failures_total', 'Jobs that raised an exception, by job.'))
+stage_seconds = registry.register(Histogram(
+    'nwb_webservices_stage_seconds', 'Time taken by each stage of a task (clone, lint, comment, ...).'))
+lint_cache_lookups = registry.register(Counter(
+    'nwb_webservices_lint_cache_lookups_total', 'Extensions looked up in the lint cache, by result (hit or miss).'))
+subprocess_wait_seconds = registry.register(Histogram(
+    'nwb_webservices_subprocess_wait_seconds', 'Time commands (like rerenders) waited for a slot, by executor.'))
+subprocess_timeouts = registry.register(Counter(
+    'nwb_webservices_subprocess_timeouts_total', 'Commands killed for running too long, by executor.'))
+
+
+# How often the disk used by checkouts and the repository cache is measured, walking them takes
+# longer the bigger they are.
+DISK_USAGE_INTERVAL = int(os.environ.get('METRICS_DISK_USAGE_INTERVAL', 60))
+
+
+def _workspaces_bytes():
+    # The checkouts made by utils.tmp_directory that are in use right now.
+    return sum(dir_size(path) for path in glob(os.path.join(tempfile.gettempdir(), '*_extensions')))
+
+
+def _repo_cache_bytes():
+    return dir_size(repo_cache.root)
+
+
+def _tmp_disk():
+    usage = shutil.disk_usage(tempfile.gettempdir())
+    return {(('kind', 'used'),): usage.used, (('kind', 'free'),): usage.free}
+
+
+registry.register(Gauge('nwb_webservices_job_queue_depth', 'Jobs waiting for a worker.',
+                        lambda: job_queue.depth))
+registry.register(Gauge('nwb_webservices_jobs_running', 'Jobs being run.',
+                        lambda: job_queue.stats()['running']))
+registry.register(Gauge('nwb_webservices_workspace_bytes', 'Disk used by temporary checkouts.',
+                        BackgroundValue(_workspaces_bytes, DISK_USAGE_INTERVAL)))
+registry.register(Gauge('nwb_webservices_repo_cache_bytes', 'Disk used by the repository mirror cache.',
+                        BackgroundValue(_repo_cache_bytes, DISK_USAGE_INTERVAL)))
+registry.register(Gauge('nwb_webservices_tmp_disk_bytes', 'Usage of the disk holding temporary files.',
+                        _tmp_disk))
+
+
+@contextmanager
+def stage(task, name):
+    """Time a stage of a task, e.g. ``with stage('lint', 'clone'):``."""
+    start = time.time()
+    try:
+        yield
+    finally:
+        stage_seconds.observe(time.time() - start, task=task, stage=name)
+
+
+@contextmanager
+def time_job(job):
+    # A JobQueue hook.
+    job_wait_seconds.observe(job.wait_time, job=job.name)
+    start = time.time()
+    try:
+        yield
+    except Exception:
+        job_failures.inc(job=job.name)
+        raise
+    finally:
+        job_run_seconds.observe(time.time() - start, job=job.name)
+
+
+def log_request(handler):
+    # Tornado's log_function: record the request, then log it as tornado would have.
+    status = handler.get_status()
+    request_time = handler.request.request_time()
+    name = getattr(handler, 'hook_name', None) or type(handler).__name__
+    http_requests.inc(handler=name, method=handler.request.method, code=status)
+    http_request_seconds.observe(request_time, handler=name)
+
+    if status < 400:
+        log_method = tornado.log.access_log.info
+    elif status < 500:
+        log_method = tornado.log.access_log.warning
+    else:
+        log_method = tornado.log.access_log.error
+    log_method("%d %s %s (%s) %.2fms", status, handler.request.method, handler.request.uri,
+               handler.request.remote_ip, 1000.0 * request_time)
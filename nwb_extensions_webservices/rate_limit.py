@@ -0,0 +1,76 @@
+import hashlib
+import threading
+import time
+
+from .jobs import current_job
+
+
+def token_fingerprint(token):
+    # Enough to tell our tokens apart without putting them in logs or endpoints.
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()[:8]
+
+
+def _auth_token(auth):
+    # "token <token>" or "Bearer <token>"
+    return auth.split(' ', 1)[-1]
+
+
+class RateLimitTracker(object):
+    """
+    The rate limit of each token, as reported by the responses we already get.
+
+    Every GitHub response carries ``X-RateLimit-*`` headers, so we never have
+    to ask for the rate limit. Requests are also counted per job name, to
+    show which handlers spend the budget.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tokens = {}
+        self._handlers = {}
+
+    def record(self, auth, status, headers):
+        if 'x-ratelimit-remaining' not in headers or not auth:
+            return
+        fingerprint = token_fingerprint(_auth_token(auth))
+        resource = headers.get('x-ratelimit-resource', 'core')
+        job = current_job()
+        handler = job.name if job is not None else 'other'
+        # A 304 for a conditional request is free.
+        cost = 0 if status == 304 else 1
+        with self._lock:
+            self._tokens.setdefault(fingerprint, {})[resource] = {
+                'limit': int(headers.get('x-ratelimit-limit', 0)),
+                'remaining': int(headers['x-ratelimit-remaining']),
+                'reset': int(headers.get('x-ratelimit-reset', 0)),
+                'updated': time.time()}
+            stats = self._handlers.setdefault(handler, {}).setdefault(
+                resource, {'requests': 0, 'consumed': 0})
+            stats['requests'] += 1
+            stats['consumed'] += cost
+
+    def remaining(self, token, resource='core'):
+        """The last known ``(remaining, limit, reset)`` of a token, if we have seen it."""
+        with self._lock:
+            rate = self._tokens.get(token_fingerprint(token), {}).get(resource)
+        if rate is None:
+            return None
+        if rate['reset'] <= time.time():
+            # The window has reset since we last heard.
+            return rate['limit'], rate['limit'], rate['reset']
+        return rate['remaining'], rate['limit'], rate['reset']
+
+    def reset(self):
+        with self._lock:
+            self._tokens.clear()
+            self._handlers.clear()
+
+    def stats(self):
+        with self._lock:
+            tokens = {fingerprint: {resource: dict(rate) for resource, rate in resources.items()}
+                      for fingerprint, resources in self._tokens.items()}
+            handlers = {handler: {resource: dict(stats) for resource, stats in resources.items()}
+                        for handler, resources in self._handlers.items()}
+        return {'tokens': tokens, 'handlers': handlers}
+
+
+rate_limits = RateLimitTracker()
@@ -0,0 +1,200 @@
+import fcntl
+import hashlib
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+from urllib.parse import urlsplit, urlunsplit
+
+from git import Repo
+
+
+def strip_credentials(url):
+    # Tokens are embedded in some of our clone urls, they must not end up in the cache key.
+    parts = urlsplit(url)
+    if not parts.username and not parts.password:
+        return url
+    netloc = parts.hostname
+    if parts.port:
+        netloc += ':{}'.format(parts.port)
+    return urlunsplit((parts.scheme, netloc, parts.path, parts.query, parts.fragment))
+
+
+def dir_size(path):
+    size = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                size += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return size
+
+
+class RepoCache(object):
+    """
+    Bare mirrors of the repositories we work on, keyed by url.
+
+    Every clone starts by incrementally fetching the mirror and then makes a
+    local clone from it (hardlinking objects where possible), so an event
+    only has to download the objects that are new since the last one.
+    Least recently used mirrors are evicted once the cache grows beyond
+    ``max_bytes``.
+    """
+    def __init__(self, root, max_bytes):
+        self.root = root
+        self.max_bytes = max_bytes
+
+    def mirror_dir(self, url):
+        url = strip_credentials(url)
+        name = os.path.basename(url.rstrip('/'))
+        if name.endswith('.git'):
+            name = name[:-len('.git')]
+        digest = hashlib.sha1(url.encode('utf-8')).hexdigest()[:12]
+        return os.path.join(self.root, '{}-{}.git'.format(name, digest))
+
+    @contextmanager
+    def _locked(self, mirror, blocking=True):
+        # flock rather than a threading lock, the cache is shared by all WEB_CONCURRENCY processes.
+        os.makedirs(self.root, exist_ok=True)
+        with open(mirror + '.lock', 'a') as fh:
+            flags = fcntl.LOCK_EX
+            if not blocking:
+                flags |= fcntl.LOCK_NB
+            try:
+                fcntl.flock(fh, flags)
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(fh, fcntl.LOCK_UN)
+
+    def _fetch(self, url, mirror):
+        if not os.path.isdir(mirror):
+            try:
+                repo = Repo.clone_from(url, mirror, bare=True)
+                repo.delete_remote('origin')
+            except Exception:
+                shutil.rmtree(mirror, ignore_errors=True)
+                raise
+        else:
+            repo = Repo(mirror)
+            # Fetch from the url directly so that no token is stored in the mirror's config.
+            repo.git.fetch(url, '+refs/heads/*:refs/heads/*', '+refs/tags/*:refs/tags/*', '--prune')
+        os.utime(mirror, None)
+
+    def update(self, url):
+        mirror = self.mirror_dir(url)
+        with self._locked(mirror):
+            self._fetch(url, mirror)
+        self.evict(keep=mirror)
+        return mirror
+
+    def clone_from(self, url, to_path, **kwargs):
+        mirror = self.mirror_dir(url)
+        with self._locked(mirror):
+            self._fetch(url, mirror)
+            repo = Repo.clone_from(mirror, to_path, **kwargs)
+        repo.remotes.origin.set_url(url)
+        self.evict(keep=mirror)
+        return repo
+
+    def evict(self, keep=None):
+        if not os.path.isdir(self.root):
+            return
+        mirrors = [os.path.join(self.root, name) for name in os.listdir(self.root)
+                   if name.endswith('.git')]
+        sizes = {mirror: dir_size(mirror) for mirror in mirrors}
+        total = sum(sizes.values())
+        for mirror in sorted(mirrors, key=os.path.getmtime):
+            if total <= self.max_bytes:
+                break
+            if mirror == keep:
+                continue
+            with self._locked(mirror, blocking=False) as acquired:
+                # Skip mirrors that are being fetched or cloned from right now.
+                if not acquired:
+                    continue
+                print('Evicting {} from the repository cache.'.format(os.path.basename(mirror)))
+                shutil.rmtree(mirror, ignore_errors=True)
+                total -= sizes[mirror]
+
+
+repo_cache = RepoCache(
+    os.environ.get('REPO_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'nwb_extensions_mirrors')),
+    int(os.environ.get('REPO_CACHE_MAX_MB', 2048)) * 1024 * 1024)
+
+
+def clone_from(url, to_path, **kwargs):
+    """A drop-in for ``Repo.clone_from`` that goes through the mirror cache."""
+    return repo_cache.clone_from(url, to_path, **kwargs)
+
+
+# How job workspaces are cloned. With ``mirror`` they are cloned through the cache of mirrors and fully checked
+# out. With ``partial`` they are cloned from the remote without any file contents (``--filter=blob:none``) and
+# only the directories we need are checked out (and so downloaded), which suits hosts without a persistent disk.
+CLONE_MODE = os.environ.get('REPO_CLONE_MODE', 'mirror')
+
+
+def clone_workspace(url, to_path, mode=None, **kwargs):
+    """Clone ``url`` for ``checkout_paths``, which has to be called before using the working tree."""
+    if (mode or CLONE_MODE) == 'partial':
+        return Repo.clone_from(url, to_path, multi_options=['--filter=blob:none', '--no-checkout'], **kwargs)
+    return clone_from(url, to_path, **kwargs)
+
+
+def checkout_paths(repo, paths, ref=None, mode=None):
+    """
+    Check out ``ref`` (HEAD by default), needing only the directories ``paths``.
+
+    Clones made in ``partial`` mode get a cone mode sparse checkout of those
+    directories (and the files at the top of the repository), other clones
+    are checked out in full.
+    """
+    args = ['--force'] + ([str(ref)] if ref is not None else [])
+    if (mode or CLONE_MODE) == 'partial':
+        if '.' in paths or '' in paths:
+            repo.git.sparse_checkout('disable')
+        else:
+            repo.git.sparse_checkout('set', '--cone', *paths)
+    repo.git.checkout(*args)
+
+
+class Workspace(object):
+    """
+    A clone made once for a job and shared by its steps, e.g. relinting and
+    rerendering a PR. A step that checks out something else has to call
+    ``restore`` once it is done, to put back what was checked out before.
+    """
+    def __init__(self, repo, mode=None):
+        self.repo = repo
+        self.path = repo.working_tree_dir
+        # How it was cloned, see CLONE_MODE.
+        self.mode = mode or CLONE_MODE
+        self.head = repo.head.commit.hexsha if repo.head.is_detached else repo.head.ref.name
+        # What is checked out, and so what ``restore`` checks out again.
+        self.paths = self._checked_out_paths() if self.mode == 'partial' else ['.']
+
+    def _checked_out_paths(self):
+        # The directories of a sparse checkout, everything (``.``) for a full one, or
+        # only the files at the top of the repository if nothing was checked out yet.
+        # Asking git, newer versions keep this in the worktree's config, which GitPython doesn't read.
+        if self.repo.git.config('--get', '--bool', 'core.sparseCheckout', with_exceptions=False) == 'true':
+            return self.repo.git.sparse_checkout('list').splitlines()
+        return ['.'] if os.path.exists(os.path.join(self.repo.git_dir, 'index')) else []
+
+    @classmethod
+    def clone(cls, url, to_path, mode=None, **kwargs):
+        return cls(clone_workspace(url, to_path, mode=mode, **kwargs), mode=mode)
+
+    def fetch(self, url, refspecs):
+        # From ``url`` rather than origin, which may be a fork (and the credentials are in the url).
+        self.repo.git.fetch(url, *refspecs)
+
+    def checkout(self, paths, ref=None):
+        checkout_paths(self.repo, paths, ref=ref, mode=self.mode)
+
+    def restore(self):
+        self.checkout(self.paths, ref=self.head)
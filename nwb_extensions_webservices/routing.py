@@ -0,0 +1,68 @@
+from collections import namedtuple
+import json
+import json.decoder
+import re
+
+# A webhook route: for which events, which top-level members of the payload are needed,
+# predicates on those members that must all hold, and a function of ``(event, payload)``
+# that returns the ``Work`` to queue (or None). A route without a job accepts its events
+# and does nothing. ``job_members`` are members only the job needs, which are decoded
+# once the filters pass (for bulky ones, like a push's ``head_commit``).
+Route = namedtuple('Route', ['events', 'members', 'filters', 'job', 'job_members'])
+Route.__new__.__defaults__ = ((),)
+
+Work = namedtuple('Work', ['name', 'func', 'args', 'key'])
+
+_decoder = json.JSONDecoder()
+_whitespace = re.compile(r'[ \t\n\r]*')
+
+
+def decode_members(body, names):
+    """
+    Decode only the top-level members ``names`` of a JSON object.
+
+    The object is read member by member and reading stops as soon as all of
+    ``names`` have been found, so anything after them (like the list of
+    commits in a push) is never decoded. Missing members are left out.
+    """
+    text = body.decode('utf-8') if isinstance(body, bytes) else body
+    names = set(names)
+    found = {}
+    ws = _whitespace.match
+    try:
+        end = ws(text, 0).end()
+        if text[end:end + 1] != '{':
+            raise ValueError('Expected a JSON object.')
+        end = ws(text, end + 1).end()
+        if text[end:end + 1] == '}':
+            return found
+        while names:
+            if text[end:end + 1] != '"':
+                raise ValueError('Expected a member name at {}.'.format(end))
+            name, end = json.decoder.scanstring(text, end + 1)
+            end = ws(text, end).end()
+            if text[end:end + 1] != ':':
+                raise ValueError('Expected ":" at {}.'.format(end))
+            value, end = _decoder.scan_once(text, ws(text, end + 1).end())
+            if name in names:
+                found[name] = value
+                names.discard(name)
+            end = ws(text, end).end()
+            if text[end:end + 1] == '}':
+                break
+            if text[end:end + 1] != ',':
+                raise ValueError('Expected "," or "}}" at {}.'.format(end))
+            end = ws(text, end + 1).end()
+    except StopIteration as err:
+        raise ValueError('Expected a value at {}.'.format(err.value))
+    return found
+
+
+def route_payload(route, body):
+    """The members of ``body`` that ``route`` needs, or None if its filters reject it."""
+    payload = decode_members(body, route.members)
+    if not all(accept(payload) for accept in route.filters):
+        return None
+    if route.job_members:
+        payload.update(decode_members(body, route.job_members))
+    return payload
@@ -0,0 +1,259 @@
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+
+def cache_path(name):
+    cache_dir = os.environ.get('CACHE_DIR', os.path.join(tempfile.gettempdir(), 'nwb_extensions_cache'))
+    os.makedirs(cache_dir, exist_ok=True)
+    return os.path.join(cache_dir, name)
+
+
+class SQLiteCache(object):
+    """
+    A size-bounded key/value store of JSON values in a SQLite file.
+
+    The file can be shared by all WEB_CONCURRENCY processes. Once there are
+    more than ``max_entries`` entries the least recently used ones are
+    evicted, and entries older than ``ttl`` seconds are treated as missing.
+    Evicting counts the entries, so it is only done every ``evict_every``
+    writes (by this process), and there can be that many extra entries.
+    """
+    def __init__(self, path, max_entries=10000, ttl=None, evict_every=100):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.evict_every = evict_every
+        self.hits = 0
+        self.misses = 0
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @property
+    def _db(self):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('CREATE TABLE IF NOT EXISTS cache '
+                       '(key TEXT PRIMARY KEY, value TEXT, created REAL, accessed REAL)')
+            db.execute('CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed)')
+            db.execute('CREATE INDEX IF NOT EXISTS cache_created ON cache (created)')
+            self._local.db = db
+        return db
+
+    def _expired(self, created):
+        return self.ttl is not None and created < time.time() - self.ttl
+
+    def get(self, key, default=None):
+        row = self._db.execute('SELECT value, created FROM cache WHERE key = ?', (key,)).fetchone()
+        if row is None or self._expired(row[1]):
+            with self._lock:
+                self.misses += 1
+            return default
+        with self._lock:
+            self.hits += 1
+        self._db.execute('UPDATE cache SET accessed = ? WHERE key = ?', (time.time(), key))
+        return json.loads(row[0])
+
+    def set(self, key, value):
+        now = time.time()
+        self._db.execute('INSERT OR REPLACE INTO cache (key, value, created, accessed) VALUES (?, ?, ?, ?)',
+                         (key, json.dumps(value), now, now))
+        self._wrote()
+
+    def add(self, key, value):
+        """Set ``key`` unless it is already there, returns whether it was set."""
+        now = time.time()
+        if self.ttl is not None:
+            self._db.execute('DELETE FROM cache WHERE key = ? AND created < ?', (key, now - self.ttl))
+        # A single statement, so only one of several processes adding the same key gets to add it.
+        added = self._db.execute('INSERT OR IGNORE INTO cache (key, value, created, accessed) VALUES (?, ?, ?, ?)',
+                                 (key, json.dumps(value), now, now)).rowcount == 1
+        if added:
+            self._wrote()
+        return added
+
+    def delete(self, key):
+        self._db.execute('DELETE FROM cache WHERE key = ?', (key,))
+
+    def _wrote(self):
+        with self._lock:
+            self._writes += 1
+            due = self._writes % self.evict_every == 0
+        if due:
+            self.evict()
+
+    def evict(self):
+        if self.ttl is not None:
+            self._db.execute('DELETE FROM cache WHERE created < ?', (time.time() - self.ttl,))
+        excess = len(self) - self.max_entries
+        if excess > 0:
+            self._db.execute('DELETE FROM cache WHERE key IN '
+                             '(SELECT key FROM cache ORDER BY accessed LIMIT ?)', (excess,))
+
+    def __len__(self):
+        return self._db.execute('SELECT COUNT(*) FROM cache').fetchone()[0]
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+                'entries': len(self)}
+
+
+class JobStore(object):
+    """
+    A queue of jobs in a SQLite file, shared by every process that opens it.
+
+    Jobs are enqueued, leased by a worker for ``lease_time`` seconds (renewed
+    while they run) and finished with their result or error, which are kept
+    for ``result_ttl`` seconds. Each of these takes the database's write lock,
+    so a job is only ever leased by one process. Jobs whose lease ran out (the
+    process running them died) are run again, at most ``max_attempts`` times.
+
+    Jobs with a ``key`` are coalesced like JobQueue's: enqueueing one replaces
+    a queued job with the same key, or marks a running one as superseded.
+    """
+    def __init__(self, path, lease_time=1800, result_ttl=24 * 60 * 60, max_attempts=3):
+        self.path = path
+        self.lease_time = lease_time
+        self.result_ttl = result_ttl
+        self.max_attempts = max_attempts
+        self._local = threading.local()
+
+    @property
+    def _db(self):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('CREATE TABLE IF NOT EXISTS jobs '
+                       '(id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT, func TEXT, args TEXT, kwargs TEXT, '
+                       'key TEXT, state TEXT, superseded INTEGER DEFAULT 0, attempts INTEGER DEFAULT 0, '
+                       'submitted REAL, not_before REAL, started REAL, finished REAL, owner TEXT, '
+                       'lease_until REAL, result TEXT, error TEXT)')
+            db.execute('CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, not_before)')
+            db.execute('CREATE INDEX IF NOT EXISTS jobs_key ON jobs (key, state)')
+            self._local.db = db
+        return db
+
+    @contextmanager
+    def _transaction(self):
+        # IMMEDIATE takes the write lock up front, so nobody else can lease
+        # the job we are about to between our SELECT and UPDATE.
+        db = self._db
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            yield db
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        db.execute('COMMIT')
+
+    def enqueue(self, name, func, args, kwargs=None, key=None, delay=0, max_depth=None, retry_of=None):
+        """
+        Add a job, to be run in ``delay`` seconds at the earliest.
+
+        ``func`` is the ``module:function`` to call with the JSON ``args`` and
+        ``kwargs``. Returns the id of the job and one of ``'queued'``,
+        ``'collapsed'`` (an existing queued job was updated), ``'superseded'``
+        or ``'full'`` (nothing was added, the id is None). A running job that
+        enqueues its own retry passes its id as ``retry_of``, so that it isn't
+        superseded by it.
+        """
+        now = time.time()
+        values = (func, json.dumps(list(args)), json.dumps(kwargs or {}), now + delay)
+        with self._transaction() as db:
+            running = []
+            if key is not None:
+                for job_id, state in db.execute("SELECT id, state FROM jobs WHERE key = ? AND "
+                                                "state IN ('queued', 'running') ORDER BY id", (key,)):
+                    if state == 'queued':
+                        db.execute('UPDATE jobs SET func = ?, args = ?, kwargs = ?, not_before = ? WHERE id = ?',
+                                   values + (job_id,))
+                        return job_id, 'collapsed'
+                    if job_id != retry_of:
+                        running.append(job_id)
+            if max_depth is not None and self._count(db, 'queued') >= max_depth:
+                return None, 'full'
+            job_id = db.execute('INSERT INTO jobs (name, func, args, kwargs, not_before, key, state, submitted) '
+                                "VALUES (?, ?, ?, ?, ?, ?, 'queued', ?)",
+                                (name,) + values + (key, now)).lastrowid
+            if running:
+                db.executemany('UPDATE jobs SET superseded = 1 WHERE id = ?', [(i,) for i in running])
+                return job_id, 'superseded'
+        return job_id, 'queued'
+
+    def lease(self, owner):
+        """Take the next job that is due, returns a dict of its columns or None."""
+        now = time.time()
+        with self._transaction() as db:
+            db.execute("UPDATE jobs SET state = 'failed', finished = ?, error = ? "
+                       "WHERE state = 'running' AND lease_until < ? AND attempts >= ?",
+                       (now, 'Lease expired {} times.'.format(self.max_attempts), now, self.max_attempts))
+            cursor = db.execute("SELECT * FROM jobs WHERE (state = 'queued' AND not_before <= ?) OR "
+                                "(state = 'running' AND lease_until < ?) ORDER BY not_before, id LIMIT 1",
+                                (now, now))
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            job = dict(zip([column[0] for column in cursor.description], row))
+            db.execute("UPDATE jobs SET state = 'running', owner = ?, started = ?, lease_until = ?, "
+                       "attempts = attempts + 1 WHERE id = ?", (owner, now, now + self.lease_time, job['id']))
+        job['args'] = json.loads(job['args'])
+        job['kwargs'] = json.loads(job['kwargs'])
+        return job
+
+    def renew(self, owner):
+        # Called regularly by each process for the jobs it is running.
+        self._db.execute("UPDATE jobs SET lease_until = ? WHERE state = 'running' AND owner = ?",
+                         (time.time() + self.lease_time, owner))
+
+    def release(self, owner):
+        """Put the jobs ``owner`` is running back in the queue, returns how many there were."""
+        return self._db.execute("UPDATE jobs SET state = 'queued', owner = NULL, lease_until = NULL "
+                                "WHERE state = 'running' AND owner = ?", (owner,)).rowcount
+
+    def finish(self, job_id, result=None, error=None, owner=None):
+        # Given an ``owner``, only while the job is still theirs and not released or leased by someone else.
+        now = time.time()
+        with self._transaction() as db:
+            db.execute('UPDATE jobs SET state = ?, finished = ?, result = ?, error = ?, lease_until = NULL '
+                       'WHERE id = ? AND (? IS NULL OR owner = ?)',
+                       ('done' if error is None else 'failed', now, json.dumps(result, default=repr), error,
+                        job_id, owner, owner))
+            db.execute("DELETE FROM jobs WHERE state IN ('done', 'failed') AND finished < ?",
+                       (now - self.result_ttl,))
+
+    def supersede(self, job_id):
+        self._db.execute('UPDATE jobs SET superseded = 1 WHERE id = ?', (job_id,))
+
+    def is_superseded(self, job_id):
+        row = self._db.execute('SELECT superseded FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return bool(row and row[0])
+
+    def get(self, job_id):
+        """The state, result and error of a job, or None once it has been pruned."""
+        row = self._db.execute('SELECT name, state, result, error, submitted, started, finished FROM jobs '
+                               'WHERE id = ?', (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(zip(['name', 'state', 'result', 'error', 'submitted', 'started', 'finished'], row))
+        job['result'] = json.loads(job['result']) if job['result'] is not None else None
+        return job
+
+    def _count(self, db, state):
+        return db.execute('SELECT COUNT(*) FROM jobs WHERE state = ?', (state,)).fetchone()[0]
+
+    def count(self, state):
+        return self._count(self._db, state)
+
+    def stats(self):
+        return dict(self._db.execute('SELECT state, COUNT(*) FROM jobs GROUP BY state').fetchall())
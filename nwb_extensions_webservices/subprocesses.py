@@ -0,0 +1,176 @@
+import asyncio
+import fcntl
+import os
+import signal
+import sys
+import threading
+import time
+from collections import namedtuple
+
+from .metrics import subprocess_timeouts, subprocess_wait_seconds
+from .store import SQLiteCache, cache_path
+
+RunResult = namedtuple('RunResult', ['returncode', 'timed_out', 'output', 'wait_time', 'run_time', 'log_key'])
+
+# How often a command waiting for a slot held by another process checks again.
+SLOT_POLL_INTERVAL = 0.2
+
+# Sets the memory limit and becomes the command. It runs in a new interpreter: the limit can't be set in the child
+# with preexec_fn, which is unsafe to use from a process with threads (like ours) and can deadlock the child.
+_LIMIT_AND_EXEC = ('import os, resource, sys; '
+                   'resource.setrlimit(resource.RLIMIT_AS, (int(sys.argv[1]), int(sys.argv[1]))); '
+                   'os.execvp(sys.argv[2], sys.argv[2:])')
+
+
+def redact(text):
+    # Our tokens are in clone urls, which git likes to print.
+    for name in ['GH_TOKEN', 'GH_TOKENS', 'CIRCLE_TOKEN']:
+        for token in os.environ.get(name, '').split(','):
+            if token.strip():
+                text = text.replace(token.strip(), '***')
+    return text
+
+
+class SubprocessExecutor(object):
+    """
+    Runs commands as subprocesses from an asyncio loop in a background thread.
+
+    At most ``max_running`` commands run at once across every process that
+    shares ``slot_dir`` (each holds a flock on one of the slot files), the
+    others wait their turn. A command is killed, with its children, after
+    ``timeout`` seconds and can use at most ``max_memory`` bytes of address
+    space. The output of every run is kept in ``logs`` (with our tokens
+    taken out), for finding out what went wrong.
+    """
+    def __init__(self, name, max_running, timeout=None, max_memory=None, slot_dir=None, logs=None,
+                 max_output=1024 * 1024):
+        self.name = name
+        self.max_running = max_running
+        self.timeout = timeout
+        self.max_memory = max_memory
+        self.slot_dir = slot_dir or cache_path('slots')
+        self.logs = logs
+        self.max_output = max_output
+        self._loop = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._stats = {'runs': 0, 'failed': 0, 'timed_out': 0, 'waiting': 0, 'running': 0,
+                       'total_wait': 0.0, 'max_wait': 0.0, 'total_run': 0.0, 'max_run': 0.0}
+
+    def _get_loop(self):
+        with self._lock:
+            # A loop thread doesn't survive a fork, start one in each process.
+            if self._loop is None or self._pid != os.getpid():
+                self._loop = asyncio.new_event_loop()
+                self._pid = os.getpid()
+                thread = threading.Thread(target=self._loop.run_forever, name='{}-executor'.format(self.name))
+                thread.daemon = True
+                thread.start()
+            return self._loop
+
+    def run(self, args, cwd=None, timeout=None, label=None):
+        """Run ``args`` and wait for it, returns a RunResult."""
+        future = asyncio.run_coroutine_threadsafe(
+            self._run(list(args), cwd, timeout or self.timeout, label or self.name), self._get_loop())
+        return future.result()
+
+    def _command(self, args):
+        if self.max_memory:
+            return [sys.executable, '-c', _LIMIT_AND_EXEC, str(self.max_memory)] + args
+        return args
+
+    async def _acquire_slot(self):
+        os.makedirs(self.slot_dir, exist_ok=True)
+        while True:
+            for i in range(self.max_running):
+                fh = open(os.path.join(self.slot_dir, '{}-{}.lock'.format(self.name, i)), 'a')
+                try:
+                    fcntl.flock(fh, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    return fh
+                except BlockingIOError:
+                    fh.close()
+            await asyncio.sleep(SLOT_POLL_INTERVAL)
+
+    async def _run(self, args, cwd, timeout, label):
+        submitted = time.time()
+        self._count('waiting', 1)
+        try:
+            slot = await self._acquire_slot()
+        finally:
+            self._count('waiting', -1)
+        started = time.time()
+        self._count('running', 1)
+        try:
+            returncode, timed_out, output = await self._communicate(args, cwd, timeout)
+        finally:
+            slot.close()
+            self._count('running', -1)
+        result = RunResult(returncode, timed_out, redact(output), started - submitted, time.time() - started, None)
+        self._record(result)
+        if self.logs is not None:
+            key = '{}-{:.0f}'.format(label, submitted * 1000)
+            self.logs.set(key, {'args': [redact(arg) for arg in args], 'cwd': cwd, 'returncode': returncode,
+                                'timed_out': timed_out, 'wait_time': result.wait_time,
+                                'run_time': result.run_time, 'output': result.output})
+            result = result._replace(log_key=key)
+        return result
+
+    async def _communicate(self, args, cwd, timeout):
+        # Everything goes to one pipe, of which we keep the last ``max_output`` bytes.
+        proc = await asyncio.create_subprocess_exec(
+            *self._command(args), cwd=cwd, stdin=asyncio.subprocess.DEVNULL, stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT, start_new_session=True)
+        output = bytearray()
+
+        async def read():
+            while True:
+                chunk = await proc.stdout.read(65536)
+                if not chunk:
+                    break
+                output.extend(chunk)
+                del output[:-self.max_output]
+            return await proc.wait()
+
+        timed_out = False
+        try:
+            returncode = await asyncio.wait_for(read(), timeout)
+        except asyncio.TimeoutError:
+            timed_out = True
+            try:
+                # Its own session, so this takes the commands it started with it.
+                os.killpg(proc.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            returncode = await proc.wait()
+        return returncode, timed_out, output.decode('utf-8', errors='replace')
+
+    def _count(self, name, change):
+        with self._lock:
+            self._stats[name] += change
+
+    def _record(self, result):
+        subprocess_wait_seconds.observe(result.wait_time, executor=self.name)
+        if result.timed_out:
+            subprocess_timeouts.inc(executor=self.name)
+        with self._lock:
+            self._stats['runs'] += 1
+            self._stats['failed'] += int(result.returncode != 0)
+            self._stats['timed_out'] += int(result.timed_out)
+            self._stats['total_wait'] += result.wait_time
+            self._stats['max_wait'] = max(self._stats['max_wait'], result.wait_time)
+            self._stats['total_run'] += result.run_time
+            self._stats['max_run'] = max(self._stats['max_run'], result.run_time)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats['max_running'] = self.max_running
+        return stats
+
+
+rerender_executor = SubprocessExecutor(
+    'rerender',
+    max_running=int(os.environ.get('RERENDER_CONCURRENCY', 2)),
+    timeout=int(os.environ.get('RERENDER_TIMEOUT', 900)),
+    max_memory=int(os.environ.get('RERENDER_MAX_MEMORY_MB', 4096)) * 1024 * 1024,
+    logs=SQLiteCache(cache_path('rerender_logs.sqlite'), max_entries=int(os.environ.get('RERENDER_LOGS', 200))))
@@ -0,0 +1,173 @@
+import os
+import unittest
+
+try:
+    import unittest.mock as mock
+except ImportError:
+    import mock
+
+import github
+
+from nwb_extensions_webservices import github_client, github_graphql, linting
+from nwb_extensions_webservices.store import SQLiteCache
+from nwb_extensions_webservices.utils import tmp_directory
+
+
+class FakeComment(object):
+    def __init__(self, comment_id, body, login='nwb-extensions-linter'):
+        self.id = comment_id
+        self.body = body
+        self.user = mock.MagicMock(login=login)
+        self.html_url = 'https://github.com/comment/{}'.format(comment_id)
+
+    def edit(self, body):
+        self.body = body
+
+
+class Test_comment_index(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tmp_directory()
+        path = os.path.join(self.tmp_dir.__enter__(), 'comments.sqlite')
+        patcher = mock.patch.object(linting, 'comment_index', SQLiteCache(path))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.tmp_dir.__exit__, None, None, None)
+
+        patcher = mock.patch.dict(os.environ, {'GH_TOKEN': 'fake'})  # github access is mocked anyway
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        patcher = mock.patch('github.Github')
+        gh = patcher.start()
+        self.addCleanup(patcher.stop)
+        github_client.reset()
+        self.addCleanup(github_client.reset)
+        gh.return_value.get_user.return_value.login = 'nwb-extensions-linter'
+        self.request = gh.return_value.requester.requestJsonAndCheck
+        self.issue = gh.return_value.get_repo.return_value.get_issue.return_value
+        self.comments = [FakeComment(1, 'Hi from someone else', login='someone')]
+        self.issue.get_comments.side_effect = lambda: list(self.comments)
+        self.issue.get_comment.side_effect = lambda comment_id: [
+            c for c in self.comments if c.id == comment_id][0]
+
+        def create_comment(body):
+            self.comments.append(FakeComment(len(self.comments) + 1, body))
+            return self.comments[-1]
+        self.issue.create_comment.side_effect = create_comment
+
+    def comment(self, message, **kwargs):
+        return linting.comment_on_pr('nwb-extensions', 'staged-extensions', 1, message,
+                                     search='linting service', **kwargs)
+
+    def test_first_comment_then_cached(self):
+        msg = self.comment('linting service: good')
+        self.assertEqual(msg.id, 2)
+        self.assertEqual(self.issue.get_comments.call_count, 1)
+
+        # Same message again: only a check that the comment is still there.
+        self.issue.reset_mock()
+        msg = self.comment('linting service: good')
+        self.assertEqual(msg.html_url, 'https://github.com/comment/2')
+        self.request.assert_called_once_with(
+            'GET', '/repos/nwb-extensions/staged-extensions/issues/comments/2')
+        self.issue.get_comments.assert_not_called()
+        self.issue.create_comment.assert_not_called()
+
+    def test_deleted_comment_is_posted_again(self):
+        self.comment('linting service: good')
+        self.comments.pop()
+        self.request.side_effect = github.UnknownObjectException(404, {}, {})
+        msg = self.comment('linting service: good')
+        self.assertEqual(msg.id, 2)
+        self.assertEqual(self.comments[-1].body, 'linting service: good')
+        self.assertEqual(self.issue.create_comment.call_count, 2)
+
+    def test_changed_message_edits(self):
+        self.comment('linting service: good')
+        self.comment('linting service: bad')
+        self.assertEqual(len(self.comments), 2)
+        self.assertEqual(self.comments[-1].body, 'linting service: bad')
+        self.assertEqual(self.issue.get_comments.call_count, 1)
+
+    def test_force_creates_new_comment(self):
+        self.comment('linting service: good')
+        self.comment('linting service: good', force=True)
+        self.assertEqual(len(self.comments), 3)
+        # Later updates go to the newest comment.
+        self.comment('linting service: bad')
+        self.assertEqual(self.comments[-1].body, 'linting service: bad')
+        self.assertEqual(self.comments[-2].body, 'linting service: good')
+
+    def test_deleted_comment_falls_back_to_listing(self):
+        self.comment('linting service: good')
+        self.comments.pop()
+        self.issue.get_comment.side_effect = github.UnknownObjectException(404, {}, {})
+        msg = self.comment('linting service: bad')
+        self.assertEqual(msg.body, 'linting service: bad')
+        self.assertEqual(self.issue.get_comments.call_count, 2)
+
+
+class Test_comment_index_graphql(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tmp_directory()
+        path = os.path.join(self.tmp_dir.__enter__(), 'comments.sqlite')
+        patcher = mock.patch.object(linting, 'comment_index', SQLiteCache(path))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.tmp_dir.__exit__, None, None, None)
+
+        patcher = mock.patch.object(github_graphql, 'USE_GRAPHQL', True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.comments = [github_graphql.Comment(1, 'IC_1', 'https://github.com/comment/1', 'Hi from the bot')]
+        for name in ['fetch_pull_request', 'add_comment', 'update_comment']:
+            patcher = mock.patch.object(github_graphql, name)
+            setattr(self, name, patcher.start())
+            self.addCleanup(patcher.stop)
+        self.fetch_pull_request.side_effect = lambda *args: github_graphql.PullRequest(
+            'PR_1', 'open', True, 'abc123', list(self.comments))
+
+        def add_comment(subject_id, body):
+            self.comments.append(github_graphql.Comment(
+                len(self.comments) + 1, 'IC_{}'.format(len(self.comments) + 1), 'url', body))
+            return self.comments[-1]
+        self.add_comment.side_effect = add_comment
+        self.update_comment.side_effect = lambda comment, body: comment._replace(body=body)
+
+    def comment(self, message, **kwargs):
+        return linting.comment_on_pr('nwb-extensions', 'staged-extensions', 1, message,
+                                     search='linting service', **kwargs)
+
+    def test_first_comment(self):
+        msg = self.comment('linting service: good')
+        self.assertEqual(msg.id, 2)
+        self.add_comment.assert_called_once_with('PR_1', 'linting service: good')
+
+    def test_changed_message_is_one_mutation(self):
+        self.comment('linting service: good')
+        self.fetch_pull_request.reset_mock()
+        msg = self.comment('linting service: bad')
+        self.fetch_pull_request.assert_not_called()
+        self.assertEqual(self.update_comment.call_args[0][0].node_id, 'IC_2')
+        self.assertEqual(msg.body, 'linting service: bad')
+
+    def test_deleted_comment_falls_back_to_query(self):
+        self.comment('linting service: good')
+        self.comments.pop()
+        self.update_comment.side_effect = github.GithubException(400, {}, {})
+        self.comment('linting service: bad')
+        self.assertEqual(self.fetch_pull_request.call_count, 2)
+        self.assertEqual(self.comments[-1].body, 'linting service: bad')
+
+    def test_set_pr_status(self):
+        with mock.patch.object(github_graphql, 'create_status') as create_status:
+            linting.set_pr_status('nwb-extensions', 'staged-extensions',
+                                  {'status': 'mixed', 'sha': 'abc123'}, target_url='url')
+        create_status.assert_called_once_with(
+            'nwb-extensions', 'staged-extensions', 'abc123', 'success', 'Some extensions have hints.',
+            'nwb-extensions-linter', target_url='url')
+
+
+if __name__ == '__main__':
+    unittest.main()
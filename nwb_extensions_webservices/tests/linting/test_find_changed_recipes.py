@@ -0,0 +1,49 @@
+import os
+import shutil
+import unittest
+
+from git import Repo
+
+from nwb_extensions_webservices.linting import find_changed_recipes
+from nwb_extensions_webservices.utils import tmp_directory
+
+
+def write(repo, path, content='name: test\n'):
+    full_path = os.path.join(repo.working_tree_dir, path)
+    os.makedirs(os.path.dirname(full_path), exist_ok=True)
+    with open(full_path, 'w') as fh:
+        fh.write(content)
+    repo.index.add([path])
+
+
+class Test_find_changed_recipes(unittest.TestCase):
+    def test_changed_recipes(self):
+        with tmp_directory() as tmp_dir:
+            repo = Repo.init(tmp_dir)
+            for name in ['ndx-a', 'ndx-b', 'ndx-c']:
+                write(repo, 'extensions/{}/ndx-meta.yaml'.format(name))
+                write(repo, 'extensions/{}/spec/ns.yaml'.format(name))
+            write(repo, 'README.md')
+            base = repo.index.commit('Base')
+            base_branch = repo.active_branch
+
+            pr_branch = repo.create_head('pr', base)
+            pr_branch.checkout()
+            write(repo, 'extensions/ndx-b/spec/ns.yaml', 'changed\n')
+            write(repo, 'extensions/ndx-d/ndx-meta.yaml')
+            write(repo, 'README.md', 'changed\n')
+            repo.index.remove(['extensions/ndx-c'], r=True)
+            shutil.rmtree(os.path.join(tmp_dir, 'extensions', 'ndx-c'))
+            head = repo.index.commit('PR')
+
+            # The base branch moves on, its changes are not part of the PR.
+            base_branch.checkout()
+            write(repo, 'extensions/ndx-a/spec/ns.yaml', 'changed on base\n')
+            new_base = repo.index.commit('Base moves on')
+
+            recipes = find_changed_recipes(repo, new_base, head)
+            self.assertEqual(sorted(recipes), ['extensions/ndx-b', 'extensions/ndx-d'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,33 @@
+import os
+import unittest
+
+from git import Repo
+
+from nwb_extensions_webservices.linting import find_recipes, find_recipes_in_commit
+from nwb_extensions_webservices.utils import tmp_directory
+
+
+class Test_find_recipes_in_commit(unittest.TestCase):
+    def test_matches_find_recipes(self):
+        with tmp_directory() as tmp_dir:
+            repo = Repo.init(tmp_dir)
+            for path in ['ndx-meta.yaml',
+                         'extensions/ndx-a/ndx-meta.yaml',
+                         'extensions/ndx-b/ndx-meta.yaml',
+                         'extensions/ndx-b/README.md',
+                         'extensions/not-an-extension/meta.yaml']:
+                full_path = os.path.join(tmp_dir, path)
+                os.makedirs(os.path.dirname(full_path), exist_ok=True)
+                with open(full_path, 'w') as fh:
+                    fh.write('name: test\n')
+                repo.index.add([path])
+            commit = repo.index.commit('Add extensions')
+
+            expected = sorted(os.path.relpath(recipe, tmp_dir) for recipe in find_recipes(tmp_dir))
+            recipes = sorted(find_recipes_in_commit(repo, commit))
+            self.assertEqual(recipes, expected)
+            self.assertEqual(recipes, ['.', 'extensions/ndx-a', 'extensions/ndx-b'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,152 @@
+import io
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from contextlib import redirect_stdout
+
+try:
+    import unittest.mock as mock
+except ImportError:
+    import mock
+
+from git import Repo
+
+from nwb_extensions_webservices import linting
+from nwb_extensions_webservices.metrics import Counter
+from nwb_extensions_webservices.repo_cache import RepoCache, Workspace
+from nwb_extensions_webservices.store import SQLiteCache
+from nwb_extensions_webservices.workers import WorkerPool
+
+
+def write(repo, path, content='name: test\n'):
+    full_path = os.path.join(repo.working_tree_dir, path)
+    os.makedirs(os.path.dirname(full_path), exist_ok=True)
+    with open(full_path, 'w') as fh:
+        fh.write(content)
+    repo.index.add([path])
+
+
+def make_pull_request(tmp_dir):
+    """
+    A bare repository standing in for GitHub: ``master`` has ndx-a, PR #1 adds
+    ndx-b, and the base branch has moved on since. Returns its path.
+    """
+    work = Repo.init(os.path.join(tmp_dir, 'work'))
+    work.git.symbolic_ref('HEAD', 'refs/heads/master')
+    write(work, 'README.md')
+    write(work, 'extensions/ndx-a/ndx-meta.yaml')
+    base = work.index.commit('Base')
+
+    work.create_head('pr', base).checkout()
+    write(work, 'extensions/ndx-b/ndx-meta.yaml')
+    write(work, 'extensions/ndx-b/spec/ns.yaml')
+    head = work.index.commit('Add ndx-b')
+
+    work.heads.master.checkout()
+    write(work, 'extensions/ndx-a/spec/ns.yaml')
+    work.index.commit('Base moves on')
+    work.git.merge('pr', '--no-ff', '-m', 'Merge')
+
+    remote = Repo.clone_from(work.working_tree_dir, os.path.join(tmp_dir, 'remote.git'), bare=True)
+    remote.git.update_ref('refs/pull/1/head', head.hexsha)
+    remote.git.update_ref('refs/pull/1/merge', work.head.commit.hexsha)
+    remote.git.config('uploadpack.allowFilter', 'true')
+    return remote.git_dir
+
+
+def fake_lint(recipe_dir):
+    # Stands in for lint_recipe in the worker processes, the slower the earlier in the alphabet.
+    name = os.path.basename(recipe_dir)
+    time.sleep({'ndx-a': 0.6, 'ndx-b': 0.3, 'ndx-slow': 30}.get(name, 0))
+    return ['lint for {}'.format(name)], [], True
+
+
+class TestLintPullRequest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp('_extensions')
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        self.url = make_pull_request(self.tmp_dir)
+        self.lint_cache = SQLiteCache(os.path.join(self.tmp_dir, 'lint.sqlite'))
+
+        self.remote_repo = mock.MagicMock(clone_url=self.url)
+        self.remote_repo.get_pull.return_value = mock.MagicMock(state='open', mergeable=True)
+        for patcher in [mock.patch.object(linting, 'get_repo', return_value=self.remote_repo),
+                        mock.patch.object(linting, 'read_token', return_value='token'),
+                        mock.patch.object(linting, 'lint_cache', self.lint_cache),
+                        mock.patch('nwb_extensions_webservices.repo_cache.repo_cache',
+                                   RepoCache(os.path.join(self.tmp_dir, 'mirrors'), 10 * 1024 * 1024))]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def lint(self, **kwargs):
+        out = io.StringIO()
+        with redirect_stdout(out):
+            lint_info = linting.compute_lint_message('nwb-extensions', 'staged-extensions', 1, **kwargs)
+        return lint_info, out.getvalue()
+
+    @mock.patch.object(linting, 'lint_recipes')
+    def test_lint_cache(self, lint_recipes):
+        lint_recipes.side_effect = lambda recipe_dirs: [(['lint'], [], True) for _ in recipe_dirs]
+        patcher = mock.patch.object(linting, 'lint_cache_lookups', Counter('lookups', 'Lookups.'))
+        lookups = patcher.start()
+        self.addCleanup(patcher.stop)
+
+        lint_info, out = self.lint()
+        self.assertEqual(lint_info['status'], 'bad')
+        self.assertEqual([os.path.basename(path) for path in lint_recipes.call_args[0][0]], ['ndx-a', 'ndx-b'])
+        self.assertIn('Lint cache: 0 hits, 2 misses.', out)
+
+        # Neither extension changed, so neither is linted again and the counts are for this run only.
+        second_info, out = self.lint()
+        lint_recipes.assert_called_with([])
+        self.assertIn('Lint cache: 2 hits, 0 misses.', out)
+        self.assertEqual(second_info, lint_info)
+        # While the metrics add up over every run.
+        self.assertEqual(lookups.render().split('\n')[2:], ['lookups{result="hit"} 2', 'lookups{result="miss"} 2'])
+
+    def test_partial_checkout(self):
+        # A partial clone needs a url, git ignores --filter for local paths.
+        workspace = Workspace.clone('file://' + self.url, os.path.join(self.tmp_dir, 'clone'), mode='partial')
+        checkouts = []
+        checkout = Workspace.checkout
+
+        def record_checkout(workspace, paths, ref=None):
+            checkouts.append((list(paths), str(ref)))
+            checkout(workspace, paths, ref=ref)
+
+        on_disk = []
+
+        def lint_recipes(recipe_dirs):
+            on_disk.append(sorted(os.listdir(os.path.dirname(recipe_dirs[0]))))
+            return [([], [], True) for _ in recipe_dirs]
+
+        with mock.patch.object(Workspace, 'checkout', record_checkout), \
+                mock.patch.object(linting, 'lint_recipes', side_effect=lint_recipes):
+            lint_info, _ = self.lint(ignore_base=True, workspace=workspace)
+
+        self.assertEqual(lint_info['status'], 'good')
+        # Only the extension new to the base branch was checked out to be linted, from the merge of the PR.
+        self.assertEqual(on_disk, [['ndx-b']])
+        # Then the workspace was given back as it was, with nothing checked out but the files at the top.
+        self.assertEqual(checkouts, [(['extensions/ndx-b'], 'pull/1/merge'), ([], 'master')])
+        self.assertEqual(workspace.repo.active_branch.name, 'master')
+        self.assertEqual(sorted(os.listdir(workspace.path)), ['.git', 'README.md'])
+
+    def test_lint_recipes_order_and_timeout(self):
+        pool = WorkerPool(3)
+        self.addCleanup(pool.close)
+        recipe_dirs = [os.path.join(self.tmp_dir, name) for name in ['ndx-a', 'ndx-slow', 'ndx-b', 'ndx-c']]
+        with mock.patch.object(linting, 'worker_pool', pool), mock.patch.object(linting, 'lint_recipe', fake_lint):
+            results = linting.lint_recipes(recipe_dirs, timeout=2)
+
+        # In the order asked for, not the order they finished in.
+        self.assertEqual(results, [(['lint for ndx-a'], [], True),
+                                   ([linting.LINT_TIMED_OUT.format(2)], [], False),
+                                   (['lint for ndx-b'], [], True),
+                                   (['lint for ndx-c'], [], True)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+try:
+    import unittest.mock as mock
+except ImportError:
+    import mock
+
+from nwb_extensions_webservices import linting
+from nwb_extensions_webservices.linting import (
+    wait_for_mergeable, notify_mergeable, MergeabilityTimeout)
+from nwb_extensions_webservices.store import SQLiteCache
+
+
+def remote_repo(*mergeable, state='open'):
+    repo = mock.MagicMock()
+    repo.get_pull.side_effect = [mock.MagicMock(state=state, mergeable=value) for value in mergeable]
+    return repo
+
+
+class Test_wait_for_mergeable(unittest.TestCase):
+    def setUp(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        patcher = mock.patch.object(linting, 'mergeable_hints', SQLiteCache(os.path.join(tmp_dir, 'hints.sqlite')))
+        self.hints = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_already_known(self):
+        repo = remote_repo(True)
+        self.assertTrue(wait_for_mergeable(repo, 'org', 'repo', 1))
+        self.assertEqual(repo.get_pull.call_count, 1)
+
+    def test_closed(self):
+        repo = remote_repo(None, state='closed')
+        self.assertIsNone(wait_for_mergeable(repo, 'org', 'repo', 1))
+
+    @mock.patch('nwb_extensions_webservices.linting.random.uniform', return_value=0.01)
+    def test_backoff(self, uniform):
+        repo = remote_repo(None, None, False)
+        self.assertFalse(wait_for_mergeable(repo, 'org', 'repo', 1))
+        self.assertEqual(repo.get_pull.call_count, 3)
+        self.assertEqual(uniform.call_count, 2)
+
+    def test_deadline(self):
+        repo = mock.MagicMock()
+        repo.get_pull.return_value = mock.MagicMock(state='open', mergeable=None)
+        start = time.time()
+        with self.assertRaises(MergeabilityTimeout):
+            wait_for_mergeable(repo, 'org', 'repo', 1, timeout=0.5)
+        self.assertLess(time.time() - start, 2)
+
+    def test_webhook_resolves_early(self):
+        repo = mock.MagicMock()
+        repo.get_pull.return_value = mock.MagicMock(state='open', mergeable=None)
+        timer = threading.Timer(0.2, notify_mergeable, ('org', 'repo', 2, True))
+        timer.start()
+        start = time.time()
+        self.assertTrue(wait_for_mergeable(repo, 'org', 'repo', 2, timeout=30))
+        self.assertLess(time.time() - start, 2)
+
+    @mock.patch.object(linting, 'MERGEABLE_HINT_INTERVAL', 0.05)
+    def test_webhook_in_another_process(self):
+        repo = mock.MagicMock()
+        repo.get_pull.return_value = mock.MagicMock(state='open', mergeable=None)
+        # One from before the wait started is out of date.
+        self.hints.set('org/repo#3', {'mergeable': True, 'time': time.time() - 10})
+        # What notify_mergeable in a web process leaves for the job workers.
+        timer = threading.Timer(0.2, self.hints.set, ('org/repo#3', {'mergeable': False, 'time': time.time() + 0.2}))
+        timer.start()
+        start = time.time()
+        self.assertIs(wait_for_mergeable(repo, 'org', 'repo', 3, timeout=30), False)
+        self.assertLess(time.time() - start, 2)
+        self.assertEqual(repo.get_pull.call_count, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
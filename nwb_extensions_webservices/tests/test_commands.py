@@ -1,4 +1,6 @@
 import os
+import shutil
+import tempfile
 import unittest
 
 try:
@@ -6,7 +8,15 @@ try:
 except ImportError:
     import mock
 
+from git import Repo
+
+from nwb_extensions_webservices import commands, github_client, linting
+from nwb_extensions_webservices.repo_cache import Workspace, checkout_paths
+from nwb_extensions_webservices.store import SQLiteCache
+from nwb_extensions_webservices.subprocesses import RunResult
+from nwb_extensions_webservices.tests.linting.test_lint_pull_request import make_pull_request
 from nwb_extensions_webservices.commands import (
+    Command, parse_commands,
     pr_detailed_comment as _pr_detailed_comment,
     issue_comment as _issue_comment)
 
@@ -32,8 +42,11 @@ class TestCommands(unittest.TestCase):
             self.kill_token = True
         else:
             self.kill_token = False
+        # Don't hand out clients or repositories resolved through an earlier mock.
+        github_client.reset()
 
     def tearDown(self):
+        github_client.reset()
         if self.kill_token:
             del os.environ['GH_TOKEN']
 
@@ -43,7 +56,7 @@ class TestCommands(unittest.TestCase):
     @mock.patch('nwb_extensions_webservices.commands.update_circle')
     @mock.patch('nwb_extensions_webservices.commands.tmp_directory')
     @mock.patch('github.Github')
-    @mock.patch('nwb_extensions_webservices.commands.Repo')
+    @mock.patch('nwb_extensions_webservices.commands.clone_from')
     def test_pr_command_triggers(
             self, repo, gh, tmp_directory, update_circle,
             update_team, relint, rerender):
@@ -107,7 +120,7 @@ class TestCommands(unittest.TestCase):
     @mock.patch('nwb_extensions_webservices.commands.update_circle')
     @mock.patch('nwb_extensions_webservices.commands.tmp_directory')
     @mock.patch('github.Github')
-    @mock.patch('nwb_extensions_webservices.commands.Repo')
+    @mock.patch('nwb_extensions_webservices.commands.clone_from')
     def test_issue_command_triggers(
             self, repo, gh, tmp_directory, update_circle,
             update_team, relint, rerender):
@@ -199,7 +212,7 @@ class TestCommands(unittest.TestCase):
     @mock.patch('nwb_extensions_webservices.commands.update_circle')
     @mock.patch('nwb_extensions_webservices.commands.tmp_directory')
     @mock.patch('github.Github')
-    @mock.patch('nwb_extensions_webservices.commands.Repo')
+    @mock.patch('nwb_extensions_webservices.commands.clone_from')
     def test_rerender_failure(
             self, repo, gh, tmp_directory, update_circle,
             update_team, relint, rerender):
@@ -218,6 +231,151 @@ class TestCommands(unittest.TestCase):
         assert 'ran into some issues' in pull_create_issue.call_args[0][0]
         assert 'please ping nwb-extensions/core for further assistance' in pull_create_issue.call_args[0][0]
 
+    @mock.patch('nwb_extensions_webservices.commands.rerender')
+    @mock.patch('nwb_extensions_webservices.commands.relint')
+    @mock.patch('nwb_extensions_webservices.commands.tmp_directory')
+    @mock.patch('github.Github')
+    @mock.patch('nwb_extensions_webservices.commands.clone_from')
+    def test_lint_and_rerender_share_a_clone(self, clone_from, gh, tmp_directory, relint, rerender):
+        tmp_directory.return_value.__enter__.return_value = '/tmp'
+        rerender.return_value = False
+
+        pr_detailed_comment('@nwb-extensions-admin, please lint. @nwb-extensions-admin, please rerender')
+
+        clone_from.assert_called_once()
+        workspace = relint.call_args[1]['workspace']
+        self.assertIs(workspace.repo, clone_from.return_value)
+        rerender.assert_called_once_with(clone_from.return_value)
+
+    def test_parse_commands(self):
+        text = ('@nwb-extensions-admin, please rerender\n' + 'log line\n' * 100 +
+                '@NWB-EXTENSIONS-LINTER: relint and @nwb-extensions-admin update the circle, '
+                '@nwb-extensions-admin hello')
+        commands = parse_commands(text)
+        self.assertEqual([command.name for command in commands], ['rerender', 'lint', 'update_circle'])
+        self.assertEqual(commands[0], Command('rerender', 0, len('@nwb-extensions-admin, please rerender')))
+        self.assertEqual(text[commands[2].start:commands[2].end], '@nwb-extensions-admin update the circle')
+        self.assertEqual(parse_commands('@nwb-extensions-admin, go ahead and rerender for me'), [])
+
+    @mock.patch('nwb_extensions_webservices.commands.rerender_executor')
+    def test_rerender_runs_smithy(self, executor):
+        repo = mock.MagicMock(working_dir='/tmp/python-feedstock')
+        executor.run.return_value = RunResult(0, False, '', 0.0, 1.0, 'python-feedstock-1')
+        self.assertFalse(commands.rerender(repo))
+        executor.run.assert_called_once_with(['nwb-extensions-smithy', 'rerender', '-c', 'auto'],
+                                             cwd='/tmp/python-feedstock', label='python-feedstock')
+
+        for result in [RunResult(1, False, '', 0.0, 1.0, None), RunResult(-9, True, '', 0.0, 1.0, None)]:
+            executor.run.return_value = result
+            with self.assertRaises(RuntimeError):
+                commands.rerender(repo)
+
+
+class TestPullRequestHeads(unittest.TestCase):
+    def setUp(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        patcher = mock.patch.object(commands, 'pull_requests', SQLiteCache(os.path.join(tmp_dir, 'prs.sqlite')))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        github_client.reset()
+        self.addCleanup(github_client.reset)
+
+    @mock.patch('nwb_extensions_webservices.commands.pr_detailed_comment')
+    @mock.patch('github.Github')
+    def test_from_payload(self, gh, pr_detailed_comment):
+        head = commands.pull_request_head({
+            'number': 3, 'state': 'open',
+            'head': {'user': {'login': 'some-user'}, 'repo': {'name': 'python-feedstock'},
+                     'ref': 'patch-1', 'sha': 'abc123'}})
+        commands.remember_pull_request('nwb-extensions', 'python-feedstock', 3, head)
+        commands.pr_comment('nwb-extensions', 'python-feedstock', 3, '@nwb-extensions-admin, please rerender')
+
+        gh.return_value.get_repo.assert_not_called()
+        pr_detailed_comment.assert_called_once_with('nwb-extensions', 'python-feedstock', 'some-user',
+                                                    'python-feedstock', 'patch-1', 3,
+                                                    '@nwb-extensions-admin, please rerender')
+
+    @mock.patch('nwb_extensions_webservices.commands.pr_detailed_comment')
+    @mock.patch('github.Github')
+    def test_fetched_on_miss(self, gh, pr_detailed_comment):
+        with mock.patch.dict(os.environ, {'GH_TOKEN': 'fake'}):
+            # Payloads without a head repository (a deleted fork) have no head to remember.
+            self.assertIsNone(commands.pull_request_head({'number': 3, 'state': 'open', 'head': {'repo': None}}))
+            pull = gh.return_value.get_repo.return_value.get_pull.return_value
+            pull.state = 'open'
+            pull.head.user.login, pull.head.repo.name, pull.head.ref, pull.head.sha = \
+                'some-user', 'fork', 'patch-1', 'abc123'
+            for _ in range(2):
+                commands.pr_comment('nwb-extensions', 'python-feedstock', 3, '@nwb-extensions-linter, lint')
+
+        gh.return_value.get_repo.return_value.get_pull.assert_called_once_with(3)
+        pr_detailed_comment.assert_called_with('nwb-extensions', 'python-feedstock', 'some-user', 'fork',
+                                               'patch-1', 3, '@nwb-extensions-linter, lint')
+
+
+class TestSharedWorkspace(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        self.url = make_pull_request(self.tmp_dir)
+        remote_repo = mock.MagicMock(clone_url=self.url)
+        remote_repo.get_pull.return_value = mock.MagicMock(state='open', mergeable=True)
+        lint_cache = SQLiteCache(os.path.join(self.tmp_dir, 'lint.sqlite'))
+        for patcher in [mock.patch.object(linting, 'get_repo', return_value=remote_repo),
+                        mock.patch.object(linting, 'read_token', return_value='token'),
+                        mock.patch.object(linting, 'lint_cache', lint_cache),
+                        mock.patch.object(commands, 'comment_on_pr'),
+                        mock.patch.object(commands, 'set_pr_status')]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_relint_restores_the_clone(self):
+        # The clone of the PR's branch that rerendering works in next.
+        repo = Repo.clone_from(self.url, os.path.join(self.tmp_dir, 'python-feedstock'), branch='pr')
+        head = repo.head.commit.hexsha
+        files = sorted(repo.git.ls_files().splitlines())
+        linted = []
+
+        def lint_recipes(recipe_dirs):
+            linted.extend(os.path.relpath(recipe_dir, repo.working_tree_dir) for recipe_dir in recipe_dirs)
+            # The merge with the base branch is what gets linted.
+            self.assertTrue(os.path.exists(os.path.join(repo.working_tree_dir, 'extensions/ndx-a/spec/ns.yaml')))
+            return [([], [], True) for _ in recipe_dirs]
+
+        with mock.patch.object(linting, 'lint_recipes', side_effect=lint_recipes):
+            commands.relint('nwb-extensions', 'python-feedstock', 1, workspace=Workspace(repo, mode='mirror'))
+
+        self.assertEqual(linted, ['extensions/ndx-a', 'extensions/ndx-b'])
+        commands.set_pr_status.assert_called_once()
+        self.assertEqual(repo.active_branch.name, 'pr')
+        self.assertEqual(repo.head.commit.hexsha, head)
+        self.assertFalse(repo.is_dirty(untracked_files=True))
+        on_disk = sorted(os.path.relpath(os.path.join(root, name), repo.working_tree_dir)
+                         for root, dirs, names in os.walk(repo.working_tree_dir)
+                         if '.git' not in os.path.relpath(root, repo.working_tree_dir).split(os.sep)
+                         for name in names)
+        self.assertEqual(on_disk, files)
+        self.assertNotIn('extensions/ndx-a/spec/ns.yaml', on_disk)
+
+    def test_relint_restores_a_sparse_clone(self):
+        # A partial clone of the PR's branch with only one extension checked out.
+        repo = Repo.clone_from('file://' + self.url, os.path.join(self.tmp_dir, 'staged-extensions'), branch='pr',
+                               multi_options=['--filter=blob:none', '--no-checkout'])
+        checkout_paths(repo, ['extensions/ndx-b'], mode='partial')
+        head = repo.head.commit.hexsha
+
+        with mock.patch.object(linting, 'lint_recipes', side_effect=lambda dirs: [([], [], True) for _ in dirs]):
+            commands.relint('nwb-extensions', 'staged-extensions', 1, workspace=Workspace(repo, mode='partial'))
+
+        commands.set_pr_status.assert_called_once()
+        self.assertEqual(repo.active_branch.name, 'pr')
+        self.assertEqual(repo.head.commit.hexsha, head)
+        # Still only that extension, not a full checkout.
+        self.assertEqual(repo.git.sparse_checkout('list').splitlines(), ['extensions/ndx-b'])
+        self.assertEqual(sorted(os.listdir(os.path.join(repo.working_tree_dir, 'extensions'))), ['ndx-b'])
+        self.assertFalse(repo.is_dirty(untracked_files=True))
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,118 @@
+import os
+import time
+import unittest
+
+try:
+    import unittest.mock as mock
+except ImportError:
+    import mock
+
+from nwb_extensions_webservices import github_client
+from nwb_extensions_webservices.jobs import Job
+from nwb_extensions_webservices.rate_limit import RateLimitTracker
+
+
+class TestGithubClient(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.dict(os.environ, {'GH_TOKEN': 'fake'})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        patcher = mock.patch('github.Github')
+        self.gh = patcher.start()
+        self.addCleanup(patcher.stop)
+        github_client.reset()
+        self.addCleanup(github_client.reset)
+
+    def test_one_client_per_token(self):
+        self.gh.side_effect = lambda *args, **kwargs: mock.MagicMock()
+        self.assertIs(github_client.get_github(), github_client.get_github('fake'))
+        self.assertIsNot(github_client.get_github(), github_client.get_github('other'))
+        self.assertEqual(self.gh.call_count, 2)
+        self.gh.assert_any_call('fake', pool_size=github_client.POOL_SIZE)
+        self.assertIsNot(github_client.get_github(queries_only=True), github_client.get_github())
+
+    def test_repo_is_resolved_once(self):
+        repo = github_client.get_repo('nwb-extensions', 'staged-extensions')
+        self.assertIs(github_client.get_repo('nwb-extensions', 'staged-extensions'), repo)
+        self.gh.return_value.get_repo.assert_called_once_with('nwb-extensions/staged-extensions')
+        self.assertEqual(github_client.stats()['calls_saved'], 2)
+
+    def test_expired_objects_are_resolved_again(self):
+        with mock.patch.object(github_client, 'OBJECT_TTL', 0):
+            github_client.get_organization('nwb-extensions')
+            github_client.get_organization('nwb-extensions')
+        self.assertEqual(self.gh.return_value.get_organization.call_count, 2)
+
+    def test_login(self):
+        self.gh.return_value.get_user.return_value.login = 'nwb-extensions-linter'
+        self.assertEqual(github_client.get_login(), 'nwb-extensions-linter')
+        self.assertEqual(github_client.get_login(), 'nwb-extensions-linter')
+        self.gh.return_value.get_user.assert_called_once_with()
+
+    def test_track_job(self):
+        job = Job('lint', None, (), {})
+        with mock.patch('sys.stdout') as stdout:
+            with github_client.track_job(job):
+                github_client.get_repo('nwb-extensions', 'staged-extensions')
+                github_client.get_repo('nwb-extensions', 'staged-extensions')
+        printed = ''.join(call[0][0] for call in stdout.write.call_args_list)
+        self.assertIn('Job "lint" saved 2 GitHub API calls, 0 requests were not modified.', printed)
+
+
+class TestTokenPool(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.dict(os.environ, {'GH_TOKEN': 'write', 'GH_TOKENS': 'read1, read2,write'})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        patcher = mock.patch.object(github_client, 'rate_limits', RateLimitTracker())
+        self.rate_limits = patcher.start()
+        self.addCleanup(patcher.stop)
+
+        patcher = mock.patch('time.sleep')
+        self.sleep = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def spend(self, token, remaining, reset_in=3600):
+        self.rate_limits.record('token ' + token, 200, {
+            'x-ratelimit-remaining': str(remaining), 'x-ratelimit-limit': '5000',
+            'x-ratelimit-reset': str(int(time.time() + reset_in))})
+
+    def test_tokens(self):
+        self.assertEqual(github_client.tokens(), ['write', 'read1', 'read2'])
+
+    def test_reads_use_the_most_budget(self):
+        self.spend('write', 3000)
+        self.spend('read1', 4000)
+        self.spend('read2', 2000)
+        self.assertEqual(github_client.read_token(), 'read1')
+        self.spend('read1', 1000)
+        self.assertEqual(github_client.read_token(), 'write')
+        self.sleep.assert_not_called()
+
+    def test_unused_tokens_are_preferred(self):
+        self.spend('write', 4999)
+        self.assertEqual(github_client.read_token(), 'read1')
+
+    def test_writes_are_pinned(self):
+        self.spend('write', 200)
+        self.spend('read1', 4000)
+        self.assertEqual(github_client.write_token(), 'write')
+
+    def test_back_off_when_exhausted(self):
+        self.spend('write', 10, reset_in=30)
+        self.spend('read1', 10, reset_in=100)
+        self.spend('read2', 10, reset_in=60)
+        github_client.read_token()
+        self.assertEqual(self.sleep.call_count, 1)
+        self.assertAlmostEqual(self.sleep.call_args[0][0], 30, delta=2)
+
+        self.sleep.reset_mock()
+        self.spend('write', 0, reset_in=10 ** 6)
+        github_client.write_token()
+        self.sleep.assert_called_once_with(github_client.MAX_BACKOFF)
+
+
+if __name__ == '__main__':
+    unittest.main()
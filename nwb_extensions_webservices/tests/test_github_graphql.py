@@ -0,0 +1,98 @@
+import os
+import unittest
+
+try:
+    import unittest.mock as mock
+except ImportError:
+    import mock
+
+from nwb_extensions_webservices import github_client, github_graphql
+
+
+def comment_node(database_id, body, login='nwb-extensions-linter'):
+    return {'id': 'IC_{}'.format(database_id), 'databaseId': database_id, 'body': body,
+            'url': 'https://github.com/comment/{}'.format(database_id),
+            'author': {'login': login} if login else None}
+
+
+def pull_request_data(state='OPEN', mergeable='MERGEABLE', comments=()):
+    return {'viewer': {'login': 'nwb-extensions-linter'},
+            'repository': {'pullRequest': {
+                'id': 'PR_1', 'state': state, 'mergeable': mergeable, 'headRefOid': 'abc123', 'baseRefOid': 'def456',
+                'comments': {'nodes': list(comments)}}}}
+
+
+class TestGithubGraphQL(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.dict(os.environ, {'GH_TOKEN': 'fake'})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        patcher = mock.patch('github.Github')
+        self.github = patcher.start()
+        self.requester = self.github.return_value.requester
+        self.addCleanup(patcher.stop)
+        github_client.reset()
+        self.addCleanup(github_client.reset)
+
+    def test_fetch_pull_request(self):
+        self.requester.graphql_query.return_value = ({}, {'data': pull_request_data(comments=[
+            comment_node(1, 'hi'),
+            comment_node(2, 'hello', login='someone'),
+            comment_node(3, 'ghost', login=None),
+            comment_node(4, 'linting service: good')])})
+        pr = github_graphql.fetch_pull_request('nwb-extensions', 'staged-extensions', 7)
+
+        self.assertEqual(self.requester.graphql_query.call_count, 1)
+        variables = self.requester.graphql_query.call_args[0][1]
+        self.assertEqual(variables, {'owner': 'nwb-extensions', 'name': 'staged-extensions', 'number': 7})
+        self.assertEqual(pr.state, 'open')
+        self.assertIs(pr.mergeable, True)
+        self.assertEqual(pr.head_sha, 'abc123')
+        self.assertEqual([comment.id for comment in pr.bot_comments], [1, 4])
+        self.assertEqual(pr.bot_comments[1].node_id, 'IC_4')
+
+    def test_mergeable_states(self):
+        for state, mergeable, expected in [('OPEN', 'UNKNOWN', None),
+                                           ('OPEN', 'CONFLICTING', False),
+                                           ('MERGED', 'UNKNOWN', None)]:
+            self.requester.graphql_query.return_value = ({}, {'data': pull_request_data(state, mergeable)})
+            pr = github_graphql.Repository('nwb-extensions', 'staged-extensions').get_pull(1)
+            self.assertEqual(pr.state, state.lower())
+            self.assertIs(pr.mergeable, expected)
+
+    def test_get_pull_polls_state_only(self):
+        self.requester.graphql_query.return_value = ({}, {'data': pull_request_data()})
+        with mock.patch.object(github_graphql, 'read_token', return_value='read'):
+            pr = github_graphql.Repository('nwb-extensions', 'staged-extensions').get_pull(1)
+        self.assertEqual((pr.head_sha, pr.base_sha), ('abc123', 'def456'))
+        self.assertNotIn('comments', self.requester.graphql_query.call_args[0][0])
+        self.assertEqual(self.github.call_args[0][0], 'read')
+
+    def test_clone_url(self):
+        repo = github_graphql.Repository('nwb-extensions', 'staged-extensions')
+        self.assertEqual(repo.clone_url, 'https://github.com/nwb-extensions/staged-extensions.git')
+
+    def test_comment_mutations(self):
+        self.requester.graphql_named_mutation.return_value = (
+            {}, {'commentEdge': {'node': comment_node(5, None)}})
+        comment = github_graphql.add_comment('PR_1', 'hi')
+        self.assertEqual(comment, github_graphql.Comment(5, 'IC_5', 'https://github.com/comment/5', 'hi'))
+        self.requester.graphql_named_mutation.assert_called_with(
+            'addComment', {'subjectId': 'PR_1', 'body': 'hi'}, mock.ANY)
+
+        comment = github_graphql.update_comment(comment, 'bye')
+        self.assertEqual(comment.body, 'bye')
+        self.requester.graphql_named_mutation.assert_called_with(
+            'updateIssueComment', {'id': 'IC_5', 'body': 'bye'}, mock.ANY)
+
+    def test_create_status(self):
+        github_graphql.create_status('nwb-extensions', 'staged-extensions', 'abc123', 'success',
+                                     'All good.', 'nwb-extensions-linter')
+        self.requester.requestJsonAndCheck.assert_called_once_with(
+            'POST', '/repos/nwb-extensions/staged-extensions/statuses/abc123',
+            input={'state': 'success', 'description': 'All good.', 'context': 'nwb-extensions-linter'})
+
+
+if __name__ == '__main__':
+    unittest.main()
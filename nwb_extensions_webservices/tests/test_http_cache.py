@@ -0,0 +1,108 @@
+import os
+import unittest
+
+try:
+    import unittest.mock as mock
+except ImportError:
+    import mock
+
+from requests.structures import CaseInsensitiveDict
+
+from nwb_extensions_webservices.http_cache import HTTPCache, CachingHTTPSConnection
+from nwb_extensions_webservices.store import SQLiteCache
+from nwb_extensions_webservices.utils import tmp_directory
+
+
+def response(status, body='', **headers):
+    headers.setdefault('X-RateLimit-Remaining', '4999')
+    return mock.MagicMock(status_code=status, text=body,
+                          headers=CaseInsensitiveDict(headers))
+
+
+class TestCachingHTTPSConnection(unittest.TestCase):
+    def setUp(self):
+        self.cache = HTTPCache(max_entries=2)
+        self.cnx = CachingHTTPSConnection('api.github.com')
+        self.cnx.cache = self.cache
+        self.cnx.session = mock.MagicMock()
+        self.get = self.cnx.session.get
+
+    def request(self, url='/repos/nwb-extensions/staged-extensions', verb='GET', token='a'):
+        self.cnx.request(verb, url, None, {'Authorization': 'token ' + token})
+        return self.cnx.getresponse()
+
+    def sent_headers(self):
+        return self.get.call_args[1]['headers']
+
+    def test_not_modified_is_served_from_cache(self):
+        self.get.return_value = response(200, '{"id": 1}', ETag='"abc"')
+        self.assertEqual(self.request().read(), '{"id": 1}')
+        self.assertNotIn('If-None-Match', self.sent_headers())
+
+        self.get.return_value = response(304, ETag='"abc"', **{'X-RateLimit-Remaining': '4998'})
+        cached = self.request()
+        self.assertEqual(self.sent_headers()['If-None-Match'], '"abc"')
+        self.assertEqual(cached.status, 200)
+        self.assertEqual(cached.read(), '{"id": 1}')
+        # The rate limit headers are the fresh ones.
+        self.assertEqual(dict(cached.getheaders())['X-RateLimit-Remaining'], '4998')
+
+        stats = self.cache.stats()
+        self.assertEqual(stats['not_modified'], 1)
+        self.assertEqual(stats['rate_limit_saved'], 1)
+        self.assertEqual(stats['hit_ratio'], 0.5)
+
+    def test_modified_replaces_entry(self):
+        self.get.return_value = response(200, 'old', ETag='"1"')
+        self.request()
+        self.get.return_value = response(200, 'new', ETag='"2"')
+        self.assertEqual(self.request().read(), 'new')
+        self.get.return_value = response(304)
+        self.request()
+        self.assertEqual(self.sent_headers()['If-None-Match'], '"2"')
+
+    def test_last_modified(self):
+        date = 'Mon, 01 Jan 2024 00:00:00 GMT'
+        self.get.return_value = response(200, 'body', **{'Last-Modified': date})
+        self.request()
+        self.get.return_value = response(304)
+        self.assertEqual(self.request().read(), 'body')
+        self.assertEqual(self.sent_headers()['If-Modified-Since'], date)
+
+    def test_tokens_are_cached_separately(self):
+        self.get.return_value = response(200, 'body', ETag='"abc"')
+        self.request(token='a')
+        self.request(token='b')
+        self.assertNotIn('If-None-Match', self.sent_headers())
+
+    def test_writes_are_not_cached(self):
+        self.get.return_value = response(200, 'body', ETag='"abc"')
+        self.cnx.session.post.return_value = response(201, 'body', ETag='"abc"')
+        self.request(verb='POST')
+        self.request()
+        self.assertNotIn('If-None-Match', self.sent_headers())
+
+    def test_least_recently_used_is_evicted(self):
+        self.get.return_value = response(200, 'body', ETag='"abc"')
+        for url in ['/a', '/b', '/a', '/c']:
+            self.request(url)
+        self.request('/a')
+        self.assertIn('If-None-Match', self.sent_headers())
+        self.request('/b')
+        self.assertNotIn('If-None-Match', self.sent_headers())
+
+    def test_disk(self):
+        with tmp_directory() as tmp_dir:
+            disk = SQLiteCache(os.path.join(tmp_dir, 'github_http.sqlite'))
+            self.cnx.cache = HTTPCache(disk=disk)
+            self.get.return_value = response(200, 'body', ETag='"abc"')
+            self.request()
+
+            # A fresh process only has what is on disk.
+            self.cnx.cache = HTTPCache(disk=disk)
+            self.get.return_value = response(304)
+            self.assertEqual(self.request().read(), 'body')
+
+
+if __name__ == '__main__':
+    unittest.main()
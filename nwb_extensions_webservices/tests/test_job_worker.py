@@ -0,0 +1,95 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from urllib.request import urlopen
+
+from nwb_extensions_webservices import metrics
+from nwb_extensions_webservices.job_worker import run, serve_metrics
+from nwb_extensions_webservices.jobs import SharedJobQueue
+from nwb_extensions_webservices.store import JobStore
+
+calls = []
+started = threading.Event()
+release = threading.Event()
+
+
+def lint(pr):
+    calls.append(pr)
+
+
+def block():
+    started.set()
+    release.wait()
+
+
+class TestJobWorker(unittest.TestCase):
+    def setUp(self):
+        del calls[:]
+        started.clear()
+        release.clear()
+        self.addCleanup(release.set)
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        # A store in a temporary file stands in for the one web and worker processes share.
+        self.path = os.path.join(tmp_dir, 'jobs.sqlite')
+        self.web = SharedJobQueue(JobStore(self.path), max_workers=0)
+        self.worker = SharedJobQueue(JobStore(self.path), max_workers=2, poll_interval=0.01)
+        self.stop = threading.Event()
+        self.thread = threading.Thread(target=run, args=(self.worker, self.stop, 0.05))
+
+    def tearDown(self):
+        self.stop.set()
+        self.thread.join()
+
+    def test_runs_queued_jobs(self):
+        for pr in range(3):
+            self.web.submit('lint', lint, pr)
+        # The web process doesn't run them itself.
+        self.assertEqual(self.web.depth, 3)
+
+        self.thread.start()
+        self.web.join()
+        self.assertEqual(sorted(calls), [0, 1, 2])
+        self.assertEqual(self.worker.stats()['jobs']['lint']['count'], 3)
+
+    def test_stop_hands_back_running_jobs(self):
+        job = self.web.submit('block', block)
+        self.thread.start()
+        started.wait()
+        self.stop.set()
+        self.thread.join()
+
+        self.assertEqual(self.web.store.get(job.id)['state'], 'queued')
+
+        # Finishing it late doesn't take it out of the queue again.
+        release.set()
+        while self.worker.stats()['running']:
+            time.sleep(0.01)
+        self.assertEqual(self.web.store.get(job.id)['state'], 'queued')
+
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        self.server = serve_metrics(0)
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+    def test_metrics(self):
+        metrics.stage_seconds.observe(1, task='lint', stage='worker-test')
+        response = urlopen('http://localhost:{}/metrics'.format(self.server.server_port))
+        self.assertTrue(response.headers['Content-Type'].startswith('text/plain'))
+        self.assertIn('nwb_webservices_stage_seconds_count{stage="worker-test",task="lint"} 1',
+                      response.read().decode('utf-8'))
+
+    def test_next_free_port(self):
+        server = serve_metrics(self.server.server_port)
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.assertNotEqual(server.server_port, self.server.server_port)
+
+
+if __name__ == '__main__':
+    unittest.main()
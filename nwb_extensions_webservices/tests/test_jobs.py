@@ -0,0 +1,259 @@
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import types
+import unittest
+
+try:
+    import unittest.mock as mock
+except ImportError:
+    import mock
+
+from nwb_extensions_webservices.jobs import JobQueue, QueueFull, SharedJobQueue, current_job, function_path
+from nwb_extensions_webservices.store import JobStore
+
+# What the shared queue's jobs did, they have to be module level functions.
+calls = []
+started = threading.Event()
+release = threading.Event()
+
+
+def record(*args, **kwargs):
+    if kwargs.get('block'):
+        started.set()
+        release.wait()
+    calls.append((args, kwargs, current_job().superseded))
+    return len(args)
+
+
+def fail():
+    raise ValueError('boom')
+
+
+# The queue retry() retries itself in.
+retrying = []
+
+
+def retry(attempt):
+    if attempt == 1:
+        retrying[0].submit_later(0, 'retry', retry, 2, key=('retry', 1))
+    calls.append(((attempt,), {}, current_job().superseded))
+
+
+class TestJobQueue(unittest.TestCase):
+    def test_runs_jobs(self):
+        job_queue = JobQueue(max_workers=2)
+        results = []
+        for i in range(5):
+            job_queue.submit('append', results.append, i)
+        job_queue.join()
+
+        self.assertEqual(sorted(results), list(range(5)))
+        stats = job_queue.stats()
+        self.assertEqual(stats['depth'], 0)
+        self.assertEqual(stats['jobs']['append']['count'], 5)
+        self.assertEqual(stats['jobs']['append']['failed'], 0)
+
+    def test_failure_is_recorded(self):
+        job_queue = JobQueue(max_workers=1)
+
+        def fail():
+            raise ValueError('boom')
+
+        job = job_queue.submit('fail', fail)
+        job_queue.join()
+
+        self.assertEqual(job_queue.stats()['jobs']['fail']['failed'], 1)
+        self.assertIsNotNone(job.run_time)
+        self.assertIsNotNone(job.wait_time)
+
+    def test_queue_full(self):
+        job_queue = JobQueue(max_workers=1, max_depth=1)
+        release = threading.Event()
+        started = threading.Event()
+
+        def block():
+            started.set()
+            release.wait()
+
+        job_queue.submit('block', block)
+        started.wait()
+        job_queue.submit('block', block)
+        with self.assertRaises(QueueFull):
+            job_queue.submit('block', block)
+        release.set()
+        job_queue.join()
+
+    def test_coalesce_pending(self):
+        job_queue = JobQueue(max_workers=1)
+        release = threading.Event()
+        started = threading.Event()
+        results = []
+
+        def block():
+            started.set()
+            release.wait()
+
+        job_queue.submit('block', block)
+        started.wait()
+        first = job_queue.submit('lint', results.append, 1, key=('lint', 1))
+        second = job_queue.submit('lint', results.append, 2, key=('lint', 1))
+        third = job_queue.submit('lint', results.append, 3, key=('lint', 1))
+        self.assertIs(first, second)
+        self.assertIs(first, third)
+        self.assertEqual(job_queue.depth, 1)
+        release.set()
+        job_queue.join()
+
+        self.assertEqual(results, [3])
+        self.assertEqual(job_queue.stats()['collapsed'], 2)
+
+    def test_supersede_running(self):
+        job_queue = JobQueue(max_workers=2)
+        release = threading.Event()
+        started = threading.Event()
+        superseded = []
+
+        def lint(n):
+            if n == 1:
+                started.set()
+                release.wait()
+            superseded.append((n, current_job().superseded))
+
+        job_queue.submit('lint', lint, 1, key=('lint', 1))
+        started.wait()
+        job_queue.submit('lint', lint, 2, key=('lint', 1))
+        release.set()
+        job_queue.join()
+
+        self.assertEqual(sorted(superseded), [(1, True), (2, False)])
+        self.assertEqual(job_queue.stats()['superseded'], 1)
+
+    def test_retry_does_not_supersede(self):
+        job_queue = JobQueue(max_workers=2)
+        retried = threading.Event()
+        superseded = []
+
+        def lint(attempt):
+            if attempt == 1:
+                job_queue.submit_later(0, 'lint', lint, 2, key=('lint', 1))
+                # Still running when the retry is submitted.
+                retried.wait(5)
+            else:
+                retried.set()
+            superseded.append((attempt, current_job().superseded))
+
+        job_queue.submit('lint', lint, 1, key=('lint', 1))
+        retried.wait(5)
+        job_queue.join()
+
+        self.assertEqual(sorted(superseded), [(1, False), (2, False)])
+        self.assertEqual(job_queue.stats()['superseded'], 0)
+
+
+class TestSharedJobQueue(unittest.TestCase):
+    def setUp(self):
+        del calls[:]
+        started.clear()
+        release.clear()
+        self.addCleanup(release.set)
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        self.path = os.path.join(tmp_dir, 'jobs.sqlite')
+
+    def queue(self, **kwargs):
+        job_queue = SharedJobQueue(JobStore(self.path), poll_interval=0.01, **kwargs)
+        # With a timeout, so that a failed test can't leave it waiting for a blocked job.
+        self.addCleanup(job_queue.stop, timeout=5)
+        return job_queue
+
+    def test_function_path(self):
+        self.assertEqual(function_path(record), 'nwb_extensions_webservices.tests.test_jobs:record')
+        with self.assertRaises(ValueError):
+            function_path(lambda: None)
+        with self.assertRaises(ValueError):
+            function_path(calls.append)
+        # Defined in a script, which no other process can import.
+        with mock.patch.dict(sys.modules, {'__main__': types.ModuleType('__main__')}), \
+                mock.patch.object(record, '__module__', '__main__'):
+            with self.assertRaises(ValueError):
+                function_path(record)
+
+    def test_runs_jobs(self):
+        job_queue = self.queue(max_workers=2)
+        jobs = [job_queue.submit('record', record, i, tag='x') for i in range(3)]
+        failed = job_queue.submit('fail', fail)
+        job_queue.join()
+
+        self.assertEqual(sorted(calls), [((i,), {'tag': 'x'}, False) for i in range(3)])
+        self.assertEqual(job_queue.store.get(jobs[0].id)['result'], 1)
+        self.assertIn('ValueError: boom', job_queue.store.get(failed.id)['error'])
+        stats = job_queue.stats()
+        self.assertEqual(stats['store'], {'done': 3, 'failed': 1})
+        self.assertEqual(stats['jobs']['record']['count'], 3)
+
+    def test_store_errors_after_a_job(self):
+        job_queue = SharedJobQueue(JobStore(self.path, lease_time=0.3), max_workers=1, poll_interval=0.01)
+        self.addCleanup(job_queue.stop)
+        with mock.patch.object(job_queue.store, 'finish', side_effect=sqlite3.OperationalError('database is locked')):
+            first = job_queue.submit('record', record, 1)
+            while first.id not in job_queue._unfinished:
+                time.sleep(0.01)
+        # The worker thread survived, and the first job's result is written once the store works again.
+        second = job_queue.submit('record', record, 2)
+        job_queue.join()
+        self.assertEqual([args for args, _, _ in calls], [(1,), (2,)])
+        self.assertEqual(job_queue.store.get(first.id)['state'], 'done')
+        self.assertEqual(job_queue.store.get(second.id)['state'], 'done')
+
+    def test_shared_between_processes(self):
+        # Two queues on the same file stand in for two processes, the second only queues jobs
+        # (like a web process with WEB_RUNS_JOBS=0) so it can't take one before they are collapsed.
+        first = self.queue(max_workers=1)
+        second = self.queue(max_workers=0)
+        first.submit('record', record, 'block', block=True)
+        started.wait()
+        for i in range(3):
+            second.submit('lint', record, i, key=('lint', 1))
+        self.assertEqual(second.depth, 1)
+        self.assertEqual(second.stats()['collapsed'], 2)
+        release.set()
+        first.join()
+
+        # Only the last of the three lint jobs ran.
+        self.assertCountEqual([args for args, _, _ in calls], [('block',), (2,)])
+
+    def test_supersede_running(self):
+        job_queue = self.queue(max_workers=2)
+        job_queue.submit('lint', record, 1, key=('lint', 1), block=True)
+        started.wait()
+        job_queue.submit('lint', record, 2, key=('lint', 1))
+        release.set()
+        job_queue.join()
+
+        self.assertEqual(job_queue.stats()['superseded'], 1)
+        self.assertEqual(sorted((args, superseded) for args, _, superseded in calls), [((1,), True), ((2,), False)])
+
+    def test_retry_does_not_supersede(self):
+        job_queue = self.queue(max_workers=1)
+        retrying.append(job_queue)
+        self.addCleanup(retrying.remove, job_queue)
+        job_queue.submit('retry', retry, 1, key=('retry', 1))
+        job_queue.join()
+
+        self.assertEqual(sorted(calls), [((1,), {}, False), ((2,), {}, False)])
+        self.assertEqual(job_queue.stats()['superseded'], 0)
+
+    def test_queue_full(self):
+        job_queue = self.queue(max_depth=1)
+        job_queue.submit_later(60, 'record', record)
+        with self.assertRaises(QueueFull):
+            job_queue.submit('record', record)
+
+
+if __name__ == '__main__':
+    unittest.main()
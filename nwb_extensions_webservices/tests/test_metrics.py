@@ -0,0 +1,81 @@
+import itertools
+import threading
+import time
+import unittest
+
+from nwb_extensions_webservices import metrics
+from nwb_extensions_webservices.jobs import JobQueue
+
+
+class TestMetrics(unittest.TestCase):
+    def test_counter(self):
+        counter = metrics.Counter('requests_total', 'Requests.')
+        counter.inc(handler='A', code=200)
+        counter.inc(handler='A', code=200)
+        counter.inc(handler='B"', code=404)
+        self.assertEqual(counter.render(), '\n'.join([
+            '# HELP requests_total Requests.',
+            '# TYPE requests_total counter',
+            'requests_total{code="200",handler="A"} 2',
+            'requests_total{code="404",handler="B\\""} 1']))
+
+    def test_histogram(self):
+        histogram = metrics.Histogram('seconds', 'Time.', buckets=(1, 5))
+        for value in [0.5, 1, 3, 10]:
+            histogram.observe(value, stage='lint')
+        lines = histogram.render().split('\n')[2:]
+        self.assertEqual(lines, [
+            'seconds_bucket{stage="lint",le="1"} 2',
+            'seconds_bucket{stage="lint",le="5"} 3',
+            'seconds_bucket{stage="lint",le="+Inf"} 4',
+            'seconds_sum{stage="lint"} 14.5',
+            'seconds_count{stage="lint"} 4'])
+
+    def test_gauge(self):
+        gauge = metrics.Gauge('disk_bytes', 'Disk.', lambda: {(('kind', 'free'),): 10, (('kind', 'used'),): 5})
+        self.assertIn('disk_bytes{kind="used"} 5', gauge.render())
+        self.assertIn('depth 3', metrics.Gauge('depth', 'Depth.', lambda: 3).render())
+
+    def test_background_value(self):
+        sizes = itertools.count()
+        measure = threading.Event()
+
+        def size():
+            measure.wait(1)
+            return next(sizes)
+
+        gauge = metrics.Gauge('cache_bytes', 'Cache.', metrics.BackgroundValue(size, 0.01))
+        # Not measured while scraping, so there is nothing to report until the thread has.
+        self.assertEqual(gauge.render().split('\n')[2:], [])
+        measure.set()
+        deadline = time.time() + 1
+        while gauge.func.value is None and time.time() < deadline:
+            time.sleep(0.01)
+        first = int(gauge.render().split(' ')[-1])
+        time.sleep(0.05)
+        self.assertGreater(int(gauge.render().split(' ')[-1]), first)
+
+    def test_stage_and_jobs(self):
+        queue = JobQueue(max_workers=1)
+        queue.add_hook(metrics.time_job)
+
+        def task():
+            with metrics.stage('test-task', 'clone'):
+                pass
+
+        def fail():
+            raise RuntimeError
+
+        queue.submit('test-job', task)
+        queue.submit('test-job', fail)
+        queue.join()
+        text = metrics.registry.render()
+        self.assertIn('nwb_webservices_stage_seconds_count{stage="clone",task="test-task"} 1', text)
+        self.assertIn('nwb_webservices_job_run_seconds_count{job="test-job"} 2', text)
+        self.assertIn('nwb_webservices_job_failures_total{job="test-job"} 1', text)
+        self.assertIn('nwb_webservices_job_queue_depth 0', text)
+        self.assertIn('nwb_webservices_tmp_disk_bytes{kind="free"}', text)
+
+
+if __name__ == '__main__':
+    unittest.main()
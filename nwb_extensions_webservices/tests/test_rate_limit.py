@@ -0,0 +1,55 @@
+import time
+import unittest
+
+from requests.structures import CaseInsensitiveDict
+
+from nwb_extensions_webservices.jobs import JobQueue
+from nwb_extensions_webservices.rate_limit import RateLimitTracker, token_fingerprint
+
+
+def headers(remaining, limit=5000, reset=None, **extra):
+    if reset is None:
+        reset = int(time.time()) + 3600
+    headers = CaseInsensitiveDict({'X-RateLimit-Remaining': str(remaining),
+                                   'X-RateLimit-Limit': str(limit),
+                                   'X-RateLimit-Reset': str(reset)})
+    headers.update(extra)
+    return headers
+
+
+class TestRateLimitTracker(unittest.TestCase):
+    def setUp(self):
+        self.tracker = RateLimitTracker()
+
+    def test_latest_response_wins(self):
+        self.assertIsNone(self.tracker.remaining('abc'))
+        self.tracker.record('token abc', 200, headers(4999))
+        self.tracker.record('token abc', 200, headers(4998))
+        self.assertEqual(self.tracker.remaining('abc')[:2], (4998, 5000))
+        self.assertIsNone(self.tracker.remaining('def'))
+
+    def test_window_reset(self):
+        self.tracker.record('token abc', 200, headers(0, reset=int(time.time()) - 1))
+        self.assertEqual(self.tracker.remaining('abc')[0], 5000)
+
+    def test_per_handler(self):
+        queue = JobQueue(max_workers=1)
+        queue.submit('lint', self.tracker.record, 'token sekrit', 200, headers(10))
+        queue.submit('lint', self.tracker.record, 'token sekrit', 304, headers(10))
+        queue.join()
+        self.tracker.record('token sekrit', 200, headers(9, **{'X-RateLimit-Resource': 'graphql'}))
+
+        stats = self.tracker.stats()
+        self.assertEqual(stats['handlers']['lint']['core'], {'requests': 2, 'consumed': 1})
+        self.assertEqual(stats['handlers']['other']['graphql'], {'requests': 1, 'consumed': 1})
+        self.assertEqual(set(stats['tokens'][token_fingerprint('sekrit')]), {'core', 'graphql'})
+        self.assertNotIn('sekrit', str(stats))
+
+    def test_no_headers(self):
+        self.tracker.record('token abc', 500, CaseInsensitiveDict())
+        self.tracker.record(None, 200, headers(10))
+        self.assertEqual(self.tracker.stats(), {'tokens': {}, 'handlers': {}})
+
+
+if __name__ == '__main__':
+    unittest.main()
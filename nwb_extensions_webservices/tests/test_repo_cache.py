@@ -0,0 +1,112 @@
+import os
+import unittest
+
+from git import Repo
+
+from nwb_extensions_webservices.repo_cache import (RepoCache, Workspace, checkout_paths, clone_workspace,
+                                                   strip_credentials)
+from nwb_extensions_webservices.utils import tmp_directory
+
+
+def commit_file(repo, name, content):
+    path = os.path.join(repo.working_tree_dir, name)
+    with open(path, 'w') as fh:
+        fh.write(content)
+    repo.index.add([name])
+    return repo.index.commit('Add {}'.format(name))
+
+
+def missing_objects(repo):
+    # The objects of a partial clone that haven't been downloaded.
+    objects = repo.git.rev_list('--objects', '--missing=print', '--all').splitlines()
+    return sum(line.startswith('?') for line in objects)
+
+
+class TestRepoCache(unittest.TestCase):
+    def test_strip_credentials(self):
+        self.assertEqual(strip_credentials('https://token@github.com/org/repo.git'),
+                         'https://github.com/org/repo.git')
+        self.assertEqual(strip_credentials('https://github.com/org/repo.git'),
+                         'https://github.com/org/repo.git')
+
+    def test_clone_and_fetch(self):
+        with tmp_directory() as tmp_dir:
+            upstream = Repo.init(os.path.join(tmp_dir, 'upstream'))
+            commit_file(upstream, 'a.txt', 'a')
+            cache = RepoCache(os.path.join(tmp_dir, 'cache'), 10 * 1024 * 1024)
+            url = upstream.working_tree_dir
+
+            clone = cache.clone_from(url, os.path.join(tmp_dir, 'clone1'))
+            self.assertTrue(os.path.exists(os.path.join(clone.working_tree_dir, 'a.txt')))
+            self.assertEqual(clone.remotes.origin.url, url)
+
+            # A new commit upstream is picked up by the next clone.
+            sha = commit_file(upstream, 'b.txt', 'b').hexsha
+            clone = cache.clone_from(url, os.path.join(tmp_dir, 'clone2'))
+            self.assertEqual(clone.head.commit.hexsha, sha)
+            self.assertEqual(len(os.listdir(cache.root)), 2)  # The mirror and its lock.
+
+    def test_evict(self):
+        with tmp_directory() as tmp_dir:
+            cache = RepoCache(os.path.join(tmp_dir, 'cache'), 0)
+            urls = []
+            for name in ['one', 'two']:
+                upstream = Repo.init(os.path.join(tmp_dir, name))
+                commit_file(upstream, 'a.txt', name)
+                urls.append(upstream.working_tree_dir)
+                cache.clone_from(urls[-1], os.path.join(tmp_dir, name + '_clone'))
+
+            # Only the most recently used mirror survives a zero size cap.
+            self.assertFalse(os.path.exists(cache.mirror_dir(urls[0])))
+            self.assertTrue(os.path.exists(cache.mirror_dir(urls[1])))
+
+
+class TestPartialWorkspace(unittest.TestCase):
+    def test_sparse_checkout(self):
+        with tmp_directory() as tmp_dir:
+            upstream = Repo.init(os.path.join(tmp_dir, 'upstream'))
+            for name in ['README', 'a/ndx-meta.yaml', 'b/ndx-meta.yaml']:
+                os.makedirs(os.path.join(upstream.working_tree_dir, os.path.dirname(name)), exist_ok=True)
+                commit_file(upstream, name, name)
+            upstream.git.config('uploadpack.allowFilter', 'true')
+
+            clone_dir = os.path.join(tmp_dir, 'clone')
+            repo = clone_workspace('file://' + upstream.working_tree_dir, clone_dir, mode='partial')
+            self.assertEqual(os.listdir(clone_dir), ['.git'])
+            # Commits and trees are there, file contents are not.
+            self.assertEqual(missing_objects(repo), 3)
+
+            checkout_paths(repo, ['b'], mode='partial')
+            self.assertEqual(sorted(os.listdir(clone_dir)), ['.git', 'README', 'b'])
+            self.assertEqual(missing_objects(repo), 1)
+
+            checkout_paths(repo, ['.'], mode='partial')
+            self.assertEqual(sorted(os.listdir(clone_dir)), ['.git', 'README', 'a', 'b'])
+
+
+class TestWorkspace(unittest.TestCase):
+    def test_fetch_checkout_restore(self):
+        with tmp_directory() as tmp_dir:
+            upstream = Repo.init(os.path.join(tmp_dir, 'upstream'))
+            commit_file(upstream, 'a.txt', 'a')
+            fork = Repo.clone_from(upstream.working_tree_dir, os.path.join(tmp_dir, 'fork'))
+            fork.create_head('feature').checkout()
+            sha = commit_file(fork, 'b.txt', 'b').hexsha
+
+            workspace = Workspace(Repo.clone_from(fork.working_tree_dir, os.path.join(tmp_dir, 'clone'),
+                                                  branch='feature'), mode='mirror')
+            self.assertEqual(workspace.head, 'feature')
+            # Something only the base repository has.
+            upstream.create_tag('base')
+            workspace.fetch(upstream.working_tree_dir, ['refs/tags/base:refs/heads/base'])
+            workspace.checkout(['.'], ref='base')
+            self.assertFalse(os.path.exists(os.path.join(workspace.path, 'b.txt')))
+
+            workspace.restore()
+            self.assertEqual(workspace.repo.active_branch.name, 'feature')
+            self.assertEqual(workspace.repo.head.commit.hexsha, sha)
+            self.assertTrue(os.path.exists(os.path.join(workspace.path, 'b.txt')))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+import json
+import unittest
+
+from nwb_extensions_webservices.routing import Route, decode_members, route_payload
+
+
+class TestDecodeMembers(unittest.TestCase):
+    def test_members(self):
+        body = json.dumps({'action': 'opened', 'number': 3, 'pull_request': {'head': {'sha': 'abc'}},
+                           'repository': {'name': 'staged-extensions', 'owner': {'login': 'nwb-extensions'}}})
+        self.assertEqual(decode_members(body.encode('utf-8'), ['action', 'repository']),
+                         {'action': 'opened',
+                          'repository': {'name': 'staged-extensions', 'owner': {'login': 'nwb-extensions'}}})
+
+    def test_missing_members(self):
+        self.assertEqual(decode_members(' { "a" : 1 , "b" : [2] } ', ['b', 'c']), {'b': [2]})
+        self.assertEqual(decode_members('{}', ['a']), {})
+
+    def test_stops_early(self):
+        # Whatever follows the last member needed is never read.
+        self.assertEqual(decode_members('{"ref": "refs/heads/master", "commits": [nonsense', ['ref']),
+                         {'ref': 'refs/heads/master'})
+
+    def test_invalid(self):
+        for body in ['', '[]', '{"a" 1}', '{"a": }', '{"a": 1 "b": 2}', '{a: 1}', '{"a": 1']:
+            with self.assertRaises(ValueError, msg=body):
+                decode_members(body, ['b'])
+
+
+class TestRoutePayload(unittest.TestCase):
+    def test_job_members_after_filters(self):
+        route = Route(['push'], ['ref'], [lambda payload: payload['ref'] == 'refs/heads/master'], None,
+                      ['head_commit'])
+        # A push to another branch is rejected before its commits are read.
+        self.assertIsNone(route_payload(route, '{"ref": "refs/heads/dev", "commits": [nonsense'))
+        body = '{"ref": "refs/heads/master", "commits": [], "head_commit": {"id": "a"}}'
+        self.assertEqual(route_payload(route, body), {'ref': 'refs/heads/master', 'head_commit': {'id': 'a'}})
+        self.assertEqual(route_payload(route._replace(job_members=()), '{"ref": "refs/heads/master", "commits": ['),
+                         {'ref': 'refs/heads/master'})
+
+
+if __name__ == '__main__':
+    unittest.main()
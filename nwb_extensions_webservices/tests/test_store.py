@@ -0,0 +1,146 @@
+import os
+import threading
+import time
+import unittest
+
+from nwb_extensions_webservices.store import JobStore, SQLiteCache
+from nwb_extensions_webservices.utils import tmp_directory
+
+
+class TestSQLiteCache(unittest.TestCase):
+    def test_get_set(self):
+        with tmp_directory() as tmp_dir:
+            cache = SQLiteCache(os.path.join(tmp_dir, 'cache.sqlite'))
+            self.assertIsNone(cache.get('a'))
+            cache.set('a', [['lint'], []])
+            self.assertEqual(cache.get('a'), [['lint'], []])
+            cache.delete('a')
+            self.assertIsNone(cache.get('a'))
+            self.assertEqual(cache.stats()['hits'], 1)
+            self.assertEqual(cache.stats()['misses'], 2)
+
+    def test_add(self):
+        with tmp_directory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'cache.sqlite')
+            self.assertTrue(SQLiteCache(path).add('a', 1))
+            self.assertFalse(SQLiteCache(path).add('a', 2))
+            self.assertEqual(SQLiteCache(path).get('a'), 1)
+
+            cache = SQLiteCache(path, ttl=0.01)
+            time.sleep(0.02)
+            self.assertTrue(cache.add('a', 3))
+
+    def test_shared_file(self):
+        with tmp_directory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'cache.sqlite')
+            SQLiteCache(path).set('a', 1)
+            self.assertEqual(SQLiteCache(path).get('a'), 1)
+
+    def test_lru_eviction(self):
+        with tmp_directory() as tmp_dir:
+            cache = SQLiteCache(os.path.join(tmp_dir, 'cache.sqlite'), max_entries=2, evict_every=1)
+            cache.set('a', 1)
+            cache.set('b', 2)
+            time.sleep(0.01)
+            cache.get('a')
+            cache.set('c', 3)
+            self.assertEqual(len(cache), 2)
+            self.assertIsNone(cache.get('b'))
+            self.assertEqual(cache.get('a'), 1)
+
+    def test_evicted_every_few_writes(self):
+        with tmp_directory() as tmp_dir:
+            cache = SQLiteCache(os.path.join(tmp_dir, 'cache.sqlite'), max_entries=2, evict_every=3)
+            for key in 'abcde':
+                cache.add(key, 1)
+            # Evicted down to 2 by the third write, then not yet again.
+            self.assertEqual(len(cache), 4)
+            cache.set('f', 1)
+            self.assertEqual(len(cache), 2)
+            self.assertEqual(cache.get('f'), 1)
+
+    def test_ttl(self):
+        with tmp_directory() as tmp_dir:
+            cache = SQLiteCache(os.path.join(tmp_dir, 'cache.sqlite'), ttl=0.05)
+            cache.set('a', 1)
+            self.assertEqual(cache.get('a'), 1)
+            time.sleep(0.1)
+            self.assertIsNone(cache.get('a'))
+
+
+class TestJobStore(unittest.TestCase):
+    def test_lease_and_finish(self):
+        with tmp_directory() as tmp_dir:
+            store = JobStore(os.path.join(tmp_dir, 'jobs.sqlite'))
+            job_id, outcome = store.enqueue('lint', 'module:func', ('a', 1), {'b': 2})
+            self.assertEqual(outcome, 'queued')
+            self.assertEqual(store.count('queued'), 1)
+
+            job = store.lease('me')
+            self.assertEqual((job['id'], job['func'], job['args'], job['kwargs']),
+                             (job_id, 'module:func', ['a', 1], {'b': 2}))
+            self.assertIsNone(store.lease('someone else'))
+
+            store.finish(job_id, result={'ok': True})
+            self.assertEqual(store.get(job_id)['state'], 'done')
+            self.assertEqual(store.get(job_id)['result'], {'ok': True})
+            self.assertEqual(store.stats(), {'done': 1})
+
+    def test_leased_once(self):
+        with tmp_directory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'jobs.sqlite')
+            for i in range(50):
+                JobStore(path).enqueue('job', 'module:func', [i])
+            leased = []
+
+            def lease(owner):
+                # A store per thread, like separate processes would have.
+                store = JobStore(path)
+                while True:
+                    job = store.lease(owner)
+                    if job is None:
+                        break
+                    leased.append(job['args'][0])
+
+            threads = [threading.Thread(target=lease, args=(i,)) for i in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual(sorted(leased), list(range(50)))
+
+    def test_coalesce(self):
+        with tmp_directory() as tmp_dir:
+            store = JobStore(os.path.join(tmp_dir, 'jobs.sqlite'))
+            first, _ = store.enqueue('lint', 'module:func', [1], key='pr')
+            self.assertEqual(store.enqueue('lint', 'module:func', [2], key='pr'), (first, 'collapsed'))
+            self.assertEqual(store.lease('me')['args'], [2])
+
+            second, outcome = store.enqueue('lint', 'module:func', [3], key='pr')
+            self.assertEqual(outcome, 'superseded')
+            self.assertTrue(store.is_superseded(first))
+            self.assertFalse(store.is_superseded(second))
+
+    def test_delay_and_depth(self):
+        with tmp_directory() as tmp_dir:
+            store = JobStore(os.path.join(tmp_dir, 'jobs.sqlite'))
+            store.enqueue('retry', 'module:func', [], delay=0.05)
+            self.assertIsNone(store.lease('me'))
+            self.assertEqual(store.enqueue('job', 'module:func', [], max_depth=1), (None, 'full'))
+            time.sleep(0.1)
+            self.assertIsNotNone(store.lease('me'))
+
+    def test_expired_lease(self):
+        with tmp_directory() as tmp_dir:
+            store = JobStore(os.path.join(tmp_dir, 'jobs.sqlite'), lease_time=0.01, max_attempts=2)
+            job_id, _ = store.enqueue('job', 'module:func', [])
+            store.lease('crashed')
+            time.sleep(0.02)
+            self.assertEqual(store.lease('me')['id'], job_id)
+            time.sleep(0.02)
+            self.assertIsNone(store.lease('me'))
+            self.assertEqual(store.get(job_id)['state'], 'failed')
+
+
+if __name__ == '__main__':
+    unittest.main()
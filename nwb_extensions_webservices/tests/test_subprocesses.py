@@ -0,0 +1,92 @@
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+try:
+    import unittest.mock as mock
+except ImportError:
+    import mock
+
+from nwb_extensions_webservices.store import SQLiteCache
+from nwb_extensions_webservices.subprocesses import SubprocessExecutor
+
+
+def python(code):
+    return [sys.executable, '-c', code]
+
+
+class TestSubprocessExecutor(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        self.logs = SQLiteCache(os.path.join(self.tmp_dir, 'logs.sqlite'))
+
+    def executor(self, **kwargs):
+        kwargs.setdefault('max_running', 2)
+        return SubprocessExecutor('test', slot_dir=os.path.join(self.tmp_dir, 'slots'), logs=self.logs, **kwargs)
+
+    def test_run(self):
+        executor = self.executor()
+        with mock.patch.dict(os.environ, {'GH_TOKEN': 'secret'}):
+            result = executor.run(python('import sys; print("https://secret@github.com"); sys.exit(3)'),
+                                  cwd=self.tmp_dir, label='feedstock')
+        self.assertEqual(result.returncode, 3)
+        self.assertFalse(result.timed_out)
+        self.assertEqual(result.output.strip(), 'https://***@github.com')
+        self.assertTrue(result.log_key.startswith('feedstock-'))
+        log = self.logs.get(result.log_key)
+        self.assertEqual((log['returncode'], log['output'], log['cwd']), (3, result.output, self.tmp_dir))
+        self.assertEqual(executor.stats()['runs'], 1)
+        self.assertEqual(executor.stats()['failed'], 1)
+
+    def test_timeout(self):
+        executor = self.executor(timeout=0.5)
+        start = time.time()
+        # The child would outlive its parent if only the parent was killed.
+        result = executor.run(python('import subprocess, sys, time; print("started", flush=True); '
+                                     'subprocess.call([sys.executable, "-c", "import time; time.sleep(30)"])'))
+        self.assertLess(time.time() - start, 10)
+        self.assertTrue(result.timed_out)
+        self.assertNotEqual(result.returncode, 0)
+        self.assertEqual(result.output.strip(), 'started')
+        self.assertEqual(executor.stats()['timed_out'], 1)
+
+    def test_memory_limit(self):
+        executor = self.executor(max_memory=512 * 1024 * 1024)
+        result = executor.run(python('import resource; print(resource.getrlimit(resource.RLIMIT_AS)[0])'))
+        self.assertEqual(result.output.strip(), str(512 * 1024 * 1024))
+        result = executor.run(python('bytearray(2 * 1024 ** 3)'))
+        self.assertNotEqual(result.returncode, 0)
+        self.assertIn('MemoryError', result.output)
+        # The command really is run, not just looked up.
+        result = executor.run(['sh', '-c', 'exit 7'])
+        self.assertEqual(result.returncode, 7)
+
+    def test_concurrency(self):
+        executor = self.executor(max_running=1)
+        # Two executors stand for two processes sharing the slots.
+        other = self.executor(max_running=1)
+        results = []
+
+        def run(executor):
+            results.append(executor.run(python('import time; time.sleep(0.5)')))
+
+        threads = [threading.Thread(target=run, args=(e,)) for e in [executor, executor, other]]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        waits = sorted(result.wait_time for result in results)
+        self.assertLess(waits[0], 0.4)
+        self.assertGreater(waits[1], 0.4)
+        self.assertGreater(waits[2], 0.9)
+        self.assertEqual(executor.stats()['runs'] + other.stats()['runs'], 3)
+        self.assertEqual(executor.stats()['running'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,47 @@
+import unittest
+
+try:
+    import unittest.mock as mock
+except ImportError:
+    import mock
+
+from nwb_extensions_webservices import update_teams
+from nwb_extensions_webservices.update_teams import RenderedMeta
+
+
+def configure_github_team(meta, gh_repo, org, feedstock_name):
+    # Reads the rendered recipe like nwb_extensions_smithy's does.
+    maintainers = set(meta.meta.get('extra', {}).get('recipe-maintainers', []))
+    return maintainers, set(), set()
+
+
+class TestUpdateTeam(unittest.TestCase):
+    def setUp(self):
+        self.meta = {'package': {'name': 'python'}, 'extra': {'recipe-maintainers': ['some-user']}}
+        for patcher in [mock.patch.object(update_teams, 'get_organization'),
+                        mock.patch.object(update_teams, 'get_repo'),
+                        mock.patch.object(update_teams, 'clone_workspace'),
+                        mock.patch.object(update_teams, 'checkout_paths'),
+                        mock.patch.object(update_teams.worker_pool, 'call', return_value=self.meta)]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    @mock.patch.object(update_teams, 'configure_github_team', side_effect=configure_github_team)
+    def test_configured_from_rendered_meta(self, configure):
+        update_teams.update_team('nwb-extensions', 'python-feedstock')
+
+        update_teams.worker_pool.call.assert_called_once_with(update_teams.render_meta, mock.ANY,
+                                                              timeout=update_teams.RENDER_TIMEOUT)
+        meta, _, _, name = configure.call_args[0]
+        self.assertIsInstance(meta, RenderedMeta)
+        self.assertEqual(meta.meta, self.meta)
+        self.assertEqual(name, 'python')
+
+    def test_only_meta_is_rendered(self):
+        meta = RenderedMeta(self.meta)
+        with self.assertRaisesRegex(AttributeError, 'MetaData.config was read'):
+            meta.config
+
+
+if __name__ == '__main__':
+    unittest.main()
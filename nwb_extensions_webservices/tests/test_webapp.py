@@ -1,4 +1,8 @@
 import json
+import os
+import shutil
+import tempfile
+import threading
 try:
     from urllib.parse import urlencode
     import unittest.mock as mock
@@ -8,7 +12,11 @@ except ImportError:
 
 from tornado.testing import AsyncHTTPTestCase
 
+from nwb_extensions_webservices import commands, webapp
 from nwb_extensions_webservices.webapp import create_webapp
+from nwb_extensions_webservices.jobs import job_queue, QueueFull
+from nwb_extensions_webservices.store import SQLiteCache
+from nwb_extensions_webservices.utils import tmp_directory
 
 
 class TestHandlerBase(AsyncHTTPTestCase):
@@ -37,7 +45,8 @@ class TestBucketHandler(TestHandlerBase):
                               body=json.dumps(body),
                               headers={'X-GitHub-Event': 'pull_request'})
 
-        self.assertEqual(response.code, 200)
+        self.assertEqual(response.code, 202)
+        job_queue.join()
         compute_lint_message.assert_called_once_with('nwb-extensions', 'repo_name',
                                                      PR_number, False)
 
@@ -65,7 +74,8 @@ class TestBucketHandler(TestHandlerBase):
                               body=json.dumps(body),
                               headers={'X-GitHub-Event': 'pull_request'})
 
-        self.assertEqual(response.code, 200)
+        self.assertEqual(response.code, 202)
+        job_queue.join()
         compute_lint_message.assert_called_once_with('nwb-extensions', 'staged-extensions',
                                                      PR_number, True)
 
@@ -76,3 +86,109 @@ class TestBucketHandler(TestHandlerBase):
         set_pr_status.assert_called_once_with('nwb-extensions', 'staged-extensions',
                                               {'message': mock.sentinel.message},
                                               target_url=mock.sentinel.html_url)
+
+
+class TestMergeableHints(TestHandlerBase):
+    @mock.patch('nwb_extensions_webservices.webapp.job_queue')
+    @mock.patch('nwb_extensions_webservices.linting.notify_mergeable')
+    def test_not_on_the_ioloop(self, notify_mergeable, queue):
+        threads = []
+        notify_mergeable.side_effect = lambda *args: threads.append(threading.current_thread())
+        body = {'repository': {'name': 'repo_name', 'owner': {'login': 'nwb-extensions'}},
+                'pull_request': {'number': 16, 'state': 'open', 'mergeable': True}}
+        response = self.fetch('/nwb-extensions-linting/hook', method='POST', body=json.dumps(body),
+                              headers={'X-GitHub-Event': 'pull_request'})
+        self.assertEqual(response.code, 202)
+        self.assertEqual(queue.submit.call_count, 1)
+
+        webapp.bookkeeping.submit(lambda: None).result()
+        notify_mergeable.assert_called_once_with('nwb-extensions', 'repo_name', 16, True)
+        self.assertIsNot(threads[0], threading.main_thread())
+
+
+class TestDeliveries(TestHandlerBase):
+    def setUp(self):
+        super(TestDeliveries, self).setUp()
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        patcher = mock.patch.object(webapp, 'deliveries', SQLiteCache(os.path.join(tmp_dir, 'deliveries.sqlite')))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def post(self, delivery):
+        body = {'repository': {'name': 'repo_name', 'owner': {'login': 'nwb-extensions'}},
+                'pull_request': {'number': 16, 'state': 'open'}}
+        return self.fetch('/nwb-extensions-linting/hook', method='POST', body=json.dumps(body),
+                          headers={'X-GitHub-Event': 'pull_request', 'X-GitHub-Delivery': delivery})
+
+    @mock.patch('nwb_extensions_webservices.webapp.job_queue')
+    def test_redelivery_is_dropped(self, queue):
+        self.assertEqual(self.post('72d3162e-cc78-11e3-81ab-4c9367dc0958').code, 202)
+        response = self.post('72d3162e-cc78-11e3-81ab-4c9367dc0958')
+        self.assertEqual(response.code, 200)
+        self.assertEqual(response.body, b'Duplicate delivery.')
+        self.assertEqual(queue.submit.call_count, 1)
+
+        self.assertEqual(self.post('8a3d2b1c-cc78-11e3-81ab-4c9367dc0958').code, 202)
+        self.assertEqual(queue.submit.call_count, 2)
+
+    @mock.patch('nwb_extensions_webservices.webapp.job_queue')
+    def test_rejected_delivery_can_be_retried(self, queue):
+        queue.submit.side_effect = QueueFull('Job queue is full.')
+        self.assertEqual(self.post('72d3162e-cc78-11e3-81ab-4c9367dc0958').code, 503)
+        queue.submit.side_effect = None
+        self.assertEqual(self.post('72d3162e-cc78-11e3-81ab-4c9367dc0958').code, 202)
+
+
+class TestPullRequestHeads(TestHandlerBase):
+    @mock.patch('nwb_extensions_webservices.webapp.job_queue')
+    def test_remembered_from_payload(self, queue):
+        with tmp_directory() as tmp_dir, \
+                mock.patch.object(commands, 'pull_requests', SQLiteCache(os.path.join(tmp_dir, 'prs.sqlite'))):
+            body = {'action': 'synchronize',
+                    'repository': {'name': 'python-feedstock', 'owner': {'login': 'nwb-extensions'}},
+                    'pull_request': {'number': 3, 'state': 'open', 'body': None,
+                                     'head': {'user': {'login': 'some-user'}, 'repo': {'name': 'python-feedstock'},
+                                              'ref': 'patch-1', 'sha': 'abc123'}}}
+            response = self.fetch('/nwb-extensions-command/hook', method='POST', body=json.dumps(body),
+                                  headers={'X-GitHub-Event': 'pull_request'})
+            self.assertEqual(response.code, 202)
+            head = {'owner': 'some-user', 'repo': 'python-feedstock', 'ref': 'patch-1', 'sha': 'abc123'}
+            queue.submit.assert_called_once_with('pr_head', commands.remember_pull_request,
+                                                 'nwb-extensions', 'python-feedstock', 3, head,
+                                                 key=('pr_head', 'nwb-extensions', 'python-feedstock', 3))
+            # Written by the job, not while handling the webhook.
+            self.assertEqual(len(commands.pull_requests), 0)
+
+            func, args = queue.submit.call_args[0][1], queue.submit.call_args[0][2:]
+            func(*args)
+            self.assertEqual(commands.get_pull_request_head('nwb-extensions', 'python-feedstock', 3), head)
+
+
+class TestJobStatusHandler(TestHandlerBase):
+    def test_status(self):
+        response = self.fetch('/nwb-extensions-jobs/status')
+        self.assertEqual(response.code, 200)
+        stats = json.loads(response.body.decode('utf-8'))
+        self.assertIn('depth', stats)
+        self.assertIn('jobs', stats)
+
+
+class TestRateLimitHandler(TestHandlerBase):
+    def test_rate_limit(self):
+        response = self.fetch('/nwb-extensions-jobs/rate-limit')
+        self.assertEqual(response.code, 200)
+        stats = json.loads(response.body.decode('utf-8'))
+        self.assertIn('tokens', stats)
+        self.assertIn('handlers', stats)
+
+
+class TestMetricsHandler(TestHandlerBase):
+    def test_metrics(self):
+        self.fetch('/nwb-extensions-linting/hook', method='POST', body=urlencode({'a': 1}))
+        response = self.fetch('/metrics')
+        self.assertEqual(response.code, 200)
+        self.assertTrue(response.headers['Content-Type'].startswith('text/plain'))
+        text = response.body.decode('utf-8')
+        self.assertIn('nwb_webservices_http_requests_total{code="404",handler="linting",method="POST"}', text)
+        self.assertIn('nwb_webservices_http_request_seconds_bucket{handler="linting",le="+Inf"}', text)
@@ -0,0 +1,99 @@
+import os
+import time
+import unittest
+
+from nwb_extensions_webservices.workers import (
+    WorkerPool, WorkerError, WorkerTimeout, WorkerDied)
+
+
+def square(x):
+    return x * x
+
+
+def sleep_then_return(x):
+    time.sleep(x)
+    return x
+
+
+def fail(x):
+    raise ValueError(x)
+
+
+def die(x):
+    os._exit(1)
+
+
+def pid(x):
+    return os.getpid()
+
+
+def allocate(n_bytes):
+    return len(bytearray(n_bytes))
+
+
+class TestWorkerPool(unittest.TestCase):
+    def setUp(self):
+        self.pool = WorkerPool(3)
+
+    def tearDown(self):
+        self.pool.close()
+
+    def test_map_keeps_order(self):
+        self.assertEqual(self.pool.map(sleep_then_return, [0.2, 0.0, 0.1]), [0.2, 0.0, 0.1])
+        self.assertEqual(self.pool.map(square, range(10)), [x * x for x in range(10)])
+
+    def test_timeout(self):
+        start = time.time()
+        results = self.pool.map(sleep_then_return, [0.0, 30, 0.1], timeout=1)
+        self.assertLess(time.time() - start, 10)
+        self.assertEqual(results[0], 0.0)
+        self.assertIsInstance(results[1], WorkerTimeout)
+        self.assertEqual(results[2], 0.1)
+        # The pool keeps working after a worker was killed.
+        self.assertEqual(self.pool.call(square, 3), 9)
+
+    def test_errors(self):
+        with self.assertRaises(WorkerError):
+            self.pool.call(fail, 'boom')
+        with self.assertRaises(WorkerDied):
+            self.pool.call(die, None)
+        self.assertEqual(self.pool.call(square, 4), 16)
+
+    def test_prewarm_and_stats(self):
+        self.pool.start()
+        stats = self.pool.stats()
+        self.assertEqual(stats['workers'], 3)
+        self.assertEqual(stats['idle'], 3)
+        self.assertEqual(stats['started'], 3)
+        self.assertGreater(stats['startup_time_total'], 0)
+
+        self.pool.map(square, range(6))
+        stats = self.pool.stats()
+        self.assertEqual(stats['started'], 3)
+        self.assertEqual(stats['jobs'], 6)
+
+    def test_recycle_after_max_jobs(self):
+        pool = WorkerPool(1, max_jobs=2)
+        try:
+            pids = [pool.call(pid, None) for _ in range(4)]
+        finally:
+            pool.close()
+        self.assertEqual(pids[0], pids[1])
+        self.assertEqual(pids[2], pids[3])
+        self.assertNotEqual(pids[1], pids[2])
+        self.assertEqual(pool.stats()['recycled'], 2)
+
+    def test_recycle_after_max_rss(self):
+        pool = WorkerPool(1, max_rss=200 * 1024 * 1024)
+        try:
+            first = pool.call(pid, None)
+            pool.call(allocate, 300 * 1024 * 1024)
+            second = pool.call(pid, None)
+        finally:
+            pool.close()
+        self.assertNotEqual(first, second)
+        self.assertEqual(pool.stats()['recycled'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,17 +1,18 @@
-from git import Repo
-import github
 import os
+from .repo_cache import checkout_paths, clone_workspace
+from .github_client import get_organization, get_repo
 from .utils import tmp_directory
 from nwb_extensions_smithy.github import configure_github_team
 import textwrap
 from functools import lru_cache
 import conda_build.api
+from .metrics import stage
+from .workers import worker_pool
 
 
 @lru_cache(maxsize=None)
 def get_filter_out_members():
-    gh = github.Github(os.environ['GH_TOKEN'])
-    org = gh.get_organization('nwb-extensions')
+    org = get_organization('nwb-extensions')
     teams = ['staged-extensions', ]
     gh_teams = list(team for team in org.get_teams() if team.name in teams)
     members = set()
@@ -30,22 +31,50 @@ def get_handles(members):
     return ', '.join(mem)
 
 
+RENDER_TIMEOUT = int(os.environ.get('RENDER_TIMEOUT', 300))
+
+
+class RenderedMeta(object):
+    """
+    What configure_github_team gets instead of conda-build's MetaData, which
+    is rendered in a worker process and doesn't pickle: just its ``meta`` dict,
+    as returned by ``render_meta``. That is all configure_github_team reads (the
+    ``extra/recipe-maintainers``), anything else it reads has to be sent back too.
+    """
+    def __init__(self, meta):
+        self.meta = meta
+
+    def __getattr__(self, name):
+        raise AttributeError('MetaData.{} was read, but only MetaData.meta is rendered for '
+                             'configure_github_team.'.format(name))
+
+
+def render_meta(recipe_dir):
+    # Runs in a worker process, see RenderedMeta.
+    meta = conda_build.api.render(recipe_dir,
+                                  permit_undefined_jinja=True, finalize=False,
+                                  bypass_env_check=True, trim_skip=False)[0][0]
+    return meta.meta
+
+
 def update_team(org_name, repo_name, commit=None):
     if not repo_name.endswith("-feedstock"):
         return
 
-    gh = github.Github(os.environ['GH_TOKEN'])
-    org = gh.get_organization(org_name)
-    gh_repo = org.get_repo(repo_name)
+    org = get_organization(org_name)
+    gh_repo = get_repo(org_name, repo_name)
 
     with tmp_directory() as tmp_dir:
-        Repo.clone_from(gh_repo.clone_url, tmp_dir)
-        meta = conda_build.api.render(tmp_dir,
-                                      permit_undefined_jinja=True, finalize=False,
-                                      bypass_env_check=True, trim_skip=False)[0][0]
-
-        current_maintainers, prev_maintainers, new_org_members = \
-            configure_github_team(meta, gh_repo, org, repo_name.replace("-feedstock", ""))
+        with stage('team', 'clone'):
+            repo = clone_workspace(gh_repo.clone_url, tmp_dir)
+            # Rendering only reads the recipe.
+            checkout_paths(repo, ['recipe'])
+        with stage('team', 'render'):
+            meta = RenderedMeta(worker_pool.call(render_meta, tmp_dir, timeout=RENDER_TIMEOUT))
+
+        with stage('team', 'configure_team'):
+            current_maintainers, prev_maintainers, new_org_members = \
+                configure_github_team(meta, gh_repo, org, repo_name.replace("-feedstock", ""))
 
         if commit:
             message = textwrap.dedent("""
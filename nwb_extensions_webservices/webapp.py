@@ -1,62 +1,56 @@
 import os
-import tornado.escape
 import tornado.httpserver
 import tornado.ioloop
 import tornado.web
 
 import requests
-import github
-from datetime import datetime
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
 
 from . import linting, status, feedstocks_service, update_teams, commands, update_me
+from .jobs import job_queue, current_job, QueueFull
+from .workers import worker_pool
+from . import github_client, metrics
+from .rate_limit import rate_limits, token_fingerprint
+from .routing import Route, Work, route_payload
+from .store import SQLiteCache, cache_path
+from .subprocesses import rerender_executor
 
 
 def get_combined_status(token, repo_name, sha):
     # Get the combined status for the repo and sha given.
 
-    gh = github.Github(token)
-    repo = gh.get_repo(repo_slug)
+    owner, repo_name = repo_name.split('/', 1)
+    repo = github_client.get_repo(owner, repo_name, token=token)
     commit = repo.get_commit(sha)
     status = commit.get_combined_status()
 
     return status.state
 
 
-def print_rate_limiting_info_for_token(token, user):
-    # Compute some info about our GitHub API Rate Limit.
-    # Note that it doesn't count against our limit to
-    # get this info. So, we should be doing this regularly
-    # to better know when it is going to run out. Also,
-    # this will help us better understand where we are
-    # spending it and how to better optimize it.
-
-    # Get GitHub API Rate Limit usage and total
-    gh = github.Github(token)
-    gh_api_remaining = gh.get_rate_limit().rate.remaining
-    gh_api_total = gh.get_rate_limit().rate.limit
-
-    # Compute time until GitHub API Rate Limit reset
-    gh_api_reset_time = gh.get_rate_limit().rate.reset
-    gh_api_reset_time -= datetime.utcnow()
-    msg = "{user} - remaining {remaining} out of {total}.".format(remaining=gh_api_remaining,
-                                                                  total=gh_api_total,
-                                                                  user=user)
-    print("-"*len(msg))
-    print(msg)
-    print("Will reset in {time}.".format(time=gh_api_reset_time))
-
-
 def print_rate_limiting_info():
+    # Our GitHub API rate limit as of the last response we got, so printing
+    # it doesn't cost anything. Per handler usage is at /nwb-extensions-jobs/rate-limit.
 
-    d = [
-         (os.environ['GH_TOKEN'], "nwb-extensions-linter"),
-        ]
+    tokens = github_client.tokens() if 'GH_TOKEN' in os.environ else []
+    d = [(token, "nwb-extensions-linter" if i == 0 else "read only token {}".format(token_fingerprint(token)))
+         for i, token in enumerate(tokens)]
 
     print("")
     print("GitHub API Rate Limit Info:")
-    for k, v in d:
-        print_rate_limiting_info_for_token(k, v)
-    print("")
+    for token, user in d:
+        rate = rate_limits.remaining(token)
+        if rate is None:
+            continue
+        gh_api_remaining, gh_api_total, gh_api_reset = rate
+        gh_api_reset_time = timedelta(seconds=int(max(gh_api_reset - time.time(), 0)))
+        msg = "{user} - remaining {remaining} out of {total}.".format(remaining=gh_api_remaining,
+                                                                      total=gh_api_total,
+                                                                      user=user)
+        print("-"*len(msg))
+        print(msg)
+        print("Will reset in {time}.".format(time=gh_api_reset_time))
 
 
 class RegisterHandler(tornado.web.RequestHandler):
@@ -97,207 +91,318 @@ class RegisterHandler(tornado.web.RequestHandler):
         r2 = requests.post(url, json=payload, headers=headers)
 
 
-class LintingHookHandler(tornado.web.RequestHandler):
-    def post(self):
-        headers = self.request.headers
-        event = headers.get('X-GitHub-Event', None)
+# Set WEB_RUNS_JOBS=0 when job_worker processes run the jobs, the web processes then only queue them.
+# The queue is a SQLite file, so those have to run on the same host (e.g. not in other Heroku dynos).
+WEB_RUNS_JOBS = bool(int(os.environ.get('WEB_RUNS_JOBS', 1)))
 
-        if event == 'ping':
-            self.write('pong')
-        elif event == 'pull_request':
-            body = tornado.escape.json_decode(self.request.body)
-            repo_name = body['repository']['name']
-            owner = body['repository']['owner']['login']
-            pr_id = int(body['pull_request']['number'])
-            is_open = body['pull_request']['state'] == 'open'
-
-            # Only do anything if we are working with nwb-extensions, and an open PR.
-            if is_open and owner == 'nwb-extensions':
-                lint_info = linting.compute_lint_message(owner, repo_name, pr_id,
-                                                         repo_name == 'staged-extensions')
-                if lint_info:
-                    msg = linting.comment_on_pr(owner, repo_name, pr_id, lint_info['message'],
-                                                search='nwb-extensions-linting service')
-                    linting.set_pr_status(owner, repo_name, lint_info, target_url=msg.html_url)
-            # print_rate_limiting_info()  # KeyError: 'GH_TOKEN'
-        else:
-            print('Unhandled event "{}".'.format(event))
-            self.set_status(404)
-            self.write_error(404)
+LINT_RETRIES = 3
+LINT_RETRY_DELAY = 60
 
 
-class StatusHookHandler(tornado.web.RequestHandler):
-    def post(self):
-        headers = self.request.headers
-        event = headers.get('X-GitHub-Event', None)
+def lint_pr(owner, repo_name, pr_id, attempt=1):
+    try:
+        lint_info = linting.compute_lint_message(owner, repo_name, pr_id,
+                                                 repo_name == 'staged-extensions')
+    except linting.MergeabilityTimeout as err:
+        if attempt >= LINT_RETRIES:
+            print('{} Giving up.'.format(err))
+            return
+        print('{} Trying again in {}s.'.format(err, LINT_RETRY_DELAY))
+        job_queue.submit_later(LINT_RETRY_DELAY, 'lint', lint_pr, owner, repo_name, pr_id, attempt + 1,
+                               key=('lint', owner, repo_name, pr_id))
+        return
+    job = current_job()
+    if lint_info and job is not None and job.superseded:
+        # A newer push to this PR is already queued, don't post a stale comment.
+        print('Discarding lint of {}/{}#{} at {}, it was superseded.'.format(
+            owner, repo_name, pr_id, lint_info['sha']))
+        return
+    if lint_info:
+        with metrics.stage('lint', 'comment'):
+            msg = linting.comment_on_pr(owner, repo_name, pr_id, lint_info['message'],
+                                        search='nwb-extensions-linting service')
+        with metrics.stage('lint', 'status'):
+            linting.set_pr_status(owner, repo_name, lint_info, target_url=msg.html_url)
+    print_rate_limiting_info()
 
-        if event == 'ping':
-            self.write('pong')
-        elif event == 'issues' or event == 'issue_comment' or event == 'push':
-            body = tornado.escape.json_decode(self.request.body)
-            repo_full_name = body['repository']['full_name']
-
-            # Only do something if it involves the status page
-            if repo_full_name == 'nwb-extensions/status':
-                status.update()
-            print_rate_limiting_info()
-        else:
-            print('Unhandled event "{}".'.format(event))
-            self.set_status(404)
-            self.write_error(404)
 
+def update_status():
+    status.update()
+    print_rate_limiting_info()
 
-class UpdateFeedstockHookHandler(tornado.web.RequestHandler):
-    def post(self):
-        headers = self.request.headers
-        event = headers.get('X-GitHub-Event', None)
 
-        if event == 'ping':
-            self.write('pong')
-        elif event == 'push':
-            body = tornado.escape.json_decode(self.request.body)
-            repo_name = body['repository']['name']
-            owner = body['repository']['owner']['login']
-            ref = body['ref']
-            # Only do anything if we are working with nwb-extensions, and a push to master.
-            if owner == 'nwb-extensions' and ref == "refs/heads/master":
-                feedstocks_service.handle_feedstock_event(owner, repo_name)
-            print_rate_limiting_info()
-        else:
-            print('Unhandled event "{}".'.format(event))
-            self.set_status(404)
-            self.write_error(404)
+def update_feedstock(owner, repo_name):
+    feedstocks_service.handle_feedstock_event(owner, repo_name)
+    print_rate_limiting_info()
 
 
-class UpdateTeamHookHandler(tornado.web.RequestHandler):
-    def post(self):
-        headers = self.request.headers
-        event = headers.get('X-GitHub-Event', None)
+def update_team(owner, repo_name, commit):
+    update_teams.update_team(owner, repo_name, commit)
+    print_rate_limiting_info()
 
-        if event == 'ping':
-            self.write('pong')
-        elif event == 'push':
-            body = tornado.escape.json_decode(self.request.body)
-            repo_name = body['repository']['name']
-            owner = body['repository']['owner']['login']
-            ref = body['ref']
-            commit = None
-            if 'head_commit' in body:
-                commit = body['head_commit']['id']
-            # Only do anything if we are working with cnwb-extensions, and a push to master.
-            if owner == 'nwb-extensions' and ref == "refs/heads/master":
-                update_teams.update_team(owner, repo_name, commit)
-            print_rate_limiting_info()
-        else:
-            print('Unhandled event "{}".'.format(event))
-            self.set_status(404)
-            self.write_error(404)
 
+def pr_detailed_comment(owner, repo_name, pr_owner, pr_repo, pr_branch, pr_num, comment, head=None):
+    if head is not None:
+        commands.remember_pull_request(owner, repo_name, pr_num, head)
+    commands.pr_detailed_comment(owner, repo_name, pr_owner, pr_repo, pr_branch, pr_num, comment)
+    print_rate_limiting_info()
 
-class CommandHookHandler(tornado.web.RequestHandler):
-    def post(self):
-        headers = self.request.headers
-        event = headers.get('X-GitHub-Event', None)
 
-        if event == 'ping':
-            self.write('pong')
-        elif event == 'pull_request_review' or event == 'pull_request' or event == 'pull_request_review_comment':
-            body = tornado.escape.json_decode(self.request.body)
-            action = body["action"]
-            repo_name = body['repository']['name']
-            owner = body['repository']['owner']['login']
-            # Only do anything if we are working with nwb-extensions
-            if owner != 'nwb-extensions':
-                return
-            pr_repo = body['pull_request']['head']['repo']
-            pr_owner = pr_repo['owner']['login']
-            pr_repo = pr_repo['name']
-            pr_branch = body['pull_request']['head']['ref']
-            pr_num = body['pull_request']['number']
-            comment = None
-            if event == 'pull_request_review' and action != 'dismissed':
-                comment = body['review']['body']
-            elif event == 'pull_request' and action in ['opened', 'edited', 'reopened']:
-                comment = body['pull_request']['body']
-            elif event == 'pull_request_review_comment' and action != 'deleted':
-                comment = body['comment']['body']
-
-            if comment:
-                commands.pr_detailed_comment(owner, repo_name, pr_owner, pr_repo, pr_branch, pr_num, comment)
-            print_rate_limiting_info()
-
-        elif event == 'issue_comment' or event == "issues":
-            body = tornado.escape.json_decode(self.request.body)
-            action = body["action"]
-            repo_name = body['repository']['name']
-            owner = body['repository']['owner']['login']
-            issue_num = body['issue']['number']
-
-            # Only do anything if we are working with nwb-extensions
-            if owner != 'nwb-extensions':
-                return
-            pull_request = False
-            if "pull_request" in body["issue"]:
-                pull_request = True
-            if pull_request and action != 'deleted':
-                comment = body['comment']['body']
-                commands.pr_comment(owner, repo_name, issue_num, comment)
-
-            if not pull_request and action in ['opened', 'edited', 'created', 'reopened']:
-                title = body['issue']['title'] if event == "issues" else ""
-                if 'comment' in body:
-                    comment = body['comment']['body']
-                else:
-                    comment = body['issue']['body']
-                commands.issue_comment(owner, repo_name, issue_num, title, comment)
-            print_rate_limiting_info()
+def pr_comment(owner, repo_name, issue_num, comment):
+    commands.pr_comment(owner, repo_name, issue_num, comment)
+    print_rate_limiting_info()
 
-        else:
-            print('Unhandled event "{}".'.format(event))
-            self.set_status(404)
-            self.write_error(404)
 
+def issue_comment(owner, repo_name, issue_num, title, comment):
+    commands.issue_comment(owner, repo_name, issue_num, title, comment)
+    print_rate_limiting_info()
 
-class UpdateWebservicesHookHandler(tornado.web.RequestHandler):
-    def post(self):
-        headers = self.request.headers
-        event = headers.get('X-GitHub-Event', None)
 
+def update_webservices(repo_name, sha, state):
+    # Check the combined status
+    # Skip check if the current status is not a success
+    if state == 'success':
+        token = github_client.read_token()
+        state = get_combined_status(token, repo_name, sha)
+
+    # Update if the combined status is a success
+    if state == 'success':
+        update_me.update_me()
+
+    print_rate_limiting_info()
+
+
+# The X-GitHub-Delivery ids of the webhooks we have handled, so that redeliveries can be dropped.
+deliveries = SQLiteCache(cache_path('deliveries.sqlite'),
+                         max_entries=int(os.environ.get('DELIVERY_CACHE_SIZE', 100000)),
+                         ttl=int(os.environ.get('DELIVERY_CACHE_TTL', 3 * 24 * 60 * 60)))
+
+
+# For what a webhook leads to besides its job, like writes to the SQLite stores, so that the
+# handlers only decode and queue on the IOLoop.
+bookkeeping = ThreadPoolExecutor(max_workers=1)
+
+
+def in_background(func, *args):
+    def done(future):
+        if future.exception() is not None:
+            print('{} failed: {}'.format(func.__name__, future.exception()))
+    bookkeeping.submit(func, *args).add_done_callback(done)
+
+
+# Who we act for, and the checks on the payloads of each hook.
+def from_nwb_extensions(payload):
+    return payload['repository']['owner']['login'] == 'nwb-extensions'
+
+
+def is_open_pr(payload):
+    return payload['pull_request']['state'] == 'open'
+
+
+def to_master(payload):
+    return payload['ref'] == 'refs/heads/master'
+
+
+def for_status_page(payload):
+    return payload['repository']['full_name'] == 'nwb-extensions/status'
+
+
+# The jobs each hook queues, built from the (partially decoded) payload.
+def lint_job(event, payload):
+    owner = payload['repository']['owner']['login']
+    repo_name = payload['repository']['name']
+    pr_id = int(payload['pull_request']['number'])
+    mergeable = payload['pull_request'].get('mergeable')
+    if mergeable is not None:
+        # Lets a lint of this PR that is waiting for GitHub to compute mergeability stop early.
+        in_background(linting.notify_mergeable, owner, repo_name, pr_id, mergeable)
+    return Work('lint', lint_pr, (owner, repo_name, pr_id), ('lint', owner, repo_name, pr_id))
+
+
+def status_job(event, payload):
+    return Work('status', update_status, (), None)
+
+
+def feedstock_job(event, payload):
+    owner = payload['repository']['owner']['login']
+    return Work('feedstocks', update_feedstock, (owner, payload['repository']['name']), None)
+
+
+def team_job(event, payload):
+    owner = payload['repository']['owner']['login']
+    commit = None
+    if payload.get('head_commit'):
+        commit = payload['head_commit']['id']
+    return Work('teams', update_team, (owner, payload['repository']['name'], commit), None)
+
+
+def pr_command_job(event, payload):
+    owner = payload['repository']['owner']['login']
+    repo_name = payload['repository']['name']
+    pr_num = payload['pull_request']['number']
+    head = commands.pull_request_head(payload['pull_request'])
+    action = payload['action']
+    comment = None
+    if event == 'pull_request_review' and action != 'dismissed':
+        comment = payload['review']['body']
+    elif event == 'pull_request' and action in ['opened', 'edited', 'reopened']:
+        comment = payload['pull_request']['body']
+    elif event == 'pull_request_review_comment' and action != 'deleted':
+        comment = payload['comment']['body']
+    if not comment:
+        if head is None:
+            return None
+        # Just remember the head, for commands in comments on the PR.
+        return Work('pr_head', commands.remember_pull_request, (owner, repo_name, pr_num, head),
+                    ('pr_head', owner, repo_name, pr_num))
+
+    pr_repo = payload['pull_request']['head']['repo']
+    return Work('command', pr_detailed_comment,
+                (owner, repo_name, pr_repo['owner']['login'], pr_repo['name'], payload['pull_request']['head']['ref'],
+                 pr_num, comment, head),
+                None)
+
+
+def issue_command_job(event, payload):
+    action = payload['action']
+    owner = payload['repository']['owner']['login']
+    repo_name = payload['repository']['name']
+    issue_num = payload['issue']['number']
+
+    if 'pull_request' in payload['issue']:
+        if action != 'deleted':
+            return Work('command', pr_comment, (owner, repo_name, issue_num, payload['comment']['body']), None)
+    elif action in ['opened', 'edited', 'created', 'reopened']:
+        title = payload['issue']['title'] if event == "issues" else ""
+        if 'comment' in payload:
+            comment = payload['comment']['body']
+        else:
+            comment = payload['issue']['body']
+        return Work('command', issue_comment, (owner, repo_name, issue_num, title, comment), None)
+    return None
+
+
+def webservices_job(event, payload):
+    return Work('webservices', update_webservices,
+                (payload['name'], payload['sha'], payload['state']), None)
+
+
+# name, path and routes of every webhook. Payloads are only decoded as far as the routes' members,
+# and GitHub sends the members we filter on (like ``ref``) before the bulky ones (like ``commits``).
+HOOKS = [
+    ('linting', r"/nwb-extensions-linting/hook", [
+        Route(['pull_request'], ['repository', 'pull_request'], [from_nwb_extensions, is_open_pr], lint_job),
+    ]),
+    ('status', r"/nwb-extensions-status/hook", [
+        Route(['issues', 'issue_comment', 'push'], ['repository'], [for_status_page], status_job),
+    ]),
+    ('feedstocks', r"/nwb-extensions-feedstocks/hook", [
+        Route(['push'], ['ref', 'repository'], [from_nwb_extensions, to_master], feedstock_job),
+    ]),
+    ('teams', r"/nwb-extensions-teams/hook", [
+        Route(['push'], ['ref', 'repository'], [from_nwb_extensions, to_master], team_job, ['head_commit']),
+    ]),
+    ('command', r"/nwb-extensions-command/hook", [
+        Route(['pull_request'], ['action', 'repository', 'pull_request'],
+              [from_nwb_extensions], pr_command_job),
+        Route(['pull_request_review'], ['action', 'repository', 'pull_request', 'review'],
+              [from_nwb_extensions], pr_command_job),
+        Route(['pull_request_review_comment'], ['action', 'repository', 'pull_request', 'comment'],
+              [from_nwb_extensions], pr_command_job),
+        Route(['issues', 'issue_comment'], ['action', 'repository', 'issue', 'comment'],
+              [from_nwb_extensions], issue_command_job),
+    ]),
+    ('webservices', r"/nwb-extensions-webservice-update/hook", [
+        Route(['status'], ['name', 'sha', 'state'], [], webservices_job),
+        Route(['push'], [], [], None),
+    ]),
+]
+
+
+class HookHandler(tornado.web.RequestHandler):
+    def initialize(self, name, routes):
+        self.hook_name = name
+        self.routes = routes
+
+    def prepare(self):
+        # Runs before the body is even decoded, a redelivery shouldn't cost more than this.
+        self.delivery = self.request.headers.get('X-GitHub-Delivery')
+        if self.delivery and not deliveries.add(self.delivery, self.request.path):
+            print('Ignoring delivery {}, it was already handled.'.format(self.delivery))
+            self.finish('Duplicate delivery.')
+
+    def on_finish(self):
+        # If we couldn't handle it, let the redelivery through.
+        if self.delivery and self.get_status() >= 500:
+            deliveries.delete(self.delivery)
+
+    def post(self):
+        event = self.request.headers.get('X-GitHub-Event', None)
         if event == 'ping':
             self.write('pong')
-        elif event == 'status':
-            # Retrieve status request payload
-            body = tornado.escape.json_decode(self.request.body)
-            repo_name = body['name']
-            sha = body['sha']
-            state = body['state']
-
-            # Check the combined status
-            # Skip check if the current status is not a success
-            if state == 'success':
-                token = os.environ.get('GH_TOKEN')
-                state = get_combined_status(token, repo_name, sha)
-
-            # Update if the combined status is a success
-            if state == 'success':
-                update_me.update_me()
-
-            print_rate_limiting_info()
-        elif event != 'push':
+            return
+
+        routes = [route for route in self.routes if event in route.events]
+        if not routes:
             print('Unhandled event "{}".'.format(event))
             self.set_status(404)
             self.write_error(404)
+            return
+
+        for route in routes:
+            if route.job is None:
+                continue
+            payload = route_payload(route, self.request.body)
+            if payload is not None:
+                work = route.job(event, payload)
+                if work is not None:
+                    self.enqueue(work.name, work.func, *work.args, key=work.key)
+
+    def enqueue(self, name, func, *args, key=None):
+        # Hand the work to the job queue and acknowledge the delivery straight away,
+        # GitHub gives up on a webhook after 10s.
+        try:
+            job_queue.submit(name, func, *args, key=key)
+        except QueueFull as err:
+            print(err)
+            self.set_status(503)
+            self.write_error(503)
+            return
+        self.set_status(202)
+
+
+class JobStatusHandler(tornado.web.RequestHandler):
+    def get(self):
+        stats = job_queue.stats()
+        stats['worker_processes'] = worker_pool.stats()
+        stats['github_client'] = github_client.stats()
+        stats['rerender'] = rerender_executor.stats()
+        self.write(stats)
+
+
+class RateLimitHandler(tornado.web.RequestHandler):
+    def get(self):
+        self.write(rate_limits.stats())
+
+
+class MetricsHandler(tornado.web.RequestHandler):
+    def get(self):
+        self.set_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.write(metrics.registry.render())
+
+
+job_queue.add_hook(github_client.track_job)
+job_queue.add_hook(metrics.time_job)
 
 
 def create_webapp():
     application = tornado.web.Application([
-        (r"/nwb-extensions-linting/hook", LintingHookHandler),
-        (r"/nwb-extensions-status/hook", StatusHookHandler),
-        (r"/nwb-extensions-feedstocks/hook", UpdateFeedstockHookHandler),
-        (r"/nwb-extensions-teams/hook", UpdateTeamHookHandler),
-        (r"/nwb-extensions-command/hook", CommandHookHandler),
-        (r"/nwb-extensions-webservice-update/hook", UpdateWebservicesHookHandler),
-    ])
+        (path, HookHandler, {'name': name, 'routes': routes}) for name, path, routes in HOOKS
+    ] + [
+        (r"/nwb-extensions-jobs/status", JobStatusHandler),
+        (r"/nwb-extensions-jobs/rate-limit", RateLimitHandler),
+        (r"/metrics", MetricsHandler),
+    ], log_function=metrics.log_request)
     return application
 
 
@@ -315,6 +420,14 @@ def main():
         http_server.start(n_processes)
     else:
         http_server.listen(port)
+    # Each process gets its own pool and job workers, so only start them once we've forked.
+    if WEB_RUNS_JOBS:
+        worker_pool.start()
+        job_queue.start()
+    else:
+        job_queue.max_workers = 0
+        if 'DYNO' in os.environ:
+            print('WARNING: WEB_RUNS_JOBS=0 on Heroku, where no other dyno can see this dyno\'s job queue.')
     tornado.ioloop.IOLoop.instance().start()
 
 
@@ -0,0 +1,236 @@
+import multiprocessing
+import os
+import resource
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class WorkerError(Exception):
+    pass
+
+
+class WorkerTimeout(WorkerError):
+    pass
+
+
+class WorkerDied(WorkerError):
+    pass
+
+
+def _max_rss():
+    # Peak resident memory of this process in bytes (ru_maxrss is in KiB on Linux).
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _serve(conn):
+    conn.send('ready')
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:
+            break
+        if job is None:
+            break
+        func, args = job
+        try:
+            result = (True, func(*args))
+        except Exception as err:
+            result = (False, '{}: {}'.format(type(err).__name__, err))
+        conn.send(result + (_max_rss(),))
+
+
+class Worker(object):
+    def __init__(self, context):
+        start = time.time()
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_serve, args=(child_conn,))
+        self.process.daemon = True
+        self.process.start()
+        child_conn.close()
+        self.conn.recv()
+        self.startup_time = time.time() - start
+        self.jobs = 0
+        self.rss = 0
+
+    def call(self, func, args, timeout=None):
+        try:
+            self.conn.send((func, args))
+        except OSError:
+            raise WorkerDied('Worker process died (exit code {}).'.format(self.process.exitcode))
+        if not self.conn.poll(timeout):
+            raise WorkerTimeout('{} timed out after {}s.'.format(func.__name__, timeout))
+        try:
+            ok, value, self.rss = self.conn.recv()
+        except EOFError:
+            raise WorkerDied('Worker process died (exit code {}).'.format(self.process.exitcode))
+        self.jobs += 1
+        if not ok:
+            raise WorkerError(value)
+        return value
+
+    def kill(self):
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+        except (OSError, EOFError):
+            pass
+        self.process.join(5)
+        if self.process.is_alive():
+            self.kill()
+
+
+class WorkerPool(object):
+    """
+    Up to ``size`` long-lived worker processes that run functions for us.
+
+    Workers are forked from a forkserver that has already imported the
+    ``preload`` modules, so they start warm. A call that exceeds its
+    timeout (or crashes its process) only takes down the process it ran
+    in, which is killed and replaced on the next call. Workers are recycled
+    after ``max_jobs`` calls or once their peak memory exceeds ``max_rss``
+    bytes. The pool can be used from several job threads at once.
+    """
+    def __init__(self, size, preload=(), max_jobs=None, max_rss=None):
+        self.size = size
+        self.max_jobs = max_jobs
+        self.max_rss = max_rss
+        self._context = multiprocessing.get_context('forkserver')
+        if preload:
+            # Note that there is only one forkserver (and preload list) per process.
+            self._context.set_forkserver_preload(list(preload))
+        self._idle = []
+        self._count = 0
+        self._cond = threading.Condition()
+        self._stats = {'started': 0, 'recycled': 0, 'killed': 0,
+                       'startup_time_total': 0.0, 'startup_time_max': 0.0,
+                       'jobs': 0, 'job_time_total': 0.0, 'job_time_max': 0.0}
+
+    def _spawn(self):
+        worker = Worker(self._context)
+        with self._cond:
+            self._stats['started'] += 1
+            self._stats['startup_time_total'] += worker.startup_time
+            self._stats['startup_time_max'] = max(self._stats['startup_time_max'], worker.startup_time)
+        return worker
+
+    def start(self):
+        # Pre-warm the pool, so the first lint doesn't pay for the imports.
+        while True:
+            with self._cond:
+                if self._count >= self.size:
+                    return
+                self._count += 1
+            try:
+                worker = self._spawn()
+            except Exception:
+                self._release(None)
+                raise
+            self._release(worker)
+
+    def _acquire(self):
+        with self._cond:
+            while not self._idle and self._count >= self.size:
+                self._cond.wait()
+            if self._idle:
+                return self._idle.pop()
+            self._count += 1
+        try:
+            return self._spawn()
+        except Exception:
+            self._release(None)
+            raise
+
+    def _release(self, worker):
+        if worker is not None and self._worn_out(worker):
+            worker.stop()
+            with self._cond:
+                self._stats['recycled'] += 1
+            worker = None
+        with self._cond:
+            if worker is None:
+                self._count -= 1
+            else:
+                self._idle.append(worker)
+            self._cond.notify()
+
+    def _worn_out(self, worker):
+        return ((self.max_jobs and worker.jobs >= self.max_jobs) or
+                (self.max_rss and worker.rss >= self.max_rss))
+
+    def _kill(self, worker):
+        worker.kill()
+        with self._cond:
+            self._stats['killed'] += 1
+        self._release(None)
+
+    def call(self, func, *args, timeout=None):
+        worker = self._acquire()
+        start = time.time()
+        try:
+            result = worker.call(func, args, timeout=timeout)
+        except WorkerError as err:
+            if isinstance(err, (WorkerTimeout, WorkerDied)):
+                self._kill(worker)
+            else:
+                self._release(worker)
+            raise
+        except BaseException:
+            # We can't tell what state the worker is in, don't reuse it.
+            self._kill(worker)
+            raise
+        finally:
+            self._record(time.time() - start)
+        self._release(worker)
+        return result
+
+    def _record(self, job_time):
+        with self._cond:
+            self._stats['jobs'] += 1
+            self._stats['job_time_total'] += job_time
+            self._stats['job_time_max'] = max(self._stats['job_time_max'], job_time)
+
+    def map(self, func, items, timeout=None):
+        """
+        Call ``func`` on each item in parallel and return the results in order.
+
+        Items that fail have a ``WorkerError`` in place of their result.
+        """
+        items = list(items)
+        if not items:
+            return []
+
+        def run(item):
+            try:
+                return self.call(func, item, timeout=timeout)
+            except WorkerError as err:
+                return err
+
+        with ThreadPoolExecutor(max_workers=min(self.size, len(items))) as executor:
+            return list(executor.map(run, items))
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._stats)
+            stats.update(size=self.size, workers=self._count, idle=len(self._idle))
+        return stats
+
+    def close(self):
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._count -= len(idle)
+        for worker in idle:
+            worker.stop()
+
+
+# Shared by linting and update_teams. The forkserver imports nwb-extensions-smithy and
+# conda-build once, and every worker is forked from it with those imports already done.
+worker_pool = WorkerPool(
+    int(os.environ.get('WORKER_PROCESSES', 2)),
+    preload=['nwb_extensions_webservices.linting', 'nwb_extensions_webservices.update_teams'],
+    max_jobs=int(os.environ.get('WORKER_MAX_JOBS', 100)),
+    max_rss=int(os.environ.get('WORKER_MAX_RSS_MB', 1024)) * 1024 * 1024)